@@ -0,0 +1,162 @@
+# Descripcion: Codec base64 del pipeline de documentos (solo en los bordes HTTP) y contadores de uso
+import base64
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from metrics import stage
+
+# pybase64 usa SIMD (SSSE3/AVX2/NEON) cuando esta instalado; si no, se usa binascii
+try:
+    import pybase64
+    _encode = pybase64.b64encode
+    _decode = pybase64.b64decode
+    CODEC = 'pybase64'
+except ImportError:
+    _encode = base64.b64encode
+    _decode = base64.b64decode
+    CODEC = 'base64'
+
+##################################################
+###        Contadores globales y por documento  ###
+##################################################
+
+# copies: copias completas del documento en memoria (cada llamada al codec es una, mas las de count_copy)
+_FIELDS = ('encode_calls', 'decode_calls', 'encoded_bytes', 'decoded_bytes', 'copies', 'copied_bytes')
+
+class CodecCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = dict.fromkeys(_FIELDS, 0)
+
+    def add(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.values[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+_totals = CodecCounters()
+_documents = CodecCounters()
+_documents_count = 0
+_documents_lock = threading.Lock()
+_current_document = contextvars.ContextVar('codec_document', default=None)
+
+def _count(**increments):
+    _totals.add(**increments)
+    current = _current_document.get()
+    if current is not None:
+        current.add(**increments)
+
+def count_copy(nbytes):
+    """
+    Cuenta una copia completa del documento hecha fuera del codec (lectura de
+    un archivo subido o temporal, armado de un cuerpo o de una parte).
+    """
+    _count(copies=1, copied_bytes=nbytes)
+
+@contextmanager
+def count_document(label=None):
+    """
+    Cuenta las llamadas al codec hechas mientras se procesa un documento.
+    """
+    global _documents_count
+    counters = CodecCounters()
+    token = _current_document.set(counters)
+    try:
+        yield counters
+    finally:
+        _current_document.reset(token)
+        values = counters.snapshot()
+        _documents.add(**values)
+        with _documents_lock:
+            _documents_count += 1
+        logging.debug(f"Codec del documento {label}: {values}")
+
+def codec_stats():
+    with _documents_lock:
+        documents = _documents_count
+    per_document = _documents.snapshot()
+    return {
+        "codec": CODEC,
+        "totals": _totals.snapshot(),
+        "documents": documents,
+        "per_document_avg": {key: round(value / documents, 2) if documents else 0 for key, value in per_document.items()},
+    }
+
+##################################################
+###                  Codec                     ###
+##################################################
+
+def b64encode(data):
+    _count(encode_calls=1, encoded_bytes=len(data), copies=1, copied_bytes=len(data))
+    with stage('b64encode', size=len(data)):
+        return _encode(data).decode('ascii')
+
+def b64decode(text):
+    _count(decode_calls=1, decoded_bytes=len(text), copies=1, copied_bytes=len(text))
+    with stage('b64decode', size=len(text)):
+        return _decode(text)
+
+class PdfPayload:
+    """
+    Documento que viaja entre etapas. Guarda los bytes y/o su base64 y convierte
+    de forma perezosa y una sola vez, solo cuando una etapa (un borde HTTP) pide
+    la representacion que falta.
+    """
+    __slots__ = ('_raw', '_b64', '_index')
+
+    def __init__(self, raw=None, b64=None):
+        self._raw = raw
+        self._b64 = b64
+        self._index = None
+
+    @classmethod
+    def from_bytes(cls, raw):
+        return cls(raw=raw)
+
+    @classmethod
+    def from_b64(cls, b64):
+        return cls(b64=b64)
+
+    @classmethod
+    def of(cls, pdf):
+        if isinstance(pdf, cls):
+            return pdf
+        if isinstance(pdf, str):
+            return cls.from_b64(pdf)
+        return cls.from_bytes(pdf)
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            self._raw = b64decode(self._b64)
+        return self._raw
+
+    @property
+    def b64(self):
+        if self._b64 is None:
+            self._b64 = b64encode(self._raw)
+        return self._b64
+
+    @property
+    def nbytes(self):
+        # Tamaño del PDF sin decodificar el base64 (estimado a partir de su largo)
+        if self._raw is not None:
+            return len(self._raw)
+        return len(self._b64) * 3 // 4
+
+    @property
+    def footprint(self):
+        # Memoria que ocupan las representaciones ya calculadas (cache de idempotencia)
+        return len(self._raw or b'') + len(self._b64 or '')
+
+    @property
+    def index(self):
+        # Indice estructural (paginas y campos), ver pdf_index.py
+        if self._index is None:
+            from pdf_index import get_pdf_index
+            self._index = get_pdf_index(self._raw if self._raw is not None else self._b64)
+        return self._index
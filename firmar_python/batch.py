@@ -0,0 +1,173 @@
+# Descripcion: Motor de ejecucion concurrente (pool acotado de hilos) para los lotes de /firmalote
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###          Configuracion del motor           ###
+##################################################
+
+# FAIL_FAST: el primer error corta el lote. Los documentos que no empezaron no se firman y los que ya
+# estaban en vuelo terminan (un hilo no se interrumpe a mitad de DSS o del llenado) antes de responder.
+# BatchItemError.skipped lista los que no empezaron: sign marca sus numeros reservados como fill_failed.
+FAIL_FAST = 'fail_fast'
+COLLECT = 'collect'
+FAILURE_POLICIES = (FAIL_FAST, COLLECT)
+
+FIRMALOTE_MAX_WORKERS = int(os.getenv('FIRMALOTE_MAX_WORKERS', '4'))
+FIRMALOTE_FAILURE_POLICY = os.getenv('FIRMALOTE_FAILURE_POLICY', FAIL_FAST)
+# Modo ASGI: documentos de un lote en vuelo (son tareas del event loop, no hilos)
+FIRMALOTE_ASYNC_MAX_IN_FLIGHT = int(os.getenv('FIRMALOTE_ASYNC_MAX_IN_FLIGHT', '32'))
+
+# Pool unico por proceso: acota los documentos en vuelo sumando todas las peticiones
+_executor = ThreadPoolExecutor(max_workers=FIRMALOTE_MAX_WORKERS, thread_name_prefix='firmalote')
+
+class BatchItemError(Exception):
+    """
+    Error de un documento del lote; conserva su posicion y la excepcion original.
+    """
+    def __init__(self, index, error):
+        super().__init__(str(error))
+        self.index = index
+        self.error = error
+        # Indices de los documentos que no llegaron a empezar (ver FAIL_FAST)
+        self.skipped = []
+
+class BatchResult:
+    __slots__ = ('index', 'value', 'error')
+
+    def __init__(self, index, value=None, error=None):
+        self.index = index
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def resolve_failure_policy(policy):
+    policy = policy or FIRMALOTE_FAILURE_POLICY
+    if policy not in FAILURE_POLICIES:
+        raise ValueError(f"Politica de fallos invalida: {policy}")
+    return policy
+
+##################################################
+###           Ejecucion de los lotes           ###
+##################################################
+
+def iter_batch(items, worker, failure_policy=None, max_workers=None):
+    """
+    Ejecuta worker(index, item) para cada elemento y devuelve los BatchResult a
+    medida que terminan. Nunca hay mas de max_workers documentos de esta llamada
+    en vuelo. Con FAIL_FAST el primer error cancela lo que no empezo, espera a
+    los documentos en vuelo y se lanza como BatchItemError; con COLLECT el error
+    queda en el resultado del documento. Cada documento corre en una copia del
+    contexto de quien llama: las contextvars no pasan de un documento a otro.
+    """
+    failure_policy = resolve_failure_policy(failure_policy)
+    max_workers = max(1, min(max_workers or FIRMALOTE_MAX_WORKERS, FIRMALOTE_MAX_WORKERS))
+    pending = {}
+    remaining = enumerate(items)
+
+    def submit_next():
+        for index, item in remaining:
+            pending[_executor.submit(contextvars.copy_context().run, worker, index, item)] = index
+            return True
+        return False
+
+    try:
+        for _ in range(max_workers):
+            if not submit_next():
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    logging.error(f"Error en el documento {index} del lote: {str(error)}")
+                    if failure_policy == FAIL_FAST:
+                        raise BatchItemError(index, error)
+                    yield BatchResult(index, error=error)
+                else:
+                    yield BatchResult(index, value=future.result())
+                submit_next()
+    except BatchItemError as e:
+        skipped = [index for future, index in pending.items() if future.cancel()]
+        wait([future for future in pending if not future.cancelled()])
+        pending.clear()
+        e.skipped = sorted(skipped + [index for index, _ in remaining])
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+def run_batch(items, worker, failure_policy=None, max_workers=None):
+    """
+    Igual que iter_batch pero devuelve la lista completa en el orden de entrada.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    for result in iter_batch(items, worker, failure_policy, max_workers):
+        results[result.index] = result
+    return results
+
+##################################################
+###       Ejecucion asincrona (modo ASGI)      ###
+##################################################
+
+async def iter_batch_async(items, worker, failure_policy=None, max_in_flight=None):
+    """
+    Version asyncio de iter_batch para sign_asgi: worker(index, item) es una
+    corrutina y hay a lo sumo max_in_flight documentos de esta llamada en vuelo.
+    Las politicas de fallos se comportan igual que en iter_batch.
+    """
+    failure_policy = resolve_failure_policy(failure_policy)
+    max_in_flight = max(1, max_in_flight or FIRMALOTE_ASYNC_MAX_IN_FLIGHT)
+    pending = {}
+    remaining = enumerate(items)
+
+    def submit_next():
+        for index, item in remaining:
+            pending[asyncio.ensure_future(worker(index, item))] = index
+            return True
+        return False
+
+    try:
+        for _ in range(max_in_flight):
+            if not submit_next():
+                break
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                error = task.exception()
+                if error is not None:
+                    logging.error(f"Error en el documento {index} del lote: {str(error)}")
+                    if failure_policy == FAIL_FAST:
+                        raise BatchItemError(index, error)
+                    yield BatchResult(index, error=error)
+                else:
+                    yield BatchResult(index, value=task.result())
+                submit_next()
+    except BatchItemError as e:
+        # Las tareas en vuelo terminan igual que los hilos de iter_batch
+        await asyncio.gather(*pending, return_exceptions=True)
+        pending.clear()
+        e.skipped = [index for index, _ in remaining]
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def run_batch_async(items, worker, failure_policy=None, max_in_flight=None):
+    items = list(items)
+    results = [None] * len(items)
+    async for result in iter_batch_async(items, worker, failure_policy, max_in_flight):
+        results[result.index] = result
+    return results
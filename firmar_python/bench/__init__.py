@@ -0,0 +1 @@
+# Descripcion: Benchmarks del servicio de firma (se ejecutan con python -m bench.<modulo> desde firmar_python)
@@ -0,0 +1,230 @@
+# Descripcion: Compara el despliegue WSGI actual (Flask con un pool fijo de hilos, como mod_wsgi threads=5)
+# con el modo ASGI (sign_asgi bajo uvicorn) a distintas concurrencias, contra un sustituto DSS lento.
+# Cada servidor corre en su propio proceso; el cliente y el sustituto DSS corren en este.
+# Uso (desde firmar_python):
+#   python -m bench.asgi_vs_wsgi [--concurrency 5,50,200] [--requests 200] [--dss-latency 200]
+#                                [--modes sello,sello_cierre,token] [--wsgi-threads 5] [--output resultado.json]
+import argparse
+import asyncio
+import base64
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from bench.corpus import CORPUS, generate_pdf
+from bench.dss_standin import DSSStandin
+from bench.pg_standin import ProtocolBook, async_standin_connect_factory
+from bench.e2e import load_app, _git_commit, _write_server_identity
+from bench.stats import summarize
+
+SERVERS = ("wsgi", "asgi")
+# modo -> (firma_digital, firma_cierra) de /firma_init
+MODES = {
+    "sello": (False, False),
+    "sello_cierre": (False, True),
+    "token": (True, False),
+}
+
+##################################################
+###       Servidores (proceso hijo, --serve)   ###
+##################################################
+
+class BoundedWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    Como un proceso de mod_wsgi: a lo sumo 'threads' pedidos en curso; el
+    resto espera en la cola de conexiones aceptadas.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+    threads = 5
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, '_pool'):
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve(args):
+    book = ProtocolBook(latency=args.db_latency / 1000.0)
+    workdir = tempfile.mkdtemp(prefix="firmador-bench-")
+    sign, _ = load_app(workdir, args.dss_url, book)
+    if args.serve == "wsgi":
+        BoundedWSGIServer.threads = args.wsgi_threads
+        server = make_server('127.0.0.1', args.port, sign.app, server_class=BoundedWSGIServer, handler_class=QuietHandler)
+        server.serve_forever()
+    else:
+        import uvicorn
+        import db_pool
+        import dss_client
+        import sign_asgi
+        dss_client.async_dss_client.base_url = args.dss_url
+        db_pool.configure_async_db_pool(connect_fn=async_standin_connect_factory(book))
+        uvicorn.run(sign_asgi.app, host='127.0.0.1', port=args.port, log_level='warning', backlog=4096)
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(kind, dss_url, args):
+    port = _free_port()
+    command = [sys.executable, '-m', 'bench.asgi_vs_wsgi', '--serve', kind, '--port', str(port),
+               '--dss-url', dss_url, '--db-latency', str(args.db_latency), '--wsgi-threads', str(args.wsgi_threads)]
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    process = subprocess.Popen(command, cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servidor {kind} termino al arrancar (codigo {process.returncode})")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"El servidor {kind} no respondio en 60s")
+
+##################################################
+###           Carga desde el cliente           ###
+##################################################
+
+_ids = itertools.count(1)
+
+def firma_init_form(pdf_b64, cert_b64, isdigital, isclosing, workdir):
+    info = {
+        "firma_lugar": "firma1",
+        "firma_nombre": "Benchmark",
+        "firma_sello": "Juez",
+        "firma_area": "Sala I",
+        "firma_digital": isdigital,
+        "firma_cierra": isclosing,
+        "firma_lugarcierre": "cierre",
+        "id_doc": next(_ids),
+    }
+    form = {"pdf": pdf_b64, "firma_info": json.dumps(info), "file_name": os.path.join(workdir, "bench")}
+    if isdigital:
+        form["certificados"] = json.dumps({"certificate": cert_b64, "certificateChain": [cert_b64]})
+    return form
+
+async def run_load_async(url, make_form, requests, concurrency):
+    """
+    'concurrency' clientes en paralelo envian 'requests' pedidos a /firma_init;
+    cada cliente abre su conexion (como navegadores distintos).
+    """
+    import httpx
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        async with httpx.AsyncClient(base_url=url, timeout=600) as http:
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await http.post('/firma_init', data=make_form())
+                    ok = response.status_code == 200 and response.json()["status"] is True
+                except Exception:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+def run(args):
+    standin = DSSStandin(latency=args.dss_latency / 1000.0, jitter=args.dss_jitter / 1000.0, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="firmador-bench-client-")
+    try:
+        _, _, cert_b64 = _write_server_identity(workdir)
+        pages, size = CORPUS[args.document]
+        pdf_b64 = base64.b64encode(generate_pdf(pages, size, seed=args.seed)).decode('utf-8')
+        results = []
+        for kind in args.servers:
+            process, url = start_server(kind, standin.url, args)
+            try:
+                for mode in args.modes:
+                    isdigital, isclosing = MODES[mode]
+                    make_form = lambda: firma_init_form(pdf_b64, cert_b64, isdigital, isclosing, workdir)
+                    # Calentamiento (conexiones, fuentes, clave) fuera de la medicion
+                    asyncio.run(run_load_async(url, make_form, 2, 1))
+                    for concurrency in args.concurrency:
+                        summary = asyncio.run(run_load_async(url, make_form, max(args.requests, concurrency), concurrency))
+                        results.append(dict({"server": kind, "mode": mode, "concurrency": concurrency}, **summary))
+                        print(f"{kind:<5} {mode:<13} c={concurrency:<5} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms "
+                              f"p99={summary['p99_ms']:.1f}ms {summary['throughput_rps']:.1f} pedidos/s errores={summary['errors']}", file=sys.stderr)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+        return {
+            "commit": _git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": {
+                "document": args.document,
+                "requests": args.requests,
+                "concurrency": list(args.concurrency),
+                "dss_latency_ms": args.dss_latency,
+                "dss_jitter_ms": args.dss_jitter,
+                "db_latency_ms": args.db_latency,
+                "wsgi_threads": args.wsgi_threads,
+            },
+            "dss_requests": dict(standin.counts),
+            "results": results,
+        }
+    finally:
+        standin.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WSGI (hilos fijos) vs ASGI de /firma_init')
+    parser.add_argument('--servers', type=lambda value: tuple(value.split(',')), default=SERVERS)
+    parser.add_argument('--modes', type=lambda value: tuple(value.split(',')), default=("sello", "sello_cierre"))
+    parser.add_argument('--document', default='1p-10KB', choices=list(CORPUS))
+    parser.add_argument('--concurrency', type=lambda value: [int(part) for part in value.split(',')], default=[5, 50, 200])
+    parser.add_argument('--requests', type=int, default=200, help='Pedidos por medicion (al menos uno por cliente)')
+    parser.add_argument('--dss-latency', type=float, default=200.0, help='Latencia del sustituto DSS en ms')
+    parser.add_argument('--dss-jitter', type=float, default=20.0)
+    parser.add_argument('--db-latency', type=float, default=5.0, help='Latencia por documento protocolizado en ms')
+    parser.add_argument('--wsgi-threads', type=int, default=5, help='Hilos del proceso WSGI (threads de mod_wsgi)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto la salida estandar)')
+    # Uso interno: proceso hijo que sirve la aplicacion
+    parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--dss-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    unknown = [name for name in args.servers if name not in SERVERS] + [name for name in args.modes if name not in MODES]
+    if unknown:
+        parser.error(f"Valores desconocidos: {', '.join(unknown)}")
+    result = run(args)
+    if args.output:
+        with open(os.path.abspath(args.output), 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
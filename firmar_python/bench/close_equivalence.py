@@ -0,0 +1,50 @@
+# Descripcion: Verifica que el llenado de cierre en Python y el endpoint Java /pdf/update
+# dejen los mismos valores en los campos del formulario y no modifiquen los bytes firmados.
+# Uso (desde firmar_python, con el servicio Java accesible en DSS_BASE_URL):
+#   python -m bench.close_equivalence documento.pdf [--numero 123] [--fecha 18/10/2026]
+# La misma comparacion corre con pytest en tests/test_close_equivalence.py (se saltea sin el servicio Java).
+import argparse
+import base64
+import json
+import sys
+
+from dss_client import dss_post
+from pdf_close import fill_closing_fields, read_field_values
+
+def close_with_java(pdf_bytes, field_values):
+    response = dss_post('pdfUpdate', data={
+        'fileBase64': base64.b64encode(pdf_bytes).decode('utf-8'),
+        'fileName': 'equivalencia.pdf',
+        'fieldValues': json.dumps(field_values)
+    })
+    response.raise_for_status()
+    return response.content
+
+def compare(pdf_bytes, field_values):
+    python_pdf = fill_closing_fields(pdf_bytes, field_values)
+    java_pdf = close_with_java(pdf_bytes, field_values)
+    python_fields = read_field_values(python_pdf)
+    java_fields = read_field_values(java_pdf)
+    return {
+        "python_fields": python_fields,
+        "java_fields": java_fields,
+        "fields_equal": python_fields == java_fields,
+        "python_incremental": python_pdf[:len(pdf_bytes)] == pdf_bytes,
+        "java_incremental": java_pdf[:len(pdf_bytes)] == pdf_bytes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el llenado de cierre Python vs Java')
+    parser.add_argument('pdf')
+    parser.add_argument('--numero', default='123')
+    parser.add_argument('--fecha', default='18/10/2026')
+    args = parser.parse_args()
+
+    with open(args.pdf, 'rb') as f:
+        pdf_bytes = f.read()
+    result = compare(pdf_bytes, {"numero": args.numero, "fecha": args.fecha})
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    sys.exit(0 if result["fields_equal"] and result["python_incremental"] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Descripcion: Compara dos resultados de bench.e2e (por ejemplo de dos commits) escenario por escenario
+# Uso (desde firmar_python): python -m bench.compare base.json nuevo.json [--max-regression 10]
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_docs")
+
+def _key(result):
+    return (result["route"], result["firma_digital"], result["firma_cierra"], result["document"])
+
+def _change(before, after):
+    if not before:
+        return None
+    return round((after - before) / before * 100, 2)
+
+def compare(base, new):
+    """
+    Devuelve una fila por escenario presente en ambos resultados con el valor
+    anterior, el nuevo y la variacion porcentual de cada metrica.
+    """
+    base_results = {_key(result): result for result in base["results"]}
+    rows = []
+    for result in new["results"]:
+        previous = base_results.get(_key(result))
+        if previous is None:
+            continue
+        route, isdigital, isclosing, document = _key(result)
+        row = {"route": route, "firma_digital": isdigital, "firma_cierra": isclosing, "document": document}
+        for metric in METRICS:
+            row[metric] = {"base": previous[metric], "new": result[metric], "change_pct": _change(previous[metric], result[metric])}
+        rows.append(row)
+    return rows
+
+def regressions(rows, max_regression):
+    # Una latencia que sube o un throughput que baja mas de max_regression %
+    found = []
+    for row in rows:
+        for metric in METRICS:
+            change = row[metric]["change_pct"]
+            if change is None:
+                continue
+            worse = -change if metric == "throughput_docs" else change
+            if worse > max_regression:
+                found.append((row, metric, change))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara dos resultados de bench.e2e')
+    parser.add_argument('base')
+    parser.add_argument('nuevo')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='Sale con codigo 1 si alguna metrica empeora mas de este porcentaje')
+    parser.add_argument('--json', action='store_true', help='Imprime la comparacion en JSON')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.nuevo) as f:
+        new = json.load(f)
+    rows = compare(base, new)
+
+    if args.json:
+        print(json.dumps({"base_commit": base.get("commit"), "new_commit": new.get("commit"), "rows": rows}, indent=2))
+    else:
+        print(f"base {base.get('commit')} -> nuevo {new.get('commit')}")
+        for row in rows:
+            changes = " ".join(
+                f"{metric}={row[metric]['new']} ({row[metric]['change_pct']:+.1f}%)" if row[metric]['change_pct'] is not None
+                else f"{metric}={row[metric]['new']}"
+                for metric in METRICS
+            )
+            print(f"{row['route']:<12} digital={row['firma_digital']!s:<5} cierra={row['firma_cierra']!s:<5} {row['document']:<10} {changes}")
+
+    if args.max_regression is not None:
+        found = regressions(rows, args.max_regression)
+        for row, metric, change in found:
+            print(f"REGRESION {row['route']} {row['document']} digital={row['firma_digital']} cierra={row['firma_cierra']}: {metric} {change:+.1f}%", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+if __name__ == '__main__':
+    main()
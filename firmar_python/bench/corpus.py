@@ -0,0 +1,91 @@
+# Descripcion: Generador de PDFs sinteticos para benchmarks (paginas, tamaño y campos de firma/cierre)
+# Uso (desde firmar_python): python -m bench.corpus DIRECTORIO [--corpus 1p-10KB,10p-200KB | all]
+import argparse
+import os
+import random
+import pymupdf
+
+KB = 1024
+MB = 1024 * KB
+
+# nombre: (paginas, tamaño aproximado en bytes)
+CORPUS = {
+    "1p-10KB": (1, 10 * KB),
+    "10p-200KB": (10, 200 * KB),
+    "50p-2MB": (50, 2 * MB),
+    "200p-10MB": (200, 10 * MB),
+    "500p-50MB": (500, 50 * MB),
+}
+DEFAULT_CORPUS = ("1p-10KB", "10p-200KB", "50p-2MB")
+
+# Campos que usan las rutas de firma: firma del usuario, lugar del sello de cierre y datos del cierre
+SIGNATURE_FIELDS = ("firma1", "cierre")
+TEXT_FIELDS = ("numero", "fecha")
+
+def _add_fields(doc, page):
+    for i, name in enumerate(SIGNATURE_FIELDS + TEXT_FIELDS):
+        widget = pymupdf.Widget()
+        widget.field_name = name
+        widget.field_type = pymupdf.PDF_WIDGET_TYPE_TEXT
+        widget.rect = pymupdf.Rect(72, 600 + 40 * i, 305, 630 + 40 * i)
+        page.add_widget(widget)
+    # Los campos de firma se dejan vacios y sin apariencia (MuPDF incrustaria una fuente de ~30 KB)
+    for widget in page.widgets():
+        if widget.field_name in SIGNATURE_FIELDS:
+            doc.xref_set_key(widget.xref, "FT", "/Sig")
+            doc.xref_set_key(widget.xref, "AP", "null")
+            doc.xref_set_key(widget.xref, "DA", "null")
+
+def generate_pdf(pages, size, seed=0):
+    """
+    PDF de 'pages' paginas con texto y los campos de firma y cierre en la
+    ultima pagina. Se completa hasta 'size' bytes con un adjunto de datos
+    aleatorios (incompresibles), asi el tamaño no depende del texto.
+    """
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+    try:
+        for number in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Documento de prueba - pagina {number + 1} de {pages}", fontsize=12)
+            page.insert_textbox(pymupdf.Rect(72, 100, 523, 560), " ".join(f"palabra{rng.randrange(10000)}" for _ in range(150)), fontsize=9)
+        _add_fields(doc, doc[-1])
+        padding = size - len(doc.tobytes(garbage=0, deflate=True))
+        if padding > 0:
+            doc.embfile_add("relleno.bin", rng.randbytes(padding))
+        return doc.tobytes(garbage=0, deflate=True)
+    finally:
+        doc.close()
+
+def build_corpus(names=DEFAULT_CORPUS, seed=0):
+    """
+    Devuelve {nombre: bytes} para los perfiles pedidos de CORPUS.
+    """
+    return {name: generate_pdf(*CORPUS[name], seed=seed) for name in names}
+
+def parse_corpus(value):
+    if value == 'all':
+        return tuple(CORPUS)
+    names = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in names if name not in CORPUS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Perfiles desconocidos: {', '.join(unknown)} (disponibles: {', '.join(CORPUS)})")
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera el corpus de PDFs sinteticos')
+    parser.add_argument('directorio')
+    parser.add_argument('--corpus', type=parse_corpus, default=DEFAULT_CORPUS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.directorio, exist_ok=True)
+    for name in args.corpus:
+        pdf = generate_pdf(*CORPUS[name], seed=args.seed)
+        path = os.path.join(args.directorio, f"{name}.pdf")
+        with open(path, 'wb') as f:
+            f.write(pdf)
+        print(f"{path}: {len(pdf)} bytes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# Descripcion: Benchmark del cuerpo de signDocument: dict armado en cada llamada + json (como enviaba requests)
+# vs plantilla precompilada de dss_profiles.py, y lectura de la respuesta con json vs json_loads
+# Uso (desde firmar_python): python -m bench.dss_bodies [--sizes 1,20] [--iterations 20]
+import argparse
+import base64
+import json
+import os
+import time
+
+from dss_profiles import signature_profile, json_loads, JSON_LIBRARY
+from bench.stats import percentile
+
+CERTIFICATES = {
+    "certificate": base64.b64encode(os.urandom(1500)).decode('ascii'),
+    "certificateChain": [base64.b64encode(os.urandom(1500)).decode('ascii') for _ in range(2)],
+}
+IMAGE = base64.b64encode(os.urandom(12000)).decode('ascii')
+
+def legacy_sign_document_body(document_b64, signature_value, certificates, current_time, field_id, page, stamp, encoded_image):
+    # Copia del cuerpo que armaba dss_sign.sign_document_tapir_body en cada llamada
+    return {
+        "parameters": {
+            "signingCertificate": {
+                "encodedCertificate": certificates['certificate']
+            },
+            "certificateChain": [
+                {"encodedCertificate": cert} for cert in certificates['certificateChain']
+            ],
+            "detachedContents": None,
+            "asicContainerType": None,
+            "signatureLevel": "PAdES_BASELINE_B",
+            "signaturePackaging": "ENVELOPED",
+            "signatureAlgorithm": "RSA_SHA256",
+            "digestAlgorithm": "SHA256",
+            "encryptionAlgorithm": "RSA",
+            "referenceDigestAlgorithm": None,
+            "maskGenerationFunction": None,
+            "contentTimestamps": None,
+            "contentTimestampParameters": {
+                "digestAlgorithm": "SHA256",
+                "canonicalizationMethod": "http://www.w3.org/2001/10/xml-exc-c14n#",
+                "timestampContainerForm": None
+            },
+            "signatureTimestampParameters": {
+                "digestAlgorithm": "SHA256",
+                "canonicalizationMethod": "http://www.w3.org/2001/10/xml-exc-c14n#",
+                "timestampContainerForm": None
+            },
+            "archiveTimestampParameters": {
+                "digestAlgorithm": "SHA256",
+                "canonicalizationMethod": "http://www.w3.org/2001/10/xml-exc-c14n#",
+                "timestampContainerForm": None
+            },
+            "signWithExpiredCertificate": False,
+            "generateTBSWithoutCertificate": False,
+            "imageParameters": {
+                "alignmentHorizontal": None,
+                "alignmentVertical": None,
+                "imageScaling": "ZOOM_AND_CENTER",
+                "backgroundColor": None,
+                "dpi": 200,
+                "image": {
+                    "bytes": encoded_image,
+                    "name": "image.png"
+                },
+                "fieldParameters": {
+                    "fieldId": f"{field_id}",
+                    "originX": 0,
+                    "originY": 0,
+                    "width": None,
+                    "height": None,
+                    "rotation": None,
+                    "page": page
+                },
+                "textParameters": None,
+                "zoom": None
+            },
+            "signatureIdToCounterSign": None,
+            "blevelParams": {
+                "trustAnchorBPPolicy": True,
+                "signingDate": current_time,
+                "claimedSignerRoles": [f"{stamp}"],
+                "policyId": None,
+                "policyQualifier": None,
+                "policyDescription": None,
+                "policyDigestAlgorithm": None,
+                "policyDigestValue": None,
+                "policySpuri": None,
+                "commitmentTypeIndications": None,
+                "signerLocationPostalAddress": [
+                    "Congreso 180",
+                    "4000 San Miguel de Tucumán",
+                    "Tucumán",
+                    "AR"
+                ],
+                "signerLocationPostalCode": "4000",
+                "signerLocationLocality": "San Miguel de Tucumán",
+                "signerLocationStateOrProvince": "Tucumán",
+                "signerLocationCountry": "AR",
+                "signerLocationStreet": "Congreso 180"
+            }
+        },
+        "signatureValue": {
+            "algorithm": "RSA_SHA256",
+            "value": signature_value
+        },
+        "toSignDocument": {
+            "bytes": document_b64,
+            "digestAlgorithm": None,
+            "name": "document.pdf"
+        }
+    }
+
+def legacy_encode(*args):
+    # requests (json=...) serializa con json.dumps y despues codifica a UTF-8
+    return json.dumps(legacy_sign_document_body(*args), allow_nan=False).encode('utf-8')
+
+def template_encode(*args):
+    return signature_profile.sign_document(*args)
+
+def measure(fn, iterations):
+    fn()  # calentamiento
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"p50_ms": round(percentile(timings, 50) * 1000, 3), "p95_ms": round(percentile(timings, 95) * 1000, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Armado y serializacion del cuerpo de signDocument')
+    parser.add_argument('--sizes', default='1,20', help='Tamaños del PDF en MB, separados por coma')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    results = []
+    for size_mb in (float(size) for size in args.sizes.split(',')):
+        document_b64 = base64.b64encode(os.urandom(int(size_mb * 1024 * 1024))).decode('ascii')
+        call = (document_b64, "c2lnbmF0dXJl", CERTIFICATES, 1721999310000, "firma1", 3, "Juez de Camara", IMAGE)
+        response = json.dumps({"bytes": document_b64}).encode('utf-8')
+        build_before = measure(lambda: legacy_encode(*call), args.iterations)
+        build_after = measure(lambda: template_encode(*call), args.iterations)
+        parse_before = measure(lambda: json.loads(response), args.iterations)
+        parse_after = measure(lambda: json_loads(response), args.iterations)
+        results.append({
+            "pdf_mb": size_mb,
+            "body_bytes": len(template_encode(*call)),
+            "build_encode_legacy": build_before,
+            "build_encode_template": build_after,
+            "build_encode_speedup": round(build_before["p50_ms"] / build_after["p50_ms"], 2) if build_after["p50_ms"] else None,
+            "parse_json": parse_before,
+            "parse_fast": parse_after,
+            "parse_speedup": round(parse_before["p50_ms"] / parse_after["p50_ms"], 2) if parse_after["p50_ms"] else None,
+        })
+    print(json.dumps({"benchmark": "dss_bodies", "json_library": JSON_LIBRARY, "results": results}, indent=2))
+
+if __name__ == '__main__':
+    main()
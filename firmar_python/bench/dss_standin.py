@@ -0,0 +1,118 @@
+# Descripcion: Sustituto local del servicio Java (DSS REST y /pdf/update) para pruebas y benchmarks
+# No firma nada: getDataToSign devuelve un digest del documento, signDocument devuelve el mismo
+# PDF y /pdf/update devuelve el archivo recibido, con la latencia configurada por endpoint.
+import json
+import time
+import random
+import base64
+import hashlib
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from dss_client import ENDPOINTS
+
+class _StandinServer(ThreadingHTTPServer):
+    # Cola de conexiones amplia: los benchmarks abren cientos de conexiones a la vez
+    request_queue_size = 1024
+    daemon_threads = True
+
+class DSSStandin:
+    """
+    Servidor HTTP/1.1 (keep-alive) en un hilo. latency y jitter en segundos; cada
+    respuesta espera latency +/- jitter (uniforme). latencies permite fijar
+    (latency, jitter) por endpoint con los nombres de dss_client.ENDPOINTS.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, latencies=None, host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = dict(latencies or {})
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self.counts = dict.fromkeys(ENDPOINTS, 0)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def delay(self, endpoint):
+        latency, jitter = self.latencies.get(endpoint, (self.latency, self.jitter))
+        with self._random_lock:
+            offset = self._random.uniform(-jitter, jitter) if jitter else 0.0
+        return max(latency + offset, 0.0)
+
+    def count(self, endpoint):
+        with self._counts_lock:
+            self.counts[endpoint] += 1
+
+    def start(self):
+        self._server = _StandinServer((self.host, self.port), _handler_for(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def _handler_for(standin):
+    routes = {path: endpoint for endpoint, path in ENDPOINTS.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            endpoint = routes.get(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if endpoint is None:
+                self._reply(404, 'application/json', b'{"message": "endpoint desconocido"}')
+                return
+            standin.count(endpoint)
+            time.sleep(standin.delay(endpoint))
+            try:
+                content_type, payload = getattr(self, '_' + endpoint)(body)
+            except Exception as e:
+                self._reply(500, 'application/json', json.dumps({"message": str(e)}).encode())
+                return
+            self._reply(200, content_type, payload)
+
+        def _getDataToSign(self, body):
+            document = base64.b64decode(json.loads(body)['toSignDocument']['bytes'])
+            digest = hashlib.sha256(document).digest()
+            return 'application/json', json.dumps({"bytes": base64.b64encode(digest).decode('utf-8')}).encode()
+
+        def _signDocument(self, body):
+            request = json.loads(body)
+            return 'application/json', json.dumps({"bytes": request['toSignDocument']['bytes'], "name": "signed.pdf"}).encode()
+
+        def _pdfUpdate(self, body):
+            form = urllib.parse.parse_qs(body.decode('utf-8'))
+            return 'application/pdf', base64.b64decode(form['fileBase64'][0])
+
+        def _validateSignature(self, body):
+            return 'application/json', json.dumps({"SimpleReport": {"signatureOrTimestampOrEvidence": []}}).encode()
+
+        def _reply(self, status, content_type, payload):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
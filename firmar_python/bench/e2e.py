@@ -0,0 +1,248 @@
+# Descripcion: Benchmark de punta a punta de /firma_init, /firma_valor y /firmalote con sustitutos
+# locales del servicio DSS y de PostgreSQL. Reporta throughput y p50/p95/p99 por ruta, documento y
+# combinacion (firma_digital, firma_cierra) en JSON, para comparar entre commits con bench.compare.
+# Uso (desde firmar_python):
+#   python -m bench.e2e [--corpus 1p-10KB,10p-200KB | all] [--iterations 20] [--concurrency 4]
+#                       [--dss-latency 20] [--dss-jitter 5] [--db-latency 2] [--output resultado.json]
+import argparse
+import base64
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.corpus import CORPUS, DEFAULT_CORPUS, build_corpus, parse_corpus
+from bench.dss_standin import DSSStandin
+from bench.pg_standin import ProtocolBook, standin_connect_factory
+from bench.stats import run_load
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGO = "firma_cliente/images/logo_tribunal_para_tapir_250px.png"
+COMBINATIONS = [(True, True), (True, False), (False, True), (False, False)]
+ROUTES = ("firma_init", "firma_valor", "firmalote")
+
+##################################################
+###        Entorno aislado del benchmark       ###
+##################################################
+
+def _write_server_identity(workdir):
+    # Clave y certificado autofirmado propios: el benchmark no usa la identidad real del servidor
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark Firmador")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=30))
+            .sign(key, hashes.SHA256()))
+    key_path = os.path.join(workdir, "bench_key.pem")
+    cert_path = os.path.join(workdir, "bench_cert.der")
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.BestAvailableEncryption(b"bench")))
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.DER))
+    return key_path, cert_path, base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode('utf-8')
+
+def load_app(workdir, dss_url, book):
+    """
+    Prepara el directorio de trabajo (logo, fuentes, clave, registro de cierres)
+    y las variables de entorno antes de importar sign, que lee todo al importar.
+    """
+    key_path, cert_path, cert_b64 = _write_server_identity(workdir)
+    shutil.copy(os.path.join(REPO_DIR, LOGO), workdir)
+    os.symlink(os.path.join(REPO_DIR, "fonts"), os.path.join(workdir, "fonts"))
+    os.environ.update({
+        "DSS_BASE_URL": dss_url,
+        "PRIVATE_KEY_PATH": key_path,
+        "CERTIFICATE_PATH": cert_path,
+        "PRIVATE_KEY_PASSWORD": "bench",
+        "FIRMADOR_DATA_DIR": workdir,
+        "SESSION_STORE": "memory",
+    })
+    # Las fuentes y el logo se buscan en el directorio de trabajo actual
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import sign
+    import db_pool
+    import dss_client
+    # dss_client ya pudo importarse (bench.dss_standin usa sus ENDPOINTS) con la URL por defecto
+    dss_client.dss_client.base_url = dss_url
+    db_pool.configure_db_pool(connect_fn=standin_connect_factory(book), minconn=0)
+    return sign, cert_b64
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+##################################################
+###           Operaciones por ruta             ###
+##################################################
+
+class Scenario:
+    """
+    Arma los pedidos de las tres rutas para un documento y una combinacion
+    (firma_digital, firma_cierra). Cada pedido usa un id_doc nuevo para que
+    los cierres no reutilicen numeros.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, app, cert_b64, pdf_b64, isdigital, isclosing, workdir, batch_size):
+        self.app = app
+        self.certificates = {"certificate": cert_b64, "certificateChain": [cert_b64]}
+        self.pdf_b64 = pdf_b64
+        self.isdigital = isdigital
+        self.isclosing = isclosing
+        self.file_name = os.path.join(workdir, "bench")
+        self.batch_size = batch_size
+
+    def _sign_info(self):
+        return {
+            "firma_lugar": "firma1",
+            "firma_nombre": "Benchmark",
+            "firma_sello": "Juez",
+            "firma_area": "Sala I",
+            "firma_digital": self.isdigital,
+            "firma_cierra": self.isclosing,
+            "firma_lugarcierre": "cierre",
+            "id_doc": next(self._ids),
+        }
+
+    def _firma_init(self, client):
+        form = {"pdf": self.pdf_b64, "firma_info": json.dumps(self._sign_info()), "file_name": self.file_name}
+        if self.isdigital:
+            form["certificados"] = json.dumps(self.certificates)
+        start = time.perf_counter()
+        response = client.post('/firma_init', data=form)
+        return response, time.perf_counter() - start
+
+    def firma_init(self):
+        with self.app.test_client() as client:
+            response, seconds = self._firma_init(client)
+            return response.status_code == 200 and response.get_json()["status"] is True, seconds
+
+    def firma_valor(self):
+        # Solo se mide /firma_valor; el /firma_init previo prepara la sesion
+        with self.app.test_client() as client:
+            response, _ = self._firma_init(client)
+            session_id = response.get_json()["session_id"]
+            start = time.perf_counter()
+            response = client.post('/firma_valor', json={"signatureValue": "c2lnbmF0dXJl", "session_id": session_id})
+            seconds = time.perf_counter() - start
+            return response.status_code == 200 and response.get_json()["status"] is True, seconds
+
+    def firmalote(self):
+        items = []
+        for _ in range(self.batch_size):
+            info = self._sign_info()
+            items.append(dict(info, pdf=self.pdf_b64, signatureValue="c2lnbmF0dXJl"))
+        body = {"certificates": self.certificates, "pdfs": items}
+        with self.app.test_client() as client:
+            start = time.perf_counter()
+            response = client.post('/firmalote', json=body)
+            seconds = time.perf_counter() - start
+            return response.status_code == 200 and response.get_json()["status"] is True, seconds
+
+def scenario_routes(isdigital, routes):
+    # /firma_valor solo existe para la firma con token (firma_digital)
+    return [route for route in routes if route != "firma_valor" or isdigital]
+
+##################################################
+###                 Ejecucion                  ###
+##################################################
+
+def run(args):
+    book = ProtocolBook(latency=args.db_latency / 1000.0, jitter=args.db_jitter / 1000.0, seed=args.seed)
+    standin = DSSStandin(latency=args.dss_latency / 1000.0, jitter=args.dss_jitter / 1000.0, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="firmador-bench-")
+    cwd = os.getcwd()
+    try:
+        sign, cert_b64 = load_app(workdir, standin.url, book)
+        corpus = build_corpus(args.corpus, seed=args.seed)
+        results = []
+        for document, pdf in corpus.items():
+            pdf_b64 = base64.b64encode(pdf).decode('utf-8')
+            for isdigital, isclosing in COMBINATIONS:
+                scenario = Scenario(sign.app, cert_b64, pdf_b64, isdigital, isclosing, workdir, args.batch_size)
+                for route in scenario_routes(isdigital, args.routes):
+                    # Una vuelta de calentamiento (conexiones, fuentes, indices) fuera de la medicion
+                    getattr(scenario, route)()
+                    units = args.batch_size if route == "firmalote" else 1
+                    iterations = max(args.iterations // units, 1)
+                    summary = run_load(getattr(scenario, route), iterations, args.concurrency, units)
+                    results.append(dict({
+                        "route": route,
+                        "firma_digital": isdigital,
+                        "firma_cierra": isclosing,
+                        "document": document,
+                        "pdf_bytes": len(pdf),
+                        "batch_size": units,
+                    }, **summary))
+                    print(f"{route:<12} digital={isdigital!s:<5} cierra={isclosing!s:<5} {document:<10} "
+                          f"p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms p99={summary['p99_ms']:.1f}ms "
+                          f"{summary['throughput_docs']:.1f} doc/s errores={summary['errors']}", file=sys.stderr)
+        return {
+            "commit": _git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": {
+                "corpus": list(args.corpus),
+                "iterations": args.iterations,
+                "concurrency": args.concurrency,
+                "batch_size": args.batch_size,
+                "dss_latency_ms": args.dss_latency,
+                "dss_jitter_ms": args.dss_jitter,
+                "db_latency_ms": args.db_latency,
+                "db_jitter_ms": args.db_jitter,
+                "seal_engine": os.getenv("SEAL_ENGINE", "dss"),
+                "pdf_close_engine": os.getenv("PDF_CLOSE_ENGINE", "python"),
+            },
+            "dss_requests": dict(standin.counts),
+            "results": results,
+        }
+    finally:
+        os.chdir(cwd)
+        standin.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de punta a punta de las rutas de firma')
+    parser.add_argument('--corpus', type=parse_corpus, default=DEFAULT_CORPUS,
+                        help=f"Perfiles separados por coma o 'all' ({', '.join(CORPUS)})")
+    parser.add_argument('--routes', type=lambda value: tuple(value.split(',')), default=ROUTES)
+    parser.add_argument('--iterations', type=int, default=20, help='Pedidos por escenario (documentos en /firmalote)')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--dss-latency', type=float, default=20.0, help='Latencia del sustituto DSS en ms')
+    parser.add_argument('--dss-jitter', type=float, default=5.0, help='Variacion (+/- ms) de la latencia DSS')
+    parser.add_argument('--db-latency', type=float, default=2.0, help='Latencia por documento protocolizado en ms')
+    parser.add_argument('--db-jitter', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto la salida estandar)')
+    args = parser.parse_args()
+
+    unknown = [route for route in args.routes if route not in ROUTES]
+    if unknown:
+        parser.error(f"Rutas desconocidas: {', '.join(unknown)}")
+    result = run(args)
+    if args.output:
+        with open(os.path.abspath(args.output), 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Descripcion: Sustituto local de PostgreSQL para pruebas y benchmarks de la protocolizacion
+# Implementa lo minimo de DB-API que usa el servicio: SELECT 1, SELECT f_documento_protocolizar(%s) y
+# SELECT set_config('statement_timeout', ...) (se acepta y no tiene efecto)
+import re
+import time
+import asyncio
+import random
+import threading
+from datetime import datetime
+
+class ProtocolBook:
+    """
+    Libro de numeracion compartido por todas las conexiones del sustituto. Como
+    en la base real, la reserva del numero bloquea la secuencia hasta el commit
+    o rollback de la transaccion que la tomo.
+    """
+    def __init__(self, latency=0.0, fail_ids=(), jitter=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.fail_ids = set(fail_ids)
+        self.sequence_lock = threading.Lock()
+        # Para las conexiones asincronas (psycopg 3): esperar la secuencia no debe bloquear el event loop
+        self.async_sequence_lock = asyncio.Lock()
+        self.next_number = 1
+        self.numbers = {}
+
+    def delay(self):
+        # Se llama con la secuencia tomada, asi que _random no necesita otro lock
+        offset = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(self.latency + offset, 0.0)
+
+    def protocolize(self, id_doc):
+        time.sleep(self.delay())
+        return self.result(id_doc)
+
+    def result(self, id_doc):
+        if id_doc in self.fail_ids:
+            return {"status": False, "message": f"Documento {id_doc} no protocolizable"}
+        if id_doc in self.numbers:
+            numero, fecha = self.numbers[id_doc]
+        else:
+            numero, fecha = self.next_number, datetime.now().strftime("%d/%m/%Y")
+        return {"status": True, "numero": numero, "fecha": fecha, "id_doc": id_doc}
+
+class StandinCursor:
+    _protocolizar = re.compile(r"SELECT\s+f_documento_protocolizar\(%s\)(\s*,\s*f_documento_protocolizar\(%s\))*", re.IGNORECASE)
+    _set_config = re.compile(r"SELECT\s+set_config\('statement_timeout',\s*%s,\s*true\)", re.IGNORECASE)
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if self.conn.closed:
+            raise Exception("connection already closed")
+        sql = sql.strip()
+        if sql.upper() == "SELECT 1":
+            self._rows = [(1,)]
+        elif self._set_config.fullmatch(sql):
+            self._rows = [tuple(params)]
+        elif self._protocolizar.fullmatch(sql):
+            # Una columna por llamada, como SELECT f(%s), f(%s), ... en PostgreSQL
+            self._rows = [tuple(self.conn.protocolize(id_doc) for id_doc in params)]
+        else:
+            raise Exception(f"Consulta no soportada por el sustituto: {sql}")
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._rows = []
+
+class StandinConnection:
+    def __init__(self, book):
+        self.book = book
+        self.closed = 0
+        self._pending = {}
+        self._holds_sequence = False
+
+    def cursor(self):
+        return StandinCursor(self)
+
+    def protocolize(self, id_doc):
+        if not self._holds_sequence:
+            self.book.sequence_lock.acquire()
+            self._holds_sequence = True
+        result = self.book.protocolize(id_doc)
+        if result["status"] and id_doc not in self.book.numbers and id_doc not in self._pending:
+            self._pending[id_doc] = (result["numero"], result["fecha"])
+            self.book.next_number += 1
+        return result
+
+    def _release(self):
+        if self._holds_sequence:
+            self._holds_sequence = False
+            self.book.sequence_lock.release()
+
+    def commit(self):
+        self.book.numbers.update(self._pending)
+        self._pending = {}
+        self._release()
+
+    def rollback(self):
+        if self._pending:
+            self.book.next_number -= len(self._pending)
+            self._pending = {}
+        self._release()
+
+    def close(self):
+        self.rollback()
+        self.closed = 1
+
+def standin_connect_factory(book=None):
+    book = book or ProtocolBook()
+    return lambda: StandinConnection(book)
+
+##################################################
+###    Conexion asincrona (API de psycopg 3)   ###
+##################################################
+
+class AsyncStandinCursor(StandinCursor):
+    async def execute(self, sql, params=None):
+        if self.conn.closed:
+            raise Exception("connection already closed")
+        sql = sql.strip()
+        if sql.upper() == "SELECT 1":
+            self._rows = [(1,)]
+        elif self._set_config.fullmatch(sql):
+            self._rows = [tuple(params)]
+        elif self._protocolizar.fullmatch(sql):
+            self._rows = [tuple([await self.conn.protocolize(id_doc) for id_doc in params])]
+        else:
+            raise Exception(f"Consulta no soportada por el sustituto: {sql}")
+
+    async def fetchone(self):
+        return super().fetchone()
+
+    async def fetchall(self):
+        return super().fetchall()
+
+    async def close(self):
+        super().close()
+
+class AsyncStandinConnection:
+    """
+    Misma numeracion que StandinConnection con la API asincrona que usa
+    protocolizacion.reserve_numbers_async; la secuencia se toma con un asyncio.Lock.
+    """
+    def __init__(self, book):
+        self.book = book
+        self.closed = 0
+        self._pending = {}
+        self._holds_sequence = False
+
+    def cursor(self):
+        return AsyncStandinCursor(self)
+
+    async def protocolize(self, id_doc):
+        if not self._holds_sequence:
+            await self.book.async_sequence_lock.acquire()
+            self._holds_sequence = True
+        await asyncio.sleep(self.book.delay())
+        result = self.book.result(id_doc)
+        if result["status"] and id_doc not in self.book.numbers and id_doc not in self._pending:
+            self._pending[id_doc] = (result["numero"], result["fecha"])
+            self.book.next_number += 1
+        return result
+
+    def _release(self):
+        if self._holds_sequence:
+            self._holds_sequence = False
+            self.book.async_sequence_lock.release()
+
+    async def commit(self):
+        self.book.numbers.update(self._pending)
+        self._pending = {}
+        self._release()
+
+    async def rollback(self):
+        if self._pending:
+            self.book.next_number -= len(self._pending)
+            self._pending = {}
+        self._release()
+
+    async def close(self):
+        await self.rollback()
+        self.closed = 1
+
+def async_standin_connect_factory(book=None):
+    book = book or ProtocolBook()
+
+    async def connect():
+        return AsyncStandinConnection(book)
+    return connect
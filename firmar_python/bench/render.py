@@ -0,0 +1,73 @@
+# Descripcion: Benchmark de la imagen de firma: implementacion anterior vs SignatureRenderer
+# Uso (desde firmar_python): python -m bench.render [--logo RUTA] [--seconds 3]
+import argparse
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+from PIL import Image, ImageDraw, ImageFont
+
+from imagecomp import encode_image
+from createimagetostamp import SignatureRenderer, FONT_PATH
+
+TEXT = "Juan Perez\n2024-07-26 13:01:50\nJuez de Camara\nSala II"
+
+def legacy_create_signature_image(text, encoded_image, path, out_dir, width=233, height=56, scale_factor=3):
+    # Copia de la implementacion anterior (fuente, logo y dos PNG optimizados a disco por llamada)
+    high_res_width, high_res_height = width * scale_factor, height * scale_factor
+    img = Image.new('L', (int(high_res_width), int(high_res_height)), color='white')
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(FONT_PATH, int(8 * scale_factor))
+    stamp = Image.open(io.BytesIO(base64.b64decode(encoded_image)))
+    stamp.thumbnail((int(high_res_width * 0.25), int(high_res_height - 10 * scale_factor)), Image.LANCZOS)
+    stamp_x = 2 * scale_factor
+    stamp_y = (high_res_height - stamp.height) // 2
+    img.paste(stamp, (int(stamp_x), int(stamp_y)), stamp if stamp.mode == 'RGBA' else None)
+    text_start_x = stamp_x + stamp.width + 10 * int(scale_factor)
+    y_text = 5 * int(scale_factor)
+    for line in text.split('\n'):
+        draw.text((text_start_x, y_text), line, font=font, fill='black')
+        y_text += font.getbbox(line)[3] + 2 * int(scale_factor)
+
+    def save_and_encode(image, filename, dpi):
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG", optimize=True, dpi=dpi)
+        image.save(os.path.join(out_dir, filename), format='PNG', dpi=dpi, optimize=True)
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    high_res_base64 = save_and_encode(img, "high_res_image" + path + ".png", (200, 200))
+    save_and_encode(img.resize((width, height), Image.LANCZOS), "scaled_image.png", (200, 200))
+    return high_res_base64
+
+def measure(fn, seconds):
+    fn()  # calentamiento
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        count += 1
+    elapsed = time.perf_counter() - start
+    return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Renders por segundo de la imagen de firma')
+    parser.add_argument('--logo', default='firma_cliente/images/logo_tribunal_para_tapir_250px.png')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    encoded_image = encode_image(args.logo)
+    renderer = SignatureRenderer(encoded_image, debug_dir=None)
+    with tempfile.TemporaryDirectory() as out_dir:
+        before = measure(lambda: legacy_create_signature_image(TEXT, encoded_image, "token", out_dir), args.seconds)
+    after = measure(lambda: renderer.render(TEXT, "token"), args.seconds)
+    print(json.dumps({
+        "benchmark": "signature_image",
+        "legacy_renders_per_second": round(before, 1),
+        "renderer_renders_per_second": round(after, 1),
+        "speedup": round(after / before, 2),
+    }))
+
+if __name__ == '__main__':
+    main()
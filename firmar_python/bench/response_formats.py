@@ -0,0 +1,191 @@
+# Descripcion: Compara los formatos de respuesta de los PDF firmados (ver responses.py): bytes en el cable y
+# latencia de punta a punta, incluida la decodificacion en el cliente hasta tener los PDF binarios.
+# - /firma_init (sello): JSON, JSON gzip, JSON brotli y application/pdf
+# - /firmalote (sello): JSON, JSON gzip, JSON brotli, NDJSON, ZIP y multipart/mixed
+# Uso (desde firmar_python):
+#   python -m bench.response_formats [--corpus 1p-10KB,10p-200KB | all] [--iterations 20] [--batch-size 10]
+#                                    [--server wsgi|asgi] [--link-mbps 100] [--output resultado.json]
+import argparse
+import base64
+import datetime
+import email.parser
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from bench.corpus import CORPUS, DEFAULT_CORPUS, generate_pdf, parse_corpus
+from bench.dss_standin import DSSStandin
+from bench.e2e import _git_commit, _write_server_identity
+from bench.asgi_vs_wsgi import start_server, firma_init_form, SERVERS
+from bench.stats import summarize
+
+##################################################
+###        Formatos y su decodificacion        ###
+##################################################
+
+def _json_pdf(response):
+    return [base64.b64decode(response.json()["pdf"])]
+
+def _json_pdfs(response):
+    return [base64.b64decode(pdf) for pdf in response.json()["pdfs"]]
+
+def _ndjson_pdfs(response):
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return [base64.b64decode(line["pdf"]) for line in lines if line.get("pdf")]
+
+def _zip_pdfs(response):
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        return [archive.read(name) for name in archive.namelist() if name.endswith('.pdf')]
+
+def _multipart_pdfs(response):
+    head = f"Content-Type: {response.headers['Content-Type']}\r\n\r\n".encode('ascii')
+    message = email.parser.BytesParser().parsebytes(head + response.content)
+    return [part.get_payload(decode=True) for part in message.get_payload() if part.get_content_type() == 'application/pdf']
+
+# nombre -> (Accept, Accept-Encoding, decodificador)
+SINGLE_FORMATS = {
+    "json": ("application/json", "identity", _json_pdf),
+    "json_gzip": ("application/json", "gzip", _json_pdf),
+    "json_br": ("application/json", "br", _json_pdf),
+    "pdf": ("application/pdf", "identity", lambda response: [response.content]),
+}
+BATCH_FORMATS = {
+    "json": ("application/json", "identity", _json_pdfs),
+    "json_gzip": ("application/json", "gzip", _json_pdfs),
+    "json_br": ("application/json", "br", _json_pdfs),
+    "ndjson": ("application/x-ndjson", "identity", _ndjson_pdfs),
+    "zip": ("application/zip", "identity", _zip_pdfs),
+    "multipart": ("multipart/mixed", "identity", _multipart_pdfs),
+}
+
+def firmalote_body(pdfs_b64):
+    item = {
+        "firma_lugar": "firma1",
+        "firma_nombre": "Benchmark",
+        "firma_sello": "Juez",
+        "firma_area": "Sala I",
+        "firma_cierra": False,
+        "firma_lugarcierre": "cierre",
+        "firma_digital": False,
+        "signatureValue": "",
+    }
+    return {"certificates": {}, "pdfs": [dict(item, pdf=pdf_b64, id_doc=index) for index, pdf_b64 in enumerate(pdfs_b64)]}
+
+##################################################
+###                  Medicion                  ###
+##################################################
+
+def measure(http, send, decode, expected, iterations):
+    """
+    Pedidos secuenciales (una conexion keep-alive). Cuenta los bytes del cuerpo
+    tal como llegan (comprimidos si corresponde) y mide hasta tener los PDF.
+    """
+    latencies = []
+    wire_bytes = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            response = send(http)
+            pdfs = decode(response) if response.status_code == 200 else []
+        except Exception:
+            response, pdfs = None, []
+        if len(pdfs) == expected:
+            latencies.append(time.perf_counter() - started)
+            wire_bytes.append(response.num_bytes_downloaded)
+        else:
+            errors += 1
+    summary = summarize(latencies, errors, time.perf_counter() - start)
+    summary["wire_bytes"] = round(sum(wire_bytes) / len(wire_bytes)) if wire_bytes else 0
+    return summary
+
+def run(args):
+    import httpx
+    standin = DSSStandin(latency=args.dss_latency / 1000.0, jitter=args.dss_jitter / 1000.0, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="firmador-bench-client-")
+    process = None
+    try:
+        _, _, cert_b64 = _write_server_identity(workdir)
+        process, url = start_server(args.server, standin.url, args)
+        results = []
+        with httpx.Client(base_url=url, timeout=600) as http:
+            for document in args.corpus:
+                pages, size = CORPUS[document]
+                raw = generate_pdf(pages, size, seed=args.seed)
+                pdf_b64 = base64.b64encode(raw).decode('utf-8')
+                cases = [("firma_init", name, spec, 1) for name, spec in SINGLE_FORMATS.items()]
+                cases += [("firmalote", name, spec, args.batch_size) for name, spec in BATCH_FORMATS.items()]
+                # Documentos distintos en el lote: con copias iguales gzip/brotli comprimirian de mas
+                batch = [generate_pdf(pages, size, seed=args.seed + index) for index in range(args.batch_size)]
+                batch_body = json.dumps(firmalote_body([base64.b64encode(pdf).decode('utf-8') for pdf in batch]))
+                for route, name, (accept, encoding, decode), expected in cases:
+                    headers = {"Accept": accept, "Accept-Encoding": encoding}
+                    if route == "firma_init":
+                        send = lambda http: http.post('/firma_init', headers=headers,
+                                                      data=firma_init_form(pdf_b64, cert_b64, False, False, workdir))
+                    else:
+                        send = lambda http: http.post('/firmalote', headers=dict(headers, **{"Content-Type": "application/json"}),
+                                                      content=batch_body)
+                    # Calentamiento fuera de la medicion
+                    measure(http, send, decode, expected, 2)
+                    summary = measure(http, send, decode, expected, args.iterations)
+                    # Tiempo estimado de transferencia en un enlace de --link-mbps (en local el cable no cuesta)
+                    summary["link_ms"] = round(summary["wire_bytes"] * 8 / (args.link_mbps * 1e6) * 1000, 3)
+                    summary["pdf_bytes"] = len(raw) if route == "firma_init" else sum(len(pdf) for pdf in batch)
+                    results.append(dict({"document": document, "route": route, "format": name}, **summary))
+                    print(f"{document:<10} {route:<10} {name:<10} {summary['wire_bytes']:>11} bytes "
+                          f"({summary['wire_bytes'] / summary['pdf_bytes']:.2f}x) p50={summary['p50_ms']:.1f}ms "
+                          f"p95={summary['p95_ms']:.1f}ms enlace={summary['link_ms']:.1f}ms errores={summary['errors']}", file=sys.stderr)
+        return {
+            "commit": _git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": {
+                "server": args.server,
+                "corpus": list(args.corpus),
+                "iterations": args.iterations,
+                "batch_size": args.batch_size,
+                "dss_latency_ms": args.dss_latency,
+                "dss_jitter_ms": args.dss_jitter,
+                "link_mbps": args.link_mbps,
+            },
+            "results": results,
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        standin.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes en el cable y latencia por formato de respuesta')
+    parser.add_argument('--corpus', type=parse_corpus, default=DEFAULT_CORPUS[:2])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=10, help='Documentos por pedido a /firmalote')
+    parser.add_argument('--server', choices=SERVERS, default='wsgi')
+    parser.add_argument('--dss-latency', type=float, default=20.0, help='Latencia del sustituto DSS en ms')
+    parser.add_argument('--dss-jitter', type=float, default=0.0)
+    parser.add_argument('--db-latency', type=float, default=0.0)
+    parser.add_argument('--wsgi-threads', type=int, default=5)
+    parser.add_argument('--link-mbps', type=float, default=100.0, help='Ancho de banda para estimar la transferencia')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto la salida estandar)')
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.output:
+        with open(os.path.abspath(args.output), 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Descripcion: Sella un PDF con el servicio DSS y con el sellado local (pades_local) y valida
+# ambos resultados con el endpoint de validacion de DSS (formato e indicacion deben coincidir) y
+# compara byte a byte el signer-attributes-v2 (rol declarado) de las dos firmas. Si dan equivalentes
+# imprime el valor de SEAL_ENGINE_VERIFIED que habilita SEAL_ENGINE=python con esta version de pyHanko.
+# Uso (desde firmar_python, con el servicio Java accesible en DSS_BASE_URL):
+#   python -m bench.seal_equivalence documento.pdf --campo firma1 [--sello "Sello"]
+import argparse
+import base64
+import io
+import json
+import sys
+import time
+
+from dss_client import dss_post
+from dss_sign import get_data_to_sign_own, sign_document_own
+from localcerts import server_signer
+from imagecomp import encode_image
+from createimagetostamp import SignatureRenderer
+from pades_local import seal_pdf, PYHANKO_VERSION
+from pyhanko.pdf_utils.reader import PdfFileReader
+
+LOGO = "firma_cliente/images/logo_tribunal_para_tapir_250px.png"
+TEXT = "Juan Perez\n2024-07-26 13:01:50\nJuez de Camara\nSala II"
+
+def seal_with_dss(pdf_b64, current_time, field_id, stamp, image):
+    certificates = server_signer.certificates()
+    data_to_sign = get_data_to_sign_own(pdf_b64, certificates, current_time, field_id, stamp, image)["bytes"]
+    signature_value = server_signer.sign(data_to_sign)
+    return base64.b64decode(sign_document_own(pdf_b64, signature_value, certificates, current_time, field_id, stamp, image)['bytes'])
+
+def validate_with_dss(pdf_bytes):
+    response = dss_post('validateSignature', json={
+        "signedDocument": {"bytes": base64.b64encode(pdf_bytes).decode('utf-8'), "digestAlgorithm": None, "name": "sellado.pdf"},
+        "originalDocuments": None,
+        "policy": None,
+        "signatureId": None
+    })
+    response.raise_for_status()
+    report = response.json()["SimpleReport"]
+    signatures = []
+    for entry in report.get("signatureOrTimestampOrEvidence") or report.get("signatureOrTimestamp") or []:
+        signature = entry.get("Signature", entry)
+        signatures.append({
+            "format": signature.get("SignatureFormat"),
+            "indication": signature.get("Indication"),
+            "subIndication": signature.get("SubIndication"),
+        })
+    return signatures
+
+def signer_attributes(pdf_bytes):
+    # DER del signer-attributes-v2 de la ultima firma, o None si no tiene
+    signature = PdfFileReader(io.BytesIO(pdf_bytes)).embedded_signatures[-1]
+    for attr in signature.signer_info['signed_attrs']:
+        if attr['type'].native == 'signer_attributes_v2':
+            return attr['values'].dump().hex()
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el sellado DSS vs el sellado local')
+    parser.add_argument('pdf')
+    parser.add_argument('--campo', default='firma1')
+    parser.add_argument('--sello', default='Sello de prueba')
+    args = parser.parse_args()
+
+    with open(args.pdf, 'rb') as f:
+        pdf_bytes = f.read()
+    pdf_b64 = base64.b64encode(pdf_bytes).decode('utf-8')
+    image = SignatureRenderer(encode_image(LOGO)).render(TEXT, "cert")
+    current_time = int(time.time() * 1000)
+
+    start = time.perf_counter()
+    dss_pdf = seal_with_dss(pdf_b64, current_time, args.campo, args.sello, image)
+    dss_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    local_pdf = seal_pdf(pdf_bytes, server_signer, current_time, args.campo, args.sello, image)
+    local_seconds = time.perf_counter() - start
+
+    dss_report = validate_with_dss(dss_pdf)
+    local_report = validate_with_dss(local_pdf)
+    result = {
+        "dss": {"seconds": round(dss_seconds, 4), "size": len(dss_pdf), "signatures": dss_report},
+        "local": {"seconds": round(local_seconds, 4), "size": len(local_pdf), "signatures": local_report},
+        "local_incremental": local_pdf[:len(pdf_bytes)] == pdf_bytes,
+        "signer_attributes_match": signer_attributes(local_pdf) == signer_attributes(dss_pdf),
+    }
+    result["equivalent"] = (
+        result["local_incremental"]
+        and result["signer_attributes_match"]
+        and [s["format"] for s in local_report] == [s["format"] for s in dss_report]
+        and [s["indication"] for s in local_report] == [s["indication"] for s in dss_report]
+    )
+    if result["equivalent"]:
+        result["SEAL_ENGINE_VERIFIED"] = PYHANKO_VERSION
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    sys.exit(0 if result["equivalent"] else 1)
+
+if __name__ == '__main__':
+    main()
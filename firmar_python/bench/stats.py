@@ -0,0 +1,58 @@
+# Descripcion: Medicion de carga y resumen de latencias (p50/p95/p99) para los benchmarks
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(sorted_values, p):
+    # Rango mas cercano sobre valores ya ordenados
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def summarize(latencies, errors, wall_seconds, units=1):
+    """
+    Resume latencias en segundos. units es la cantidad de documentos por
+    operacion (por ejemplo el tamaño del lote) para el throughput en documentos.
+    """
+    values = sorted(latencies)
+    total = len(values) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_rps": round(len(values) / wall_seconds, 3) if wall_seconds else 0.0,
+        "throughput_docs": round(len(values) * units / wall_seconds, 3) if wall_seconds else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+def run_load(operation, iterations, concurrency, units=1):
+    """
+    Ejecuta operation() 'iterations' veces con 'concurrency' hilos. operation
+    devuelve (ok, segundos) de la parte medida, o lanza una excepcion.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        try:
+            ok, seconds = operation()
+        except Exception:
+            ok, seconds = False, None
+        with lock:
+            if ok:
+                latencies.append(seconds)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(iterations)))
+    return summarize(latencies, errors, time.perf_counter() - start, units)
@@ -0,0 +1,103 @@
+# Descripcion: Cortacircuitos (circuit breaker) hacia DSS y PostgreSQL
+# Tras BREAKER_FAILURES fallas seguidas de conexion, timeout o 5xx el circuito se abre: los pedidos fallan
+# enseguida con un error claro en lugar de esperar a un servicio caido. Pasados BREAKER_RESET_TIMEOUT
+# segundos se deja pasar una llamada de prueba (semiabierto): si sale bien se cierra, si no se vuelve a abrir.
+import os
+import time
+import logging
+import threading
+from metrics import set_breaker_state, count_breaker_rejection
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# Valor del gauge firmador_breaker_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """
+    El servicio 'target' esta marcado como caido; se reintenta en retry_after segundos.
+    """
+    def __init__(self, target, retry_after):
+        super().__init__(f"{target} no disponible (circuito abierto), reintentar en {retry_after:.0f}s")
+        self.target = target
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    def __init__(self, target, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.target = target
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = dict.fromkeys(('successes', 'failures', 'rejected', 'opened'), 0)
+        set_breaker_state(target, STATE_VALUES[CLOSED])
+
+    def _set_state(self, state):
+        if state != self._state:
+            logging.warning(f"Circuito de {self.target}: {self._state} -> {state}")
+            self._state = state
+            set_breaker_state(self.target, STATE_VALUES[state])
+
+    def before_call(self):
+        """
+        Lanza CircuitOpenError si el circuito esta abierto (o si ya hay una
+        llamada de prueba en curso en el estado semiabierto).
+        """
+        with self._lock:
+            if self.failures <= 0 or self._state == CLOSED:
+                return
+            retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+            if self._state == OPEN and retry_after <= 0:
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self._stats['rejected'] += 1
+        count_breaker_rejection(self.target)
+        raise CircuitOpenError(self.target, max(retry_after, 1))
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._consecutive = 0
+            self._trial_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._consecutive += 1
+            self._trial_in_flight = False
+            if self.failures > 0 and (self._state == HALF_OPEN or self._consecutive >= self.failures):
+                if self._state != OPEN:
+                    self._stats['opened'] += 1
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self):
+        # La llamada de prueba termino sin decidir (error del pedido, no del servicio)
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                state=self._state,
+                consecutive_failures=self._consecutive,
+                failure_threshold=self.failures,
+                reset_timeout=self.reset_timeout,
+            )
+
+dss_breaker = CircuitBreaker('dss')
+db_breaker = CircuitBreaker('db')
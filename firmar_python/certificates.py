@@ -1,44 +1,160 @@
 # Description: Módulo para extraer información de un certificado X.509
+# Los datos de cada certificado (nombre, cuil, email, vigencia y cadena) se leen una sola vez por huella
+# y quedan en un registro LRU compartido entre pedidos: /firmalote ya no vuelve a decodificar y parsear
+# el mismo certificado por cada documento del lote.
 
+import os
 import logging
 import base64
+import hashlib
 import re
+import threading
+from collections import OrderedDict
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from errors import PDFSignatureError
+from dotenv import load_dotenv
 
-###    Funcion para extraer toda la informacion de un certificado X.509 (nombre, cuil y email)    ###
-def extract_certificate_info(cert_base64):
+load_dotenv()
+
+# Certificados distintos que se recuerdan (firmantes + cadenas)
+CERT_CACHE_SIZE = int(os.getenv('CERT_CACHE_SIZE', '1024'))
+
+##################################################
+###        Registro de certificados (LRU)      ###
+##################################################
+
+class CertificateInfo:
+    __slots__ = ('fingerprint', 'common_name', 'cuil', 'email', 'not_before', 'not_after', 'chain')
+
+    def __init__(self, fingerprint, common_name, cuil, email, not_before, not_after, chain=()):
+        self.fingerprint = fingerprint
+        self.common_name = common_name
+        self.cuil = cuil
+        self.email = email
+        self.not_before = not_before
+        self.not_after = not_after
+        # Huellas de los certificados de la cadena, en el orden recibido
+        self.chain = chain
+
+def _attribute(name, oid):
+    values = name.get_attributes_for_oid(oid)
+    return values[0].value if values else None
+
+def _parse(cert_bytes):
+    cert = x509.load_der_x509_certificate(cert_bytes, default_backend())
+
+    # Buscar el CUIL en el nombre del sujeto
+    cuil = _attribute(cert.subject, x509.NameOID.SERIAL_NUMBER)
+    # Extraer email (si existe)
     try:
-        cert_bytes = base64.b64decode(cert_base64)
-        cert = x509.load_der_x509_certificate(cert_bytes, default_backend())
+        emails = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(x509.RFC822Name)
+    except x509.ExtensionNotFound:
+        emails = []
+
+    return CertificateInfo(
+        fingerprint=hashlib.sha256(cert_bytes).hexdigest(),
+        common_name=_attribute(cert.subject, x509.NameOID.COMMON_NAME),
+        cuil=re.sub(r'\D', '', cuil) if cuil is not None else None,
+        email=emails[0] if emails else None,
+        not_before=cert.not_valid_before_utc,
+        not_after=cert.not_valid_after_utc,
+    )
+
+class CertificateRegistry:
+    """
+    Datos de certificados por huella (SHA-256 del DER). El texto base64 tal como
+    llega se recuerda aparte, asi un certificado ya visto no se decodifica ni se
+    parsea de nuevo.
+    """
+    def __init__(self, max_entries=CERT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._by_fingerprint = OrderedDict()
+        self._by_text = OrderedDict()
+        self._stats = dict.fromkeys(('hits', 'misses', 'evictions'), 0)
+
+    def _remember(self, cert_base64, info):
+        with self._lock:
+            known = self._by_fingerprint.get(info.fingerprint)
+            # El mismo certificado en otro base64 (saltos de linea) comparte la entrada
+            if known is not None and (known.chain or not info.chain):
+                info = known
+            self._by_fingerprint[info.fingerprint] = info
+            self._by_fingerprint.move_to_end(info.fingerprint)
+            self._by_text[cert_base64] = info.fingerprint
+            self._by_text.move_to_end(cert_base64)
+            while len(self._by_fingerprint) > self.max_entries:
+                self._by_fingerprint.popitem(last=False)
+                self._stats['evictions'] += 1
+            while len(self._by_text) > self.max_entries:
+                self._by_text.popitem(last=False)
+        return info
 
-        # Buscar el CUIL en el nombre del sujeto
-        cuil = cert.subject.get_attributes_for_oid(x509.NameOID.SERIAL_NUMBER)[0].value
-        # Extraer nombre completo
-        common_name = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
+    def _cached(self, cert_base64):
+        with self._lock:
+            fingerprint = self._by_text.get(cert_base64)
+            info = self._by_fingerprint.get(fingerprint) if fingerprint else None
+            if info is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._by_text.move_to_end(cert_base64)
+            self._by_fingerprint.move_to_end(fingerprint)
+            return info
 
-        # Extraer email (si existe)
-        email = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(x509.RFC822Name)
+    def get(self, cert_base64, chain=None):
+        """
+        CertificateInfo del certificado en base64. chain (lista de certificados en
+        base64, como 'certificateChain') se registra junto con el primero que la trae.
+        """
+        info = self._cached(cert_base64)
+        if info is not None and (info.chain or not chain):
+            return info
+        if info is None:
+            info = _parse(base64.b64decode(cert_base64))
+        if chain:
+            try:
+                chain_fingerprints = tuple(self.get(cert).fingerprint for cert in chain)
+            except Exception as e:
+                # La cadena solo se reenvia a DSS: un certificado ilegible no impide firmar
+                logging.warning(f"No se pudo leer la cadena del certificado: {str(e)}")
+                chain_fingerprints = ()
+            info = CertificateInfo(info.fingerprint, info.common_name, info.cuil, info.email,
+                                   info.not_before, info.not_after, chain_fingerprints)
+        return self._remember(cert_base64, info)
 
-        cuil = re.sub(r'\D', '', cuil)
-        email = email[0] if email else None
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                entries=len(self._by_fingerprint),
+                hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else 0,
+                max_entries=self.max_entries,
+            )
 
-        return cuil, common_name, email
+certificate_registry = CertificateRegistry()
+
+def certificate_info(cert_base64, chain=None):
+    try:
+        return certificate_registry.get(cert_base64, chain)
     except Exception as e:
         logging.error(f"Error al extraer información del certificado: {str(e)}")
         raise PDFSignatureError("Failed to extract certificate information.")
-    
-###    Funcion para extraer el nombre de un certificado X.509    ###
-def extract_certificate_info_name(cert_base64):
-    try:
-        cert_bytes = base64.b64decode(cert_base64)
-        cert = x509.load_der_x509_certificate(cert_bytes, default_backend())
 
-        # Extraer nombre completo
-        common_name = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
+###    Funcion para extraer toda la informacion de un certificado X.509 (nombre, cuil y email)    ###
+def extract_certificate_info(cert_base64):
+    info = certificate_info(cert_base64)
+    if info.cuil is None or info.common_name is None:
+        logging.error("Error al extraer información del certificado: falta el CUIL o el nombre")
+        raise PDFSignatureError("Failed to extract certificate information.")
+    return info.cuil, info.common_name, info.email
 
-        return common_name
-    except Exception as e:
-        logging.error(f"Error al extraer información del certificado: {str(e)}")
-        raise PDFSignatureError("Failed to extract certificate information.")
\ No newline at end of file
+###    Funcion para extraer el nombre de un certificado X.509    ###
+def extract_certificate_info_name(cert_base64, chain=None):
+    common_name = certificate_info(cert_base64, chain).common_name
+    if common_name is None:
+        logging.error("Error al extraer información del certificado: falta el nombre")
+        raise PDFSignatureError("Failed to extract certificate information.")
+    return common_name
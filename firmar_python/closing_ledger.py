@@ -0,0 +1,159 @@
+# Descripcion: Registro local de numeros de cierre reservados y del estado del llenado del PDF
+# Permite reintentar un cierre cuyo llenado fallo sin volver a pedir (ni quemar) un numero.
+# Es un archivo SQLite: solo deduplica entre los procesos que lo comparten (un host o un volumen).
+# Con varios contenedores, FIRMADOR_DATA_DIR (o CLOSING_LEDGER_PATH) tiene que ser un volumen comun.
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Directorio de datos que deben sobrevivir al proceso (en el contenedor, un volumen escribible por www-data).
+# Ruta absoluta: mod_wsgi no arranca en /app sino en el home de www-data.
+FIRMADOR_DATA_DIR = os.getenv('FIRMADOR_DATA_DIR', '/var/lib/firmador')
+CLOSING_LEDGER_PATH = os.getenv('CLOSING_LEDGER_PATH', os.path.join(FIRMADOR_DATA_DIR, 'cierres.db'))
+# Los cierres completos se conservan este tiempo (segundos) para detectar reintentos
+CLOSING_LEDGER_RETENTION = float(os.getenv('CLOSING_LEDGER_RETENTION', str(7 * 24 * 3600)))
+# Segundos tras los cuales el reclamo de un proceso que murio a mitad de la numeracion deja de valer
+CLOSING_CLAIM_TTL = float(os.getenv('CLOSING_CLAIM_TTL', '300'))
+
+RESERVED = 'reserved'
+FILLED = 'filled'
+FILL_FAILED = 'fill_failed'
+
+def ledger_key(id_doc):
+    # 123 y "123" son el mismo documento: el cliente puede reenviar el id_doc con otro tipo JSON
+    return str(id_doc)
+
+class ClosingLedger:
+    def __init__(self, path=CLOSING_LEDGER_PATH, retention=CLOSING_LEDGER_RETENTION, claim_ttl=CLOSING_CLAIM_TTL):
+        self.path = path
+        self.retention = retention
+        self.claim_ttl = claim_ttl
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            if not self._initialized:
+                with self._init_lock:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS cierres ("
+                        " id_doc TEXT PRIMARY KEY, numero TEXT NOT NULL, fecha TEXT NOT NULL,"
+                        " status TEXT NOT NULL, error TEXT, updated_at REAL NOT NULL)"
+                    )
+                    # id_doc que un proceso esta numerando en este momento (ver claim)
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS reclamos ("
+                        " id_doc TEXT PRIMARY KEY, owner TEXT NOT NULL, claimed_at REAL NOT NULL)"
+                    )
+                    self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, id_docs):
+        """
+        Devuelve {id_doc: (numero, fecha, status)} de los documentos ya numerados.
+        """
+        found = {}
+        keys = {}
+        for id_doc in id_docs:
+            keys.setdefault(ledger_key(id_doc), []).append(id_doc)
+        if not keys:
+            return found
+        with self._connect() as conn:
+            placeholders = ", ".join("?" * len(keys))
+            rows = conn.execute(
+                f"SELECT id_doc, numero, fecha, status FROM cierres WHERE id_doc IN ({placeholders})",
+                tuple(keys)
+            ).fetchall()
+        for key, numero, fecha, status in rows:
+            for id_doc in keys[key]:
+                found[id_doc] = (json.loads(numero), json.loads(fecha), status)
+        return found
+
+    def record_reserved(self, reservations):
+        # reservations: iterable de (id_doc, numero, fecha)
+        now = time.time()
+        rows = [(ledger_key(id_doc), json.dumps(numero), json.dumps(fecha), RESERVED, now) for id_doc, numero, fecha in reservations]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO cierres (id_doc, numero, fecha, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("DELETE FROM cierres WHERE status = ? AND updated_at < ?", (FILLED, now - self.retention))
+            conn.execute("COMMIT")
+
+    def claim(self, id_docs, owner):
+        """
+        Reclama los id_doc para numerarlos, todos o ninguno, en una transaccion
+        BEGIN IMMEDIATE: vale entre procesos y workers que comparten el archivo.
+        Devuelve False si otro owner tiene alguno reclamado y su reclamo no vencio.
+        """
+        keys = list(dict.fromkeys(ledger_key(id_doc) for id_doc in id_docs))
+        if not keys:
+            return True
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ", ".join("?" * len(keys))
+                busy = conn.execute(
+                    f"SELECT 1 FROM reclamos WHERE id_doc IN ({placeholders}) AND owner != ? AND claimed_at > ? LIMIT 1",
+                    (*keys, owner, now - self.claim_ttl)
+                ).fetchone()
+                if busy:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.executemany(
+                    "INSERT OR REPLACE INTO reclamos (id_doc, owner, claimed_at) VALUES (?, ?, ?)",
+                    [(key, owner, now) for key in keys]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def release(self, owner):
+        # Libera los reclamos de owner (despues de record_reserved, o si la numeracion fallo)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM reclamos WHERE owner = ?", (owner,))
+
+    def _set_status(self, id_doc, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE cierres SET status = ?, error = ?, updated_at = ? WHERE id_doc = ?",
+                (status, error, time.time(), ledger_key(id_doc))
+            )
+
+    def mark_filled(self, id_doc):
+        self._set_status(id_doc, FILLED)
+
+    def mark_fill_failed(self, id_doc, error):
+        self._set_status(id_doc, FILL_FAILED, error)
+
+    def pending(self):
+        # Documentos con numero reservado cuyo PDF todavia no se lleno
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id_doc, numero, fecha, status, error FROM cierres WHERE status != ? ORDER BY updated_at",
+                (FILLED,)
+            ).fetchall()
+        return [
+            {"id_doc": id_doc, "numero": json.loads(numero), "fecha": json.loads(fecha), "status": status, "error": error}
+            for id_doc, numero, fecha, status, error in rows
+        ]
+
+closing_ledger = ClosingLedger()
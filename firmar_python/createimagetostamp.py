@@ -1,60 +1,105 @@
 from PIL import Image, ImageDraw, ImageFont
 import io
+import os
 import base64
+import logging
+import threading
+from dotenv import load_dotenv
+from metrics import stage
+from tracing import span
+
+load_dotenv()
+
+FONT_PATH = "./fonts/PTSerif-Regular.ttf"
+# Perfil PNG: compresion zlib 0-9 sin la pasada extra de 'optimize'
+SIGNATURE_PNG_COMPRESS_LEVEL = int(os.getenv('SIGNATURE_PNG_COMPRESS_LEVEL', '1'))
+SIGNATURE_PNG_OPTIMIZE = os.getenv('SIGNATURE_PNG_OPTIMIZE', 'false').lower() in ('1', 'true', 'yes')
+# Solo para depuracion: si se define, cada imagen generada tambien se escribe en este directorio
+SIGNATURE_IMAGE_DEBUG_DIR = os.getenv('SIGNATURE_IMAGE_DEBUG_DIR')
+
+class SignatureRenderer:
+    """
+    Genera la imagen de firma. Se crea una vez al iniciar: mantiene la fuente,
+    el logo ya escalado y un lienzo base por tamaño; en cada llamada solo se
+    dibujan las lineas de texto y se codifica una vez en memoria.
+    """
+    def __init__(self, encoded_image, font_path=FONT_PATH, dpi=(200, 200),
+                 compress_level=SIGNATURE_PNG_COMPRESS_LEVEL, optimize=SIGNATURE_PNG_OPTIMIZE,
+                 debug_dir=SIGNATURE_IMAGE_DEBUG_DIR):
+        self.stamp = Image.open(io.BytesIO(base64.b64decode(encoded_image)))
+        self.stamp.load()
+        self.font_path = font_path
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self.optimize = optimize
+        self.debug_dir = debug_dir
+        self._fonts = {}
+        self._canvases = {}
+        self._lock = threading.Lock()
+
+    def _font(self, scale_factor):
+        font = self._fonts.get(scale_factor)
+        if font is None:
+            try:
+                font = ImageFont.truetype(self.font_path, int(8 * scale_factor))
+            except IOError:
+                font = ImageFont.load_default()
+                logging.warning("Using default font. Text size may not be as expected.")
+            self._fonts[scale_factor] = font
+        return font
+
+    def _canvas(self, width, height, scale_factor):
+        key = (width, height, scale_factor)
+        canvas = self._canvases.get(key)
+        if canvas is None:
+            # Lienzo blanco en alta resolucion con el logo ya pegado a la izquierda
+            high_res_width, high_res_height = width * scale_factor, height * scale_factor
+            img = Image.new('L', (int(high_res_width), int(high_res_height)), color='white')
+
+            stamp = self.stamp.copy()
+            stamp_max_width = high_res_width * 0.25  # Up to 25% of the width for the stamp
+            stamp_max_height = high_res_height - 10 * scale_factor  # 10 pixels padding
+            stamp.thumbnail((int(stamp_max_width), int(stamp_max_height)), Image.LANCZOS)
+
+            stamp_x = 2 * scale_factor  # 2 pixels padding from left edge (scaled)
+            stamp_y = (high_res_height - stamp.height) // 2
+            img.paste(stamp, (int(stamp_x), int(stamp_y)), stamp if stamp.mode == 'RGBA' else None)
+
+            text_start_x = stamp_x + stamp.width + 10 * int(scale_factor)  # 10 pixels padding between stamp and text
+            canvas = (img, text_start_x)
+            self._canvases[key] = canvas
+        return canvas
+
+    def render(self, text, path, width=233, height=56, scale_factor=3):
+        with stage('signature_image'), span('signature_image'):
+            with self._lock:
+                base, text_start_x = self._canvas(width, height, scale_factor)
+                font = self._font(scale_factor)
+                img = base.copy()
+                draw = ImageDraw.Draw(img)
+                y_text = 5 * int(scale_factor)  # Start 5 pixels from top edge (scaled)
+                for line in text.split('\n'):
+                    draw.text((text_start_x, y_text), line, font=font, fill='black')
+                    y_text += font.getbbox(line)[3] + 2 * int(scale_factor)  # Move to next line (font height + 2 pixels, scaled)
+
+            buffered = io.BytesIO()
+            img.save(buffered, format="PNG", dpi=self.dpi, compress_level=self.compress_level, optimize=self.optimize)
+            png_bytes = buffered.getvalue()
+            if self.debug_dir:
+                with open(os.path.join(self.debug_dir, "high_res_image" + path + ".png"), 'wb') as f:
+                    f.write(png_bytes)
+            return base64.b64encode(png_bytes).decode('utf-8')
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+def get_signature_renderer(encoded_image):
+    with _renderers_lock:
+        renderer = _renderers.get(encoded_image)
+        if renderer is None:
+            renderer = SignatureRenderer(encoded_image)
+            _renderers[encoded_image] = renderer
+        return renderer
 
 def create_signature_image(text, encoded_image, path, width=233, height=56, scale_factor=3):
-    # Create a new image with white background at higher resolution
-    high_res_width, high_res_height = width * scale_factor, height * scale_factor
-    img = Image.new('L', (int(high_res_width), int(high_res_height)), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    # Try to use the PTSerif font, falling back to default if not available
-    try:
-        font = ImageFont.truetype("./fonts/PTSerif-Regular.ttf", int(8 * scale_factor))
-    except IOError:
-        font = ImageFont.load_default()
-        print("Warning: Using default font. Text size may not be as expected.")
-    
-    # Decode and open the stamp image
-    stamp_data = base64.b64decode(encoded_image)
-    stamp = Image.open(io.BytesIO(stamp_data))
-
-    # Calculate new dimensions for the stamp image to fit within the final dimensions
-    stamp_max_width = high_res_width * 0.25  # Up to 25% of the width for the stamp
-    stamp_max_height = high_res_height - 10 * scale_factor  # 10 pixels padding
-    stamp.thumbnail((int(stamp_max_width), int(stamp_max_height)), Image.LANCZOS)
-    
-    # Calculate position to paste stamp (left-aligned)
-    stamp_x = 2 * scale_factor  # 2 pixels padding from left edge (scaled)
-    stamp_y = (high_res_height - stamp.height) // 2
-
-    # Paste stamp image
-    img.paste(stamp, (int(stamp_x), int(stamp_y)), stamp if stamp.mode == 'RGBA' else None)
-    
-    # Calculate the starting point for the text, adjusted for the stamp width and padding
-    text_start_x = stamp_x + stamp.width + 10 * int(scale_factor)  # 10 pixels padding between stamp and text
-    y_text = 5 * int(scale_factor)  # Start 5 pixels from top edge (scaled)
-    
-    # Split text into lines and draw each line
-    lines = text.split('\n')
-    for line in lines:
-        draw.text((text_start_x, y_text), line, font=font, fill='black')
-        y_text += font.getbbox(line)[3] + 2 * int(scale_factor)  # Move to next line (font height + 2 pixels, scaled)
-    
-    # Function to save and encode image
-    def save_and_encode(image, filename, dpi):
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG", optimize=True, dpi=dpi)
-        image.save(filename, format='PNG', dpi=dpi, optimize=True)
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
-    
-    # Save and encode high resolution image
-    high_res_base64 = save_and_encode(img, "high_res_image" + path + ".png", (200, 200))
-    
-    # Scale down the image
-    img_scaled = img.resize((width, height), Image.LANCZOS)
-    
-    # Save and encode scaled down image
-    scaled_base64 = save_and_encode(img_scaled, "scaled_image.png", (200, 200))
-    
-    return high_res_base64
\ No newline at end of file
+    return get_signature_renderer(encoded_image).render(text, path, width, height, scale_factor)
@@ -0,0 +1,369 @@
+# Descripcion: Pool de conexiones PostgreSQL compartido por el proceso (protocolizacion de documentos)
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###          Configuracion del pool            ###
+##################################################
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+# Tiempo maximo (segundos) esperando una conexion libre
+DB_POOL_MAX_WAIT = float(os.getenv('DB_POOL_MAX_WAIT', '5'))
+# Conexiones ociosas por mas de este tiempo se verifican con SELECT 1 al retirarlas
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', '30'))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+# Tope (segundos) de cada sentencia, incluida la espera por la fila de la numeracion; 0 sin tope
+DB_STATEMENT_TIMEOUT = float(os.getenv('DB_STATEMENT_TIMEOUT', '30'))
+
+def _session_options():
+    return f"-c statement_timeout={int(DB_STATEMENT_TIMEOUT * 1000)}"
+
+def postgres_connect():
+    import psycopg2
+    return psycopg2.connect(
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT'),
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        options=_session_options()
+    )
+
+async def postgres_connect_async():
+    # psycopg 3: misma API que psycopg2 (cursor, execute, fetchone, commit, rollback) con await
+    import psycopg
+    return await psycopg.AsyncConnection.connect(
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT'),
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        options=_session_options()
+    )
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """
+    Pool seguro entre hilos con tamaño minimo/maximo, verificacion de salud al
+    retirar una conexion y espera acotada. connect_fn puede ser cualquier
+    funcion que devuelva una conexion DB-API (por ejemplo un sustituto local en pruebas).
+    """
+    def __init__(self, connect_fn=postgres_connect, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 max_wait=DB_POOL_MAX_WAIT, healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE):
+        self.connect_fn = connect_fn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_wait = max_wait
+        self.healthcheck_idle = healthcheck_idle
+        self._cond = threading.Condition()
+        self._idle = []  # (conexion, momento en que se devolvio)
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _is_healthy(self, conn, idle_since):
+        if getattr(conn, 'closed', 0):
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Conexion a la base de datos descartada: {str(e)}")
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout=None):
+        # timeout: espera maxima de esta llamada (por ejemplo lo que queda del plazo del pedido)
+        max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        start = time.monotonic()
+        deadline = start + max_wait
+        with self._cond:
+            self._waiting += 1
+            try:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No hay conexiones libres tras {max_wait:.3g}s")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn, idle_since = None, None
+                    self._size += 1
+                self._in_use += 1
+            finally:
+                self._waiting -= 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        # La verificacion y la conexion nueva se hacen fuera del lock
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self.connect_fn()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard:
+            try:
+                # Nunca devolver al pool una transaccion abierta
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or getattr(conn, 'closed', 0):
+                self._size -= 1
+                self._discarded += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            discard = bool(getattr(conn, 'closed', 0))
+            raise
+        finally:
+            self.putconn(conn, discard)
+
+    def fill(self):
+        # Abre las conexiones minimas; los errores se registran y no impiden arrancar
+        with self._cond:
+            missing = self.minconn - self._size
+            self._size += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            try:
+                conn = self.connect_fn()
+            except Exception as e:
+                logging.warning(f"No se pudo abrir la conexion minima del pool: {str(e)}")
+                with self._cond:
+                    self._size -= 1
+                continue
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_total": round(self._wait_time_total, 6),
+                "wait_time_max": round(self._wait_time_max, 6),
+            }
+
+##################################################
+###           Pool unico del proceso           ###
+##################################################
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_db_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        pool = _pool = ConnectionPool()
+    # Las conexiones minimas se abren fuera del lock: con la base caida cada una espera DB_CONNECT_TIMEOUT
+    # y los demas pedidos no deben quedar bloqueados detras (el pool ya abre conexiones a demanda)
+    pool.fill()
+    return pool
+
+def configure_db_pool(**kwargs):
+    """
+    Reemplaza el pool del proceso (por ejemplo con connect_fn de un sustituto local).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(**kwargs)
+        return _pool
+
+def get_db_pool_stats():
+    return get_db_pool().stats()
+
+##################################################
+###       Pool asincrono (modo ASGI)           ###
+##################################################
+
+class AsyncConnectionPool:
+    """
+    Version asyncio de ConnectionPool para sign_asgi: esperar una conexion libre
+    no ocupa un hilo. connect_fn es una corrutina que devuelve una conexion con la
+    API asincrona de psycopg 3. Debe usarse siempre desde el mismo event loop.
+    """
+    def __init__(self, connect_fn=postgres_connect_async, maxconn=DB_POOL_MAX, max_wait=DB_POOL_MAX_WAIT):
+        self.connect_fn = connect_fn
+        self.maxconn = maxconn
+        self.max_wait = max_wait
+        self._cond = asyncio.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    async def _close_quietly(self, conn):
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def getconn(self, timeout=None):
+        max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        start = time.monotonic()
+        async with self._cond:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._cond.wait_for(lambda: self._idle or self._size < self.maxconn), max_wait)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise PoolTimeout(f"No hay conexiones libres tras {max_wait:.3g}s")
+            finally:
+                self._waiting -= 1
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = None
+                self._size += 1
+            self._in_use += 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            if conn is not None and conn.closed:
+                await self._close_quietly(conn)
+                self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = await self.connect_fn()
+            return conn
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    async def putconn(self, conn, discard=False):
+        if not discard:
+            try:
+                # Nunca devolver al pool una transaccion abierta
+                await conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            await self._close_quietly(conn)
+        async with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    async def close(self):
+        async with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            await self._close_quietly(conn)
+
+    def stats(self):
+        return {
+            "size": self._size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "waiting": self._waiting,
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "discarded": self._discarded,
+            "wait_time_total": round(self._wait_time_total, 6),
+            "wait_time_max": round(self._wait_time_max, 6),
+        }
+
+_async_pool = None
+
+def get_async_db_pool():
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool()
+    return _async_pool
+
+def configure_async_db_pool(**kwargs):
+    """
+    Reemplaza el pool asincrono del proceso (por ejemplo con un sustituto local).
+    """
+    global _async_pool
+    _async_pool = AsyncConnectionPool(**kwargs)
+    return _async_pool
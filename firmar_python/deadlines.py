@@ -0,0 +1,107 @@
+# Descripcion: Plazo (deadline) de cada pedido, repartido entre las llamadas a DSS y a la base
+# Cada pedido recibe un presupuesto de tiempo: la cabecera X-Request-Timeout (segundos) o el valor por
+# defecto de la ruta, acotado por REQUEST_DEADLINE_MAX. Los timeouts de DSS, la espera de una conexion
+# del pool y el statement_timeout de PostgreSQL se recortan a lo que queda del plazo, y entre etapas se
+# verifica que quede tiempo: un DSS colgado o una fila bloqueada ya no retienen un hilo de mod_wsgi.
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from metrics import count_timeout
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###          Configuracion de los plazos       ###
+##################################################
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+# Segundos por defecto para /firma_init y /firma_valor, y para /firmalote
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '120'))
+REQUEST_DEADLINE_BATCH = float(os.getenv('REQUEST_DEADLINE_BATCH', '600'))
+# Tope para el valor que pide el cliente
+REQUEST_DEADLINE_MAX = float(os.getenv('REQUEST_DEADLINE_MAX', '900'))
+
+BATCH_ROUTES = ('/firmalote',)
+
+class DeadlineExceeded(Exception):
+    """
+    Se agoto el plazo del pedido antes (o durante) la etapa indicada.
+    """
+    def __init__(self, where):
+        super().__init__(f"Plazo del pedido agotado en {where}")
+        self.where = where
+
+# Momento (time.monotonic) en que vence el pedido en curso, o None sin plazo
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+##################################################
+###               Plazo del pedido             ###
+##################################################
+
+def request_deadline(headers, route):
+    """
+    Segundos de plazo del pedido: la cabecera X-Request-Timeout si es valida
+    (acotada por REQUEST_DEADLINE_MAX) o el valor por defecto de la ruta.
+    """
+    default = REQUEST_DEADLINE_BATCH if route in BATCH_ROUTES else REQUEST_DEADLINE
+    value = headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            seconds = float(value)
+        except ValueError:
+            return default
+        if seconds > 0:
+            return min(seconds, REQUEST_DEADLINE_MAX)
+    return default
+
+def start_deadline(seconds):
+    # Devuelve el token para end_deadline; seconds <= 0 deja el pedido sin plazo
+    return _deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+def current_deadline():
+    # Para continuar el plazo en otro hilo (documentos de un lote), como tracing.capture_context
+    return _deadline.get()
+
+@contextmanager
+def use_deadline(deadline):
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    # Segundos que quedan del plazo (puede ser negativo), o None sin plazo
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def expired():
+    # True si el pedido tiene plazo y ya vencio (un timeout que se debe al plazo, no al servicio)
+    left = remaining()
+    return left is not None and left <= 0
+
+def check_deadline(where):
+    """
+    Verificacion entre etapas: lanza DeadlineExceeded si ya no queda tiempo.
+    """
+    if expired():
+        count_timeout('deadline')
+        raise DeadlineExceeded(where)
+
+def bounded(seconds, where):
+    """
+    seconds recortado a lo que queda del plazo (para timeouts de llamadas
+    externas); lanza DeadlineExceeded si ya vencio.
+    """
+    check_deadline(where)
+    left = remaining()
+    if left is None or seconds is None:
+        return seconds if left is None else left
+    return min(seconds, left)
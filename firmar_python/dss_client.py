@@ -0,0 +1,367 @@
+# Descripcion: Cliente HTTP compartido (pool keep-alive) para todas las llamadas a la API de DSS
+import os
+import time
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from dotenv import load_dotenv
+from metrics import stage, observe_size, count_error, count_timeout
+from tracing import span, inject_headers
+from deadlines import bounded, expired, DeadlineExceeded
+from breaker import dss_breaker
+from dss_replicas import ReplicaBalancer, AsyncReplicaBalancer, ReplicasBusy, replica_urls, payload_cost
+from dss_profiles import json_dumps, json_loads, JSON_HEADERS
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+load_dotenv()
+
+##################################################
+###          Configuracion del cliente         ###
+##################################################
+
+DSS_BASE_URL = os.getenv('DSS_BASE_URL', 'http://java-webapp:5555')
+# Varias replicas del servicio Java separadas por coma (ver dss_replicas.py); sin la variable, solo DSS_BASE_URL
+DSS_BASE_URLS = replica_urls(os.getenv('DSS_BASE_URLS') or DSS_BASE_URL)
+DSS_POOL_SIZE = int(os.getenv('DSS_POOL_SIZE', '10'))
+# Si el pool esta lleno, esperar una conexion libre en vez de abrir una descartable
+DSS_POOL_BLOCK = os.getenv('DSS_POOL_BLOCK', 'true').lower() in ('1', 'true', 'yes')
+# Conexiones simultaneas a DSS del cliente asincrono (sign_asgi): es el limite de pedidos en vuelo hacia DSS
+DSS_ASYNC_MAX_CONNECTIONS = int(os.getenv('DSS_ASYNC_MAX_CONNECTIONS', '100'))
+
+ENDPOINTS = {
+    'getDataToSign': '/services/rest/signature/one-document/getDataToSign',
+    'signDocument': '/services/rest/signature/one-document/signDocument',
+    'pdfUpdate': '/pdf/update',
+    'validateSignature': '/services/rest/validation/validateSignature',
+}
+
+# (connect, read) en segundos por endpoint
+DEFAULT_TIMEOUTS = {
+    'getDataToSign': (3.05, 30),
+    'signDocument': (3.05, 60),
+    'pdfUpdate': (3.05, 60),
+    'validateSignature': (3.05, 60),
+}
+
+# Respuestas que cuentan como DSS caido o saturado para el cortacircuitos (un 500 suele ser un error del documento)
+BREAKER_STATUS = (502, 503, 504)
+
+def _load_timeouts():
+    """
+    Lee los timeouts por endpoint desde variables de entorno con la forma
+    DSS_TIMEOUT_<ENDPOINT>="connect,read" (por ejemplo DSS_TIMEOUT_SIGNDOCUMENT="2,90").
+    """
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    for endpoint in ENDPOINTS:
+        value = os.getenv(f'DSS_TIMEOUT_{endpoint.upper()}')
+        if value:
+            connect, read = (float(part) for part in value.split(','))
+            timeouts[endpoint] = (connect, read)
+    return timeouts
+
+##################################################
+###       Contadores de reuso de conexiones    ###
+##################################################
+
+class ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._new_connections = 0
+
+    def count_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def count_new_connection(self):
+        with self._lock:
+            self._new_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "new_connections": self._new_connections,
+                "reused_connections": max(self._requests - self._new_connections, 0),
+            }
+
+_stats = ConnectionStats()
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _stats.count_new_connection()
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _stats.count_new_connection()
+        return super()._new_conn()
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        _stats.count_request()
+        return super().send(request, **kwargs)
+
+##################################################
+###               Cliente de DSS               ###
+##################################################
+
+class DSSClient:
+    """
+    Cliente keep-alive para DSS. El pool de conexiones (adapter) es unico por
+    proceso y seguro entre hilos; cada hilo de mod_wsgi usa su propia Session
+    montada sobre ese mismo adapter. Con varias replicas, cada llamada elige la
+    suya con el balanceador (ver dss_replicas.py).
+    """
+    def __init__(self, base_url=DSS_BASE_URLS, pool_size=DSS_POOL_SIZE, pool_block=DSS_POOL_BLOCK, timeouts=None):
+        urls = replica_urls(base_url) if isinstance(base_url, str) else list(base_url)
+        self.replicas = ReplicaBalancer(urls)
+        self.timeouts = timeouts or _load_timeouts()
+        # Un pool de conexiones por replica
+        self._adapter = _PooledAdapter(pool_connections=len(urls), pool_maxsize=pool_size, pool_block=pool_block)
+        self._local = threading.local()
+
+    @property
+    def base_url(self):
+        # Primera replica; asignar una URL (o varias separadas por coma) rearma el balanceo
+        return self.replicas.urls[0]
+
+    @base_url.setter
+    def base_url(self, value):
+        self.replicas = ReplicaBalancer(replica_urls(value))
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def _timeout(self, endpoint):
+        # Timeouts del endpoint recortados a lo que queda del plazo del pedido (ver deadlines.py)
+        connect, read = self.timeouts.get(endpoint)
+        return (bounded(connect, 'dss_' + endpoint), bounded(read, 'dss_' + endpoint))
+
+    def _send(self, endpoint, cost, timeout, tried, kwargs):
+        replicas = self.replicas
+        replica = replicas.acquire(cost, bounded(replicas.max_wait, 'dss_' + endpoint), exclude=tried)
+        tried.append(replica)
+        started = time.perf_counter()
+        try:
+            with stage('dss_' + endpoint), span('dss ' + endpoint, client=True, **{"http.url": replica.url + ENDPOINTS[endpoint]}) as current:
+                # traceparent para que el servicio Java continue la traza
+                kwargs['headers'] = inject_headers(kwargs.get('headers'))
+                response = self._session().post(replica.url + ENDPOINTS[endpoint], timeout=timeout or self._timeout(endpoint), **kwargs)
+                if current is not None:
+                    current.set_attribute("http.status_code", response.status_code)
+        except requests.Timeout:
+            replicas.release(replica, cost, endpoint, time.perf_counter() - started, 'timeout')
+            raise
+        except requests.ConnectionError:
+            replicas.release(replica, cost, endpoint, time.perf_counter() - started, 'connect')
+            raise
+        except BaseException:
+            replicas.release(replica, cost, endpoint)
+            raise
+        replicas.release(replica, cost, endpoint, time.perf_counter() - started, _replica_failure(response.status_code))
+        return response
+
+    def post(self, endpoint, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        cost = payload_cost(kwargs)
+        dss_breaker.before_call()
+        tried = []
+        while True:
+            try:
+                response = self._send(endpoint, cost, timeout, tried, kwargs)
+                break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if isinstance(e, requests.Timeout):
+                    count_timeout('dss_' + endpoint)
+                    _deadline_timeout(endpoint, e)
+                if isinstance(e, requests.ConnectionError) and self.replicas.can_retry(tried):
+                    # La replica no acepto o corto la conexion: DSS no guarda estado, se repite en otra
+                    continue
+                dss_breaker.record_failure()
+                raise
+            except ReplicasBusy as e:
+                dss_breaker.release()
+                count_timeout('dss_replicas')
+                # Igual que la espera por una conexion del pool de urllib3
+                raise requests.ConnectionError(str(e)) from e
+            except BaseException:
+                dss_breaker.release()
+                raise
+        _record_status(response.status_code)
+        observe_size('dss_' + endpoint, len(response.content))
+        if not response.ok:
+            count_error('dss_' + endpoint)
+        return response
+
+    def stats(self):
+        return _stats.snapshot()
+
+def _deadline_timeout(endpoint, error):
+    # Si el timeout lo fijo el plazo del pedido (no DSS lento) no cuenta para el cortacircuitos
+    if expired():
+        dss_breaker.release()
+        raise DeadlineExceeded('dss_' + endpoint) from error
+
+def _replica_failure(status_code):
+    # Motivo de falla para el chequeo pasivo de la replica, o None
+    return f"status_{status_code}" if status_code in BREAKER_STATUS else None
+
+def _record_status(status_code):
+    if status_code in BREAKER_STATUS:
+        dss_breaker.record_failure()
+    else:
+        dss_breaker.record_success()
+
+dss_client = DSSClient()
+
+def dss_post(endpoint, **kwargs):
+    return dss_client.post(endpoint, **kwargs)
+
+def get_dss_connection_stats():
+    return dss_client.stats()
+
+def get_dss_replica_stats():
+    return dss_client.replicas.stats()
+
+##################################################
+###      Cliente asincrono de DSS (ASGI)       ###
+##################################################
+
+class DSSRequestError(Exception):
+    """
+    Falla de una llamada asincrona a DSS (conexion, timeout, estado HTTP o JSON invalido).
+    """
+
+class AsyncDSSClient:
+    """
+    Cliente httpx para sign_asgi, con los mismos endpoints, timeouts, metricas y
+    trazas que DSSClient. El pool de conexiones queda ligado al event loop en el
+    que se usa por primera vez (uno por proceso de uvicorn).
+    """
+    def __init__(self, base_url=DSS_BASE_URLS, max_connections=DSS_ASYNC_MAX_CONNECTIONS, timeouts=None):
+        self.replicas = AsyncReplicaBalancer(replica_urls(base_url) if isinstance(base_url, str) else list(base_url))
+        self.max_connections = max_connections
+        self.timeouts = timeouts or _load_timeouts()
+        self._client = None
+        self._requests = 0
+
+    @property
+    def base_url(self):
+        return self.replicas.urls[0]
+
+    @base_url.setter
+    def base_url(self, value):
+        self.replicas = AsyncReplicaBalancer(replica_urls(value))
+
+    def _http(self):
+        if self._client is None:
+            if not HTTPX_AVAILABLE:
+                raise DSSRequestError("httpx no esta instalado (necesario para el modo ASGI)")
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(limits=limits)
+        return self._client
+
+    def _timeout(self, endpoint):
+        connect, read = self.timeouts.get(endpoint)
+        connect, read = bounded(connect, 'dss_' + endpoint), bounded(read, 'dss_' + endpoint)
+        # pool: espera por una conexion libre cuando hay max_connections pedidos en vuelo
+        return httpx.Timeout(read, connect=connect, pool=read)
+
+    async def _send(self, endpoint, cost, timeout, tried, kwargs):
+        client = self._http()
+        replicas = self.replicas
+        replica = await replicas.acquire(cost, bounded(replicas.max_wait, 'dss_' + endpoint), exclude=tried)
+        tried.append(replica)
+        started = time.perf_counter()
+        try:
+            with stage('dss_' + endpoint), span('dss ' + endpoint, client=True, **{"http.url": replica.url + ENDPOINTS[endpoint]}) as current:
+                kwargs['headers'] = inject_headers(kwargs.get('headers'))
+                response = await client.post(replica.url + ENDPOINTS[endpoint], timeout=timeout or self._timeout(endpoint), **kwargs)
+                if current is not None:
+                    current.set_attribute("http.status_code", response.status_code)
+        except httpx.TransportError as e:
+            failure = 'timeout' if isinstance(e, httpx.TimeoutException) else 'connect'
+            await replicas.release(replica, cost, endpoint, time.perf_counter() - started, failure)
+            raise
+        except BaseException:
+            await replicas.release(replica, cost, endpoint)
+            raise
+        await replicas.release(replica, cost, endpoint, time.perf_counter() - started, _replica_failure(response.status_code))
+        return response
+
+    async def post(self, endpoint, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        cost = payload_cost(kwargs)
+        self._requests += 1
+        dss_breaker.before_call()
+        tried = []
+        while True:
+            try:
+                response = await self._send(endpoint, cost, timeout, tried, kwargs)
+                break
+            except httpx.TransportError as e:
+                if isinstance(e, httpx.TimeoutException):
+                    count_timeout('dss_' + endpoint)
+                    _deadline_timeout(endpoint, e)
+                if isinstance(e, (httpx.NetworkError, httpx.ConnectTimeout, httpx.RemoteProtocolError)) and self.replicas.can_retry(tried):
+                    continue
+                dss_breaker.record_failure()
+                raise
+            except ReplicasBusy as e:
+                dss_breaker.release()
+                count_timeout('dss_replicas')
+                raise httpx.PoolTimeout(str(e)) from e
+            except BaseException:
+                dss_breaker.release()
+                raise
+        _record_status(response.status_code)
+        observe_size('dss_' + endpoint, len(response.content))
+        if not response.is_success:
+            count_error('dss_' + endpoint)
+        return response
+
+    async def post_json(self, endpoint, body, executor=None):
+        """
+        POST con cuerpo y respuesta JSON. body puede venir ya serializado (bytes,
+        ver dss_profiles.py). Serializar y leer un PDF en base64 (MB) es trabajo
+        de CPU, asi que se hace en 'executor' y no en el event loop.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            content = body if isinstance(body, bytes) else await loop.run_in_executor(executor, json_dumps, body)
+            response = await self.post(endpoint, content=content, headers=dict(JSON_HEADERS))
+            response.raise_for_status()
+            return await loop.run_in_executor(executor, json_loads, response.content)
+        except (httpx.HTTPError, ValueError) as e:
+            raise DSSRequestError(str(e)) from e
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {"requests": self._requests, "max_connections": self.max_connections}
+
+async_dss_client = AsyncDSSClient()
@@ -0,0 +1,204 @@
+# Descripcion: Perfiles de firma para los pedidos a DSS (getDataToSign / signDocument)
+# Los parametros fijos (nivel de firma, algoritmos, lugar del firmante, imagen) se serializan a JSON una sola
+# vez al importar el modulo; en cada llamada solo se codifican los campos que cambian (documento,
+# certificados, campo, pagina, fecha, rol, imagen y valor de firma) y se unen con los fragmentos fijos.
+# El JSON se escribe y se lee con orjson cuando esta instalado.
+import re
+import json
+from types import MappingProxyType
+
+# orjson es opcional; sin el paquete se usa json de la biblioteca estandar
+try:
+    import orjson
+    JSON_LIBRARY = 'orjson'
+except ImportError:
+    orjson = None
+    JSON_LIBRARY = 'json'
+
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json'})
+
+##################################################
+###              JSON rapido                   ###
+##################################################
+
+def json_dumps(value):
+    # Devuelve bytes UTF-8
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+##################################################
+###            Plantillas de cuerpos           ###
+##################################################
+
+_SLOT = re.compile(rb'"@@(\w+)@@"')
+
+def slot(name):
+    # Lugar de un campo que se completa en cada llamada
+    return f"@@{name}@@"
+
+class BodyTemplate:
+    """
+    Cuerpo JSON precompilado: fragmentos fijos ya serializados alternados con
+    los campos (slot) que se codifican en cada render().
+    """
+    def __init__(self, template):
+        parts = _SLOT.split(json_dumps(template))
+        self._static = tuple(parts[0::2])
+        self.slots = tuple(name.decode('ascii') for name in parts[1::2])
+
+    def render(self, **values):
+        chunks = [self._static[0]]
+        for name, static in zip(self.slots, self._static[1:]):
+            chunks.append(json_dumps(values[name]))
+            chunks.append(static)
+        return b''.join(chunks)
+
+##################################################
+###              Perfil de firma               ###
+##################################################
+
+_TIMESTAMP_PARAMETERS = {
+    "digestAlgorithm": "SHA256",
+    "canonicalizationMethod": "http://www.w3.org/2001/10/xml-exc-c14n#",
+    "timestampContainerForm": None
+}
+
+SIGNER_LOCATION = MappingProxyType({
+    "signerLocationPostalAddress": (
+        "Congreso 180",
+        "4000 San Miguel de Tucumán",
+        "Tucumán",
+        "AR"
+    ),
+    "signerLocationPostalCode": "4000",
+    "signerLocationLocality": "San Miguel de Tucumán",
+    "signerLocationStateOrProvince": "Tucumán",
+    "signerLocationCountry": "AR",
+    "signerLocationStreet": "Congreso 180"
+})
+
+class SignatureProfile:
+    """
+    Parametros fijos de las firmas PAdES que pide el firmador a DSS. Las
+    plantillas de getDataToSign y signDocument se compilan al crear el perfil.
+    """
+    def __init__(self, signature_level="PAdES_BASELINE_B", signature_algorithm="RSA_SHA256", digest_algorithm="SHA256",
+                 encryption_algorithm="RSA", image_dpi=200, signer_location=SIGNER_LOCATION):
+        self.signature_level = signature_level
+        self.signature_algorithm = signature_algorithm
+        self.digest_algorithm = digest_algorithm
+        self.encryption_algorithm = encryption_algorithm
+        self.image_dpi = image_dpi
+        self.signer_location = signer_location
+        self.data_to_sign_template = BodyTemplate(self._body(for_signing=False))
+        self.sign_document_template = BodyTemplate(self._body(for_signing=True))
+
+    def _body(self, for_signing):
+        # Mismo cuerpo que armaban los *_body de dss_sign.py, con slot() en los campos de cada llamada
+        parameters = {
+            "signingCertificate": {
+                "encodedCertificate": slot("certificate")
+            },
+            "certificateChain": slot("certificate_chain"),
+            "detachedContents": None,
+            "asicContainerType": None,
+            "signatureLevel": self.signature_level,
+            "signaturePackaging": "ENVELOPED",
+        }
+        if not for_signing:
+            parameters.update({
+                "embedXML": False,
+                "manifestSignature": False,
+                "jwsSerializationType": None,
+                "sigDMechanism": None,
+            })
+        parameters.update({
+            "signatureAlgorithm": self.signature_algorithm,
+            "digestAlgorithm": self.digest_algorithm,
+            "encryptionAlgorithm": self.encryption_algorithm,
+            "referenceDigestAlgorithm": None,
+            "maskGenerationFunction": None,
+            "contentTimestamps": None,
+            "contentTimestampParameters": dict(_TIMESTAMP_PARAMETERS),
+            "signatureTimestampParameters": dict(_TIMESTAMP_PARAMETERS),
+            "archiveTimestampParameters": dict(_TIMESTAMP_PARAMETERS),
+            "signWithExpiredCertificate": False,
+            "generateTBSWithoutCertificate": False,
+            "imageParameters": {
+                "alignmentHorizontal": None,
+                "alignmentVertical": None,
+                "imageScaling": "ZOOM_AND_CENTER",
+                "backgroundColor": None,
+                "dpi": self.image_dpi,
+                "image": {
+                    "bytes": slot("image"),
+                    "name": "image.png"
+                },
+                "fieldParameters": {
+                    "fieldId": slot("field_id"),
+                    "originX": 0,
+                    "originY": 0,
+                    "width": None,
+                    "height": None,
+                    "rotation": None,
+                    "page": slot("page")
+                },
+                "textParameters": None,
+                "zoom": None
+            },
+            "signatureIdToCounterSign": None,
+            "blevelParams": dict({
+                "trustAnchorBPPolicy": True,
+                "signingDate": slot("signing_date"),  # Current time in milliseconds
+                "claimedSignerRoles": slot("roles"),
+                "policyId": None,
+                "policyQualifier": None,
+                "policyDescription": None,
+                "policyDigestAlgorithm": None,
+                "policyDigestValue": None,
+                "policySpuri": None,
+                "commitmentTypeIndications": None,
+            }, **self.signer_location)
+        })
+        body = {"parameters": parameters}
+        if for_signing:
+            body["signatureValue"] = {
+                "algorithm": self.signature_algorithm,
+                "value": slot("signature_value")
+            }
+        body["toSignDocument"] = {
+            "bytes": slot("document"),
+            "digestAlgorithm": None,
+            "name": "document.pdf"
+        }
+        return body
+
+    @staticmethod
+    def _values(document_b64, certificates, current_time, field_id, page, stamp, encoded_image):
+        return {
+            "certificate": certificates['certificate'],
+            "certificate_chain": [{"encodedCertificate": cert} for cert in certificates['certificateChain']],
+            "image": encoded_image,
+            "field_id": f"{field_id}",
+            "page": page,
+            "signing_date": current_time,
+            "roles": [f"{stamp}"],
+            "document": document_b64,
+        }
+
+    def get_data_to_sign(self, document_b64, certificates, current_time, field_id, page, stamp, encoded_image):
+        # Cuerpo JSON (bytes) de getDataToSign
+        return self.data_to_sign_template.render(**self._values(document_b64, certificates, current_time, field_id, page, stamp, encoded_image))
+
+    def sign_document(self, document_b64, signature_value, certificates, current_time, field_id, page, stamp, encoded_image):
+        # Cuerpo JSON (bytes) de signDocument
+        values = self._values(document_b64, certificates, current_time, field_id, page, stamp, encoded_image)
+        return self.sign_document_template.render(signature_value=signature_value, **values)
+
+signature_profile = SignatureProfile()
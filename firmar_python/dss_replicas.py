@@ -0,0 +1,286 @@
+# Descripcion: Balanceo del lado del cliente entre varias replicas de DSS (servicio Java)
+# DSS_BASE_URLS lista las replicas separadas por coma. Cada llamada va a la replica con menos trabajo en
+# vuelo, medido por el tamaño de los pedidos (un PDF de 20 MB pesa mas que uno de 100 KB) y no solo por
+# la cantidad. Con varias replicas cada una tiene un tope de pedidos simultaneos; con una sola (solo
+# DSS_BASE_URL) no hay tope por defecto, como antes del balanceo: el unico limite es el del pool de
+# conexiones del cliente, y el modo ASGI puede tener en vuelo todo lo que DSS acepte. Las que fallan seguido (conexion,
+# timeout, 502/503/504) salen del balanceo por un tiempo que se duplica en cada expulsion, y vuelven
+# a prueba: una falla mas las vuelve a sacar.
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from metrics import observe_replica, replica_in_flight, set_replica_ejected
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###          Configuracion del balanceo        ###
+##################################################
+
+# Pedidos simultaneos por replica (0 sin tope); los demas esperan una replica libre.
+# Sin la variable: 10 con varias replicas y sin tope con una sola (ver default_max_in_flight)
+DSS_REPLICA_MAX_IN_FLIGHT = os.getenv('DSS_REPLICA_MAX_IN_FLIGHT')
+# Segundos maximos de espera por una replica libre (tambien acotados por el plazo del pedido)
+DSS_REPLICA_MAX_WAIT = float(os.getenv('DSS_REPLICA_MAX_WAIT', '30'))
+# Bytes del cuerpo que equivalen a un pedido mas en vuelo
+DSS_REPLICA_COST_BYTES = int(os.getenv('DSS_REPLICA_COST_BYTES', str(1024 * 1024)))
+# Fallas seguidas para sacar una replica, y segundos fuera del balanceo (se duplican hasta el maximo)
+DSS_REPLICA_EJECT_FAILURES = int(os.getenv('DSS_REPLICA_EJECT_FAILURES', '3'))
+DSS_REPLICA_EJECT_SECONDS = float(os.getenv('DSS_REPLICA_EJECT_SECONDS', '10'))
+DSS_REPLICA_EJECT_MAX_SECONDS = float(os.getenv('DSS_REPLICA_EJECT_MAX_SECONDS', '300'))
+# Otras replicas a probar cuando una rechaza la conexion (DSS no guarda estado entre pedidos)
+DSS_REPLICA_RETRIES = int(os.getenv('DSS_REPLICA_RETRIES', '1'))
+
+class ReplicasBusy(Exception):
+    """
+    Todas las replicas de DSS llegaron a su tope de pedidos en vuelo y ninguna
+    se libero a tiempo.
+    """
+
+def default_max_in_flight(urls):
+    if DSS_REPLICA_MAX_IN_FLIGHT is not None:
+        return int(DSS_REPLICA_MAX_IN_FLIGHT)
+    return 0 if len(urls) == 1 else 10
+
+def replica_urls(value):
+    # "http://dss-1:5555, http://dss-2:5555" -> lista sin barras finales
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
+def payload_cost(kwargs):
+    """
+    Peso de un pedido para el balanceo: 1 mas una unidad por cada
+    DSS_REPLICA_COST_BYTES del cuerpo (bytes ya serializados o formulario).
+    """
+    body = kwargs.get('data') if kwargs.get('data') is not None else kwargs.get('content')
+    if isinstance(body, (bytes, bytearray, str)):
+        size = len(body)
+    elif isinstance(body, dict):
+        size = sum(len(value) for value in body.values() if isinstance(value, (bytes, str)))
+    else:
+        size = 0
+    return 1 + size / DSS_REPLICA_COST_BYTES
+
+##################################################
+###                  Replicas                  ###
+##################################################
+
+class Replica:
+    __slots__ = ('url', 'in_flight', 'outstanding', 'failures', 'ejected_until', 'ejection_streak',
+                 'ejections', 'requests', 'errors', 'latency')
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        # Suma de payload_cost de los pedidos en vuelo
+        self.outstanding = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejection_streak = 0
+        self.ejections = 0
+        self.requests = 0
+        self.errors = 0
+        # Promedio movil de la duracion de las llamadas (segundos)
+        self.latency = None
+
+    def ejected(self, now):
+        return now < self.ejected_until
+
+    def snapshot(self, now):
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "outstanding_cost": round(self.outstanding, 3),
+            "ejected": self.ejected(now),
+            "ejected_for": round(max(self.ejected_until - now, 0), 1),
+            "consecutive_failures": self.failures,
+            "ejections": self.ejections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_avg_seconds": round(self.latency, 4) if self.latency is not None else None,
+        }
+
+class _ReplicaSet:
+    """
+    Estado y eleccion de replicas, comun a ReplicaBalancer (hilos) y
+    AsyncReplicaBalancer (asyncio). Los metodos _pick y _finish se llaman con
+    el lock o la condicion de la subclase tomados.
+    """
+    def __init__(self, urls, max_in_flight=None, max_wait=DSS_REPLICA_MAX_WAIT,
+                 eject_failures=DSS_REPLICA_EJECT_FAILURES, eject_seconds=DSS_REPLICA_EJECT_SECONDS,
+                 eject_max_seconds=DSS_REPLICA_EJECT_MAX_SECONDS, retries=DSS_REPLICA_RETRIES):
+        if not urls:
+            raise ValueError("Se necesita al menos una replica de DSS")
+        self.replicas = [Replica(url) for url in urls]
+        self.max_in_flight = default_max_in_flight(urls) if max_in_flight is None else max_in_flight
+        self.max_wait = max_wait
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.eject_max_seconds = eject_max_seconds
+        self.retries = retries
+        self._waiting = 0
+        self._waits = 0
+        self._busy = 0
+        for replica in self.replicas:
+            set_replica_ejected(replica.url, 0)
+
+    @property
+    def urls(self):
+        return [replica.url for replica in self.replicas]
+
+    def _has_room(self, replica):
+        return self.max_in_flight <= 0 or replica.in_flight < self.max_in_flight
+
+    def _pick(self, cost, exclude):
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica not in exclude]
+        healthy = [replica for replica in candidates if not replica.ejected(now)]
+        # Con todas las replicas fuera del balanceo se sigue usando cualquiera: mejor intentar que rechazar
+        pool = [replica for replica in (healthy or candidates) if self._has_room(replica)]
+        if not pool:
+            return None
+        # Menor trabajo en vuelo; al empatar, menor latencia promedio y despues al azar
+        replica = min(pool, key=lambda r: (r.outstanding, r.latency or 0.0, random.random()))
+        replica.in_flight += 1
+        replica.outstanding += cost
+        replica.requests += 1
+        replica_in_flight(replica.url, 1)
+        return replica
+
+    def _finish(self, replica, cost, endpoint, elapsed, failure):
+        replica.in_flight -= 1
+        replica.outstanding = max(replica.outstanding - cost, 0.0)
+        replica_in_flight(replica.url, -1)
+        if elapsed is None and failure is None:
+            # La llamada no termino por un error propio del pedido: no cuenta para el chequeo
+            return
+        observe_replica(replica.url, endpoint, elapsed, failure)
+        if failure is None:
+            # Solo las respuestas: un rechazo de conexion inmediato no hace rapida a la replica
+            if elapsed is not None:
+                replica.latency = elapsed if replica.latency is None else 0.8 * replica.latency + 0.2 * elapsed
+            if replica.failures or replica.ejection_streak:
+                set_replica_ejected(replica.url, 0)
+            replica.failures = 0
+            replica.ejection_streak = 0
+            return
+        replica.errors += 1
+        replica.failures += 1
+        now = time.monotonic()
+        if self.eject_failures > 0 and replica.failures >= self.eject_failures and not replica.ejected(now):
+            seconds = min(self.eject_seconds * 2 ** replica.ejection_streak, self.eject_max_seconds)
+            replica.ejected_until = now + seconds
+            replica.ejection_streak += 1
+            replica.ejections += 1
+            # Al volver queda a prueba: una sola falla mas la vuelve a sacar
+            replica.failures = self.eject_failures - 1
+            set_replica_ejected(replica.url, 1)
+            logging.warning(f"Replica de DSS {replica.url} fuera del balanceo por {seconds:.0f}s ({failure})")
+
+    def _busy_error(self, max_wait):
+        self._busy += 1
+        return ReplicasBusy(f"Todas las replicas de DSS estan ocupadas tras {max_wait:.3g}s")
+
+    def can_retry(self, tried):
+        # Queda otra replica sin probar y no se agotaron los reintentos
+        return len(tried) <= self.retries and len(tried) < len(self.replicas)
+
+    def _stats(self):
+        now = time.monotonic()
+        return {
+            "replicas": [replica.snapshot(now) for replica in self.replicas],
+            "max_in_flight": self.max_in_flight,
+            "waiting": self._waiting,
+            "waits": self._waits,
+            "busy_errors": self._busy,
+        }
+
+class ReplicaBalancer(_ReplicaSet):
+    """
+    Balanceo para DSSClient: seguro entre hilos, la espera por una replica
+    libre bloquea el hilo (como ConnectionPool.getconn).
+    """
+    def __init__(self, urls, **kwargs):
+        super().__init__(urls, **kwargs)
+        self._cond = threading.Condition()
+
+    def acquire(self, cost, timeout=None, exclude=()):
+        max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            replica = self._pick(cost, exclude)
+            if replica is not None:
+                return replica
+            self._waiting += 1
+            self._waits += 1
+            try:
+                while replica is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._busy_error(max_wait)
+                    self._cond.wait(remaining)
+                    replica = self._pick(cost, exclude)
+            finally:
+                self._waiting -= 1
+            return replica
+
+    def release(self, replica, cost, endpoint, elapsed=None, failure=None):
+        """
+        Devuelve el lugar en la replica. failure: None si DSS respondio, o el
+        motivo ('connect', 'timeout', 'status_503'...) para el chequeo pasivo;
+        sin elapsed ni failure la llamada no se cuenta.
+        """
+        with self._cond:
+            self._finish(replica, cost, endpoint, elapsed, failure)
+            # Todos: la replica liberada puede estar excluida para alguno de los que esperan
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return self._stats()
+
+class AsyncReplicaBalancer(_ReplicaSet):
+    """
+    Version asyncio de ReplicaBalancer para AsyncDSSClient: esperar una replica
+    libre no ocupa un hilo. Debe usarse siempre desde el mismo event loop.
+    """
+    def __init__(self, urls, **kwargs):
+        super().__init__(urls, **kwargs)
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, cost, timeout=None, exclude=()):
+        max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        async with self._cond:
+            replica = self._pick(cost, exclude)
+            if replica is not None:
+                return replica
+            self._waiting += 1
+            self._waits += 1
+            picked = []
+            def ready():
+                replica = self._pick(cost, exclude)
+                if replica is not None:
+                    picked.append(replica)
+                return replica is not None
+            try:
+                await asyncio.wait_for(self._cond.wait_for(ready), max_wait)
+            except asyncio.TimeoutError:
+                if picked:
+                    # Se libero una replica justo al vencer la espera
+                    return picked[0]
+                raise self._busy_error(max_wait)
+            finally:
+                self._waiting -= 1
+            return picked[0]
+
+    async def release(self, replica, cost, endpoint, elapsed=None, failure=None):
+        async with self._cond:
+            self._finish(replica, cost, endpoint, elapsed, failure)
+            self._cond.notify_all()
+
+    def stats(self):
+        # Sin await entre lecturas: el event loop no intercala otra corrutina
+        return self._stats()
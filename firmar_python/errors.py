@@ -1,2 +1,5 @@
 class PDFSignatureError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class PDFCloseError(PDFSignatureError):
+    pass
@@ -0,0 +1,217 @@
+# Descripcion: Idempotencia de /firma_init, /firma_valor y los documentos de /firmalote
+# Un reenvio de Tapir (doble click, reintento por timeout) con la misma clave no repite las idas al DSS:
+# si el original esta en curso espera su resultado (single-flight) y si ya termino lo toma de un cache
+# acotado en bytes y con vencimiento. La clave la manda el cliente (cabecera Idempotency-Key, o
+# 'idempotency_key' por documento del lote) o se calcula del PDF, los datos de firma y el certificado.
+# Los errores no se guardan: el siguiente reintento vuelve a intentar. Un resultado que ya no sirve (por
+# ejemplo un data_to_sign cuya sesion ya se uso en /firma_valor) se descarta con el parametro valid.
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###      Configuracion de la idempotencia      ###
+##################################################
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Tiempo (segundos) que se conserva un resultado; 0 deja solo el single-flight
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_MAX_BYTES = int(os.getenv('IDEMPOTENCY_MAX_BYTES', str(128 * 1024 * 1024)))
+
+# Resultado de run(): calculado aca, esperado de otro pedido en curso, o tomado del cache
+MISS = 'miss'
+JOINED = 'joined'
+HIT = 'hit'
+
+##################################################
+###                  Claves                    ###
+##################################################
+
+def _digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        hasher.update(len(data).to_bytes(8, 'big'))
+        hasher.update(data)
+    return hasher.hexdigest()
+
+def caller_key(route, key):
+    # Clave del cliente, separada por ruta
+    return _digest('caller', route, key)
+
+def session_key(session_id):
+    # /firma_valor: un reenvio con la misma sesion devuelve el mismo PDF firmado
+    return _digest('session', session_id)
+
+def content_key(route, pdf, info, certificate=None):
+    """
+    Clave de un documento sin clave del cliente: hash del PDF, de los datos de
+    firma (JSON canonico) y de la huella del certificado del firmante.
+    """
+    fingerprint = hashlib.sha256(certificate.encode('ascii')).hexdigest() if certificate else ''
+    canonical = json.dumps(info, sort_keys=True, separators=(',', ':'), default=str)
+    return _digest('content', route, hashlib.sha256(pdf.raw).digest(), canonical, fingerprint)
+
+##################################################
+###     Single-flight + cache de resultados    ###
+##################################################
+
+def _footprint(value):
+    # Bytes aproximados que ocupa un resultado en el cache
+    if hasattr(value, 'footprint'):
+        return value.footprint
+    if isinstance(value, dict):
+        return sum(_footprint(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_footprint(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 64
+
+class IdempotencyCache:
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_bytes=IDEMPOTENCY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._in_flight = {}
+        self._in_flight_async = {}
+        self._stats = dict.fromkeys((MISS, JOINED, HIT, 'errors', 'evictions', 'stale'), 0)
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, size = entry
+        if expires_at <= now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        expires_at, value, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _discard(self, key, entry):
+        # Solo si nadie guardo otro resultado con la misma clave mientras se verificaba
+        if self._entries.get(key) is entry:
+            self._drop(key)
+            self._stats['stale'] += 1
+
+    def _store(self, key, value):
+        if self.ttl <= 0:
+            return
+        size = _footprint(value)
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (now + self.ttl, value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes or (self._entries and next(iter(self._entries.values()))[0] <= now):
+            self._drop(next(iter(self._entries)))
+            self._stats['evictions'] += 1
+
+    def run(self, key, compute, valid=None):
+        """
+        Devuelve (resultado, MISS|JOINED|HIT). Con key None calcula siempre.
+        valid(resultado) decide si un resultado del cache todavia se puede
+        devolver; si no, se descarta y se vuelve a calcular.
+        """
+        if key is None:
+            return compute(), MISS
+        if valid is not None:
+            with self._lock:
+                entry = self._lookup(key, time.monotonic())
+            if entry is not None and not valid(entry[1]):
+                with self._lock:
+                    self._discard(key, entry)
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is not None:
+                self._stats[HIT] += 1
+                return entry[1], HIT
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            self._stats[MISS if owner else JOINED] += 1
+        if not owner:
+            return future.result(), JOINED
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._store(key, value)
+            del self._in_flight[key]
+        future.set_result(value)
+        return value, MISS
+
+    async def run_async(self, key, compute, valid=None):
+        # Igual que run() para sign_asgi: compute y valid son funciones que devuelven una corrutina
+        if key is None:
+            return await compute(), MISS
+        if valid is not None:
+            with self._lock:
+                entry = self._lookup(key, time.monotonic())
+            if entry is not None and not await valid(entry[1]):
+                with self._lock:
+                    self._discard(key, entry)
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is not None:
+                self._stats[HIT] += 1
+                return entry[1], HIT
+            future = self._in_flight_async.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight_async[key] = asyncio.get_running_loop().create_future()
+            self._stats[MISS if owner else JOINED] += 1
+        if not owner:
+            return await asyncio.shield(future), JOINED
+        try:
+            value = await compute()
+        except BaseException as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                del self._in_flight_async[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Si nadie mas espera, la excepcion no queda "sin recuperar"
+                future.exception()
+            raise
+        with self._lock:
+            self._store(key, value)
+            del self._in_flight_async[key]
+        future.set_result(value)
+        return value, MISS
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                in_flight=len(self._in_flight) + len(self._in_flight_async),
+                ttl=self.ttl,
+            )
+
+idempotency_cache = IdempotencyCache()
@@ -2,6 +2,8 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.backends import default_backend
+import threading
+import logging
 import base64
 import os
 from dotenv import load_dotenv
@@ -14,35 +16,85 @@ private_key_password = os.getenv('PRIVATE_KEY_PASSWORD')
 private_key_path = os.getenv('PRIVATE_KEY_PATH')
 certificate_path = os.getenv('CERTIFICATE_PATH')
 
-def get_signature_value_own(data_to_sign):
-    # Cargar la clave privada desde un archivo
-    with open(private_key_path, "rb") as key_file:
-        private_key = load_pem_private_key(key_file.read(), password=private_key_password.encode(), backend=default_backend())
-    print("Private key loaded")
-    data_to_sign_bytes = base64.b64decode(data_to_sign)
-    print("Data to sign decoded")
-    # Generar la firma
-    signature = private_key.sign(
+def _load_private_key(key_pem, password):
+    return load_pem_private_key(key_pem, password=password.encode() if password else None, backend=default_backend())
+
+def _sign_bytes(private_key, data_to_sign_bytes):
+    return private_key.sign(
         data_to_sign_bytes,
         padding.PKCS1v15(),
         hashes.SHA256()
     )
 
+##################################################
+###    Firmante residente del sello servidor   ###
+##################################################
+
+class ServerSealSigner:
+    """
+    Mantiene cargados la clave privada y la cadena de certificados del servidor
+    y los vuelve a leer solo cuando cambia el mtime de alguno de los archivos.
+    """
+    def __init__(self, key_path, cert_path, password):
+        self.key_path = key_path
+        self.cert_path = cert_path
+        self.password = password
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._private_key = None
+        self._certificate_data = None
+        self._certificates = None
+
+    def _current_mtimes(self):
+        return (os.stat(self.key_path).st_mtime_ns, os.stat(self.cert_path).st_mtime_ns)
+
+    def _ensure_loaded(self):
+        mtimes = self._current_mtimes()
+        if mtimes == self._mtimes:
+            return
+        with self._lock:
+            if mtimes == self._mtimes:
+                return
+            with open(self.key_path, "rb") as key_file:
+                key_pem = key_file.read()
+            private_key = _load_private_key(key_pem, self.password)
+            with open(self.cert_path, "rb") as cert_file:
+                certificate_data = cert_file.read()
+
+            # Convertir el certificado a base64 para enviarlo a DSS
+            cert_base64 = base64.b64encode(certificate_data).decode("utf-8")
+            self._certificates = {
+                "certificate": cert_base64,
+                "certificateChain": [cert_base64]  # Asumiendo un solo elemento de cadena de certificado para simplificar
+            }
+            self._private_key = private_key
+            self._certificate_data = certificate_data
+            self._mtimes = mtimes
+            logging.info("Clave y certificado del servidor cargados")
+
+    def certificates(self):
+        self._ensure_loaded()
+        return self._certificates
+
+    def key_material(self):
+        """
+        Devuelve (clave privada, certificado tal como esta en el archivo, version).
+        La version cambia cada vez que se recargan los archivos.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return self._private_key, self._certificate_data, self._mtimes
+
+    def sign(self, data_to_sign):
+        self._ensure_loaded()
+        signature = _sign_bytes(self._private_key, base64.b64decode(data_to_sign))
+        return base64.b64encode(signature).decode("utf-8")
+
+server_signer = ServerSealSigner(private_key_path, certificate_path, private_key_password)
+
+def get_signature_value_own(data_to_sign):
     # Convertir la firma a base64 para enviarla a DSS
-    signature_base64 = base64.b64encode(signature).decode("utf-8")
-    return signature_base64
+    return server_signer.sign(data_to_sign)
 
 def get_certificate_from_local():
-    # Leer el certificado desde un archivo
-    with open(certificate_path, "rb") as cert_file:
-        certificate_data = cert_file.read()
-
-    # Convertir el certificado a base64 para enviarlo a DSS
-    cert_base64 = base64.b64encode(certificate_data).decode("utf-8")
-    cert_chain_base64 = [cert_base64]  # Asumiendo un solo elemento de cadena de certificado para simplificar
-
-    certificate_base64 = {
-        "certificate": cert_base64,
-        "certificateChain": cert_chain_base64
-    }
-    return certificate_base64
+    return server_signer.certificates()
@@ -0,0 +1,208 @@
+# Descripcion: Metricas Prometheus (/metrics) por etapa, ruta y modo de firma
+# Con varios procesos de mod_wsgi se usa el modo multiproceso de prometheus_client: cada proceso
+# escribe sus valores en PROMETHEUS_MULTIPROC_DIR y /metrics los agrega al leerlos.
+import os
+import time
+import atexit
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# prometheus_client lee PROMETHEUS_MULTIPROC_DIR al importarse, por eso va despues de load_dotenv
+load_dotenv()
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Segundos: desde el codec base64 (ms) hasta lotes grandes contra DSS
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Bytes: de 1 KB a 64 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(9))
+
+##################################################
+###                 Metricas                   ###
+##################################################
+
+class _NoopMetric:
+    # Sin prometheus_client las mediciones no hacen nada
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_SECONDS = Histogram(
+        'firmador_stage_seconds', 'Duracion de cada etapa del proceso de firma',
+        ['route', 'mode', 'stage'], buckets=LATENCY_BUCKETS
+    )
+    PAYLOAD_BYTES = Histogram(
+        'firmador_payload_bytes', 'Tamaño de los datos procesados en cada etapa',
+        ['route', 'mode', 'stage'], buckets=SIZE_BUCKETS
+    )
+    ERRORS = Counter(
+        'firmador_errors_total', 'Errores por etapa (en la etapa request: respuestas con estado >= 400)',
+        ['route', 'mode', 'stage']
+    )
+    IN_FLIGHT = Gauge(
+        'firmador_in_flight_requests', 'Pedidos en curso por ruta',
+        ['route'], multiprocess_mode='livesum'
+    )
+    TIMEOUTS = Counter(
+        'firmador_timeouts_total', 'Timeouts hacia DSS y la base, y plazos de pedido agotados',
+        ['route', 'mode', 'target']
+    )
+    BREAKER_STATE = Gauge(
+        'firmador_breaker_state', 'Estado del cortacircuitos (0 cerrado, 1 semiabierto, 2 abierto)',
+        ['target'], multiprocess_mode='livemax'
+    )
+    BREAKER_REJECTED = Counter(
+        'firmador_breaker_rejected_total', 'Llamadas rechazadas con el circuito abierto',
+        ['target']
+    )
+    DSS_REPLICA_SECONDS = Histogram(
+        'firmador_dss_replica_seconds', 'Duracion de las llamadas a cada replica de DSS',
+        ['replica', 'endpoint'], buckets=LATENCY_BUCKETS
+    )
+    DSS_REPLICA_ERRORS = Counter(
+        'firmador_dss_replica_errors_total', 'Fallas de cada replica de DSS (conexion, timeout, 502/503/504)',
+        ['replica', 'endpoint', 'kind']
+    )
+    DSS_REPLICA_IN_FLIGHT = Gauge(
+        'firmador_dss_replica_in_flight', 'Pedidos en vuelo por replica de DSS',
+        ['replica'], multiprocess_mode='livesum'
+    )
+    DSS_REPLICA_EJECTED = Gauge(
+        'firmador_dss_replica_ejected', 'Replica de DSS fuera del balanceo o a prueba tras volver (1), o sana (0)',
+        ['replica'], multiprocess_mode='livemax'
+    )
+else:
+    STAGE_SECONDS = PAYLOAD_BYTES = ERRORS = IN_FLIGHT = TIMEOUTS = BREAKER_STATE = BREAKER_REJECTED = _NoopMetric()
+    DSS_REPLICA_SECONDS = DSS_REPLICA_ERRORS = DSS_REPLICA_IN_FLIGHT = DSS_REPLICA_EJECTED = _NoopMetric()
+
+if PROMETHEUS_AVAILABLE and PROMETHEUS_MULTIPROC_DIR:
+    # Los gauges 'livesum' de un proceso terminado no deben seguir sumando
+    atexit.register(lambda: multiprocess.mark_process_dead(os.getpid()))
+
+##################################################
+###       Etiquetas del pedido en curso        ###
+##################################################
+
+NO_ROUTE = 'ninguna'
+NO_MODE = 'ninguno'
+
+# (ruta, modo) del pedido o documento que se esta procesando en este hilo
+_labels = contextvars.ContextVar('metrics_labels', default=(NO_ROUTE, NO_MODE))
+
+def signing_mode(isdigital, isclosing):
+    mode = 'token' if isdigital else 'sello'
+    return mode + '_cierre' if isclosing else mode
+
+def start_request(route):
+    """
+    Marca el inicio de un pedido; devuelve el token para end_request.
+    """
+    IN_FLIGHT.labels(route).inc()
+    return _labels.set((route, NO_MODE)), time.perf_counter()
+
+def set_mode(mode):
+    route, _ = _labels.get()
+    _labels.set((route, mode))
+
+def end_request(started, status_code, content_length=None):
+    token, start = started
+    route, mode = _labels.get()
+    STAGE_SECONDS.labels(route, mode, 'request').observe(time.perf_counter() - start)
+    if content_length:
+        PAYLOAD_BYTES.labels(route, mode, 'request').observe(content_length)
+    if status_code >= 400:
+        ERRORS.labels(route, mode, 'request').inc()
+    IN_FLIGHT.labels(route).dec()
+    _labels.reset(token)
+
+@contextmanager
+def document_labels(route, mode):
+    # Para los documentos de un lote, que se procesan en hilos del pool (otro contexto)
+    token = _labels.set((route, mode))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+@contextmanager
+def stage(name, size=None):
+    """
+    Mide la duracion de una etapa (y el tamaño de sus datos, si se conoce) con
+    la ruta y el modo del pedido en curso; una excepcion cuenta como error.
+    """
+    route, mode = _labels.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        ERRORS.labels(route, mode, name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(route, mode, name).observe(time.perf_counter() - start)
+        if size is not None:
+            PAYLOAD_BYTES.labels(route, mode, name).observe(size)
+
+def observe_size(name, size):
+    route, mode = _labels.get()
+    PAYLOAD_BYTES.labels(route, mode, name).observe(size)
+
+def count_error(name):
+    route, mode = _labels.get()
+    ERRORS.labels(route, mode, name).inc()
+
+def count_timeout(target):
+    route, mode = _labels.get()
+    TIMEOUTS.labels(route, mode, target).inc()
+
+def set_breaker_state(target, value):
+    BREAKER_STATE.labels(target).set(value)
+
+def count_breaker_rejection(target):
+    BREAKER_REJECTED.labels(target).inc()
+
+def observe_replica(replica, endpoint, seconds, failure=None):
+    if seconds is not None:
+        DSS_REPLICA_SECONDS.labels(replica, endpoint).observe(seconds)
+    if failure is not None:
+        DSS_REPLICA_ERRORS.labels(replica, endpoint, failure).inc()
+
+def replica_in_flight(replica, delta):
+    DSS_REPLICA_IN_FLIGHT.labels(replica).inc(delta)
+
+def set_replica_ejected(replica, value):
+    DSS_REPLICA_EJECTED.labels(replica).set(value)
+
+def render_metrics():
+    """
+    Devuelve (cuerpo, content type) en el formato de texto de Prometheus, o
+    None si prometheus_client no esta instalado.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
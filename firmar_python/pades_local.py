@@ -0,0 +1,157 @@
+# Descripcion: Sellado PAdES-B en proceso con el certificado del servidor (sin ida y vuelta a DSS)
+# Equivalente a get_data_to_sign_own + get_signature_value_own + sign_document_own.
+import io
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+from cryptography.hazmat.primitives import serialization
+from PIL import Image
+from errors import PDFSignatureError
+from b64codec import b64decode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 'dss' firma con el servicio Java; 'python' sella en proceso (requiere pyHanko, experimental)
+SEAL_ENGINE = os.getenv('SEAL_ENGINE', 'dss')
+# Version de pyHanko con la que bench.seal_equivalence dio equivalente contra DSS. Sin ella
+# (o con otra version instalada) SEAL_ENGINE=python no tiene efecto y se sigue sellando con DSS.
+SEAL_ENGINE_VERIFIED = os.getenv('SEAL_ENGINE_VERIFIED', '')
+
+try:
+    from asn1crypto import cms, x509, keys as asn1_keys
+    from pyhanko.keys import load_certs_from_pemder_data
+    from pyhanko.pdf_utils import layout
+    from pyhanko.pdf_utils.images import PdfImage
+    from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+    from pyhanko.sign import signers
+    from pyhanko.sign.ades.api import CAdESSignedAttrSpec, SignerAttrSpec
+    from pyhanko.sign.fields import SigSeedSubFilter
+    from pyhanko.stamp import StaticStampStyle
+    from pyhanko_certvalidator.registry import SimpleCertificateStore
+    from pyhanko.version import __version__ as PYHANKO_VERSION
+    PYHANKO_AVAILABLE = True
+except ImportError:
+    PYHANKO_AVAILABLE = False
+
+def local_seal_enabled():
+    if SEAL_ENGINE != 'python':
+        return False
+    if not PYHANKO_AVAILABLE:
+        logging.warning("SEAL_ENGINE=python sin pyHanko instalado; se firma con DSS")
+        return False
+    if SEAL_ENGINE_VERIFIED != PYHANKO_VERSION:
+        logging.warning(
+            f"SEAL_ENGINE=python sin equivalencia verificada para pyHanko {PYHANKO_VERSION} "
+            "(correr bench.seal_equivalence contra DSS y fijar SEAL_ENGINE_VERIFIED); se firma con DSS"
+        )
+        return False
+    return True
+
+##################################################
+###       Firmante pyHanko del servidor        ###
+##################################################
+
+_signer_lock = threading.Lock()
+_signer_cache = (None, None)  # (version de la clave, SimpleSigner)
+
+def _pyhanko_signer(seal_signer):
+    # Se rehace solo cuando ServerSealSigner recarga la clave o el certificado
+    global _signer_cache
+    private_key, certificate_data, version = seal_signer.key_material()
+    with _signer_lock:
+        cached_version, signer = _signer_cache
+        if cached_version == version:
+            return signer
+        certs = list(load_certs_from_pemder_data(certificate_data))
+        key_der = private_key.private_bytes(
+            serialization.Encoding.DER,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        signer = signers.SimpleSigner(
+            signing_cert=certs[0],
+            signing_key=asn1_keys.PrivateKeyInfo.load(key_der),
+            cert_registry=SimpleCertificateStore.from_certs(certs)
+        )
+        _signer_cache = (version, signer)
+        return signer
+
+# Caracteres que van tal cual en el IA5String del rol (ASCII imprimible)
+_ROLE_SAFE = ''.join(chr(c) for c in range(0x20, 0x7f))
+
+def _claimed_role(stamp):
+    """
+    Atributo declarado de signer-attributes-v2 con el rol, como claimedSignerRoles
+    en DSS: id-at-role con un RoleSyntax cuyo roleName es un GeneralName URI
+    (new RoleSyntax(String) de BouncyCastle). El texto ASCII va sin cambios; el
+    resto se escapa en UTF-8 (%XX) para que siga siendo un IA5String valido.
+    """
+    role = quote(str(stamp), safe=_ROLE_SAFE).encode('ascii')
+    role_name = x509.GeneralName.load(b'\x86' + _der_length(len(role)) + role)
+    return cms.AttCertAttribute({'type': 'role', 'values': [cms.RoleSyntax({'role_name': role_name})]})
+
+def _der_length(length):
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(encoded)]) + encoded
+
+class _TimedPdfSigner(signers.PdfSigner if PYHANKO_AVAILABLE else object):
+    # La fecha de firma (/M) es la misma que se muestra en la imagen y que usaria DSS (signingDate)
+    def __init__(self, *args, signing_time, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.signing_time = signing_time
+
+    def init_signing_session(self, pdf_out, existing_fields_only=False):
+        session = super().init_signing_session(pdf_out, existing_fields_only=existing_fields_only)
+        session.system_time = self.signing_time
+        return session
+
+##################################################
+###               Sellado local                ###
+##################################################
+
+def seal_pdf(pdf_bytes, seal_signer, current_time, field_id, stamp, encoded_image):
+    """
+    Firma el campo field_id existente con la clave del servidor (PAdES-B,
+    ETSI.CAdES.detached, SHA-256) y la imagen de firma ajustada y centrada, y
+    devuelve el PDF con la firma agregada como actualizacion incremental.
+    """
+    try:
+        image = Image.open(io.BytesIO(b64decode(encoded_image)))
+        image.load()
+        stamp_style = StaticStampStyle(
+            background=PdfImage(image),
+            background_opacity=1.0,
+            border_width=0,
+            background_layout=layout.SimpleBoxLayoutRule(
+                x_align=layout.AxisAlignment.ALIGN_MID,
+                y_align=layout.AxisAlignment.ALIGN_MID,
+                margins=layout.Margins.uniform(0),
+                inner_content_scaling=layout.InnerScaling.STRETCH_TO_FIT
+            )
+        )
+        signed_attrs = None
+        if stamp:
+            signed_attrs = CAdESSignedAttrSpec(signer_attributes=SignerAttrSpec(claimed_attrs=[_claimed_role(stamp)], certified_attrs=[]))
+        metadata = signers.PdfSignatureMetadata(
+            field_name=field_id,
+            md_algorithm='sha256',
+            subfilter=SigSeedSubFilter.PADES,
+            cades_signed_attr_spec=signed_attrs
+        )
+        pdf_signer = _TimedPdfSigner(
+            metadata,
+            signer=_pyhanko_signer(seal_signer),
+            stamp_style=stamp_style,
+            signing_time=datetime.fromtimestamp(current_time / 1000, tz=timezone.utc)
+        )
+        writer = IncrementalPdfFileWriter(io.BytesIO(pdf_bytes), strict=False)
+        output = pdf_signer.sign_pdf(writer, existing_fields_only=True)
+        return output.getvalue()
+    except Exception as e:
+        logging.error(f"Error en el sellado local: {str(e)}")
+        raise PDFSignatureError("Error en el sellado local: " + str(e))
@@ -0,0 +1,83 @@
+# Descripcion: Llenado en proceso de los campos de cierre (numero y fecha) como actualizacion incremental
+# Equivalente en Python de PdfFormService.updatePdfFields del servicio Java (/pdf/update).
+import os
+import logging
+import tempfile
+import threading
+import pymupdf
+from errors import PDFCloseError
+from b64codec import count_copy
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 'python' llena el PDF en proceso; 'java' usa el endpoint /pdf/update del servicio DSS
+PDF_CLOSE_ENGINE = os.getenv('PDF_CLOSE_ENGINE', 'python')
+# MuPDF solo escribe actualizaciones incrementales sobre un archivo; se usa memoria compartida si existe
+PDF_CLOSE_TMPDIR = os.getenv('PDF_CLOSE_TMPDIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# PyMuPDF no admite uso concurrente desde varios hilos (ni con documentos distintos)
+_mupdf_lock = threading.Lock()
+
+def _fill_widget(doc, widget, value):
+    widget.field_value = str(value)
+    widget.field_flags |= pymupdf.PDF_FIELD_IS_READ_ONLY
+    # Sin borde ni colores de apariencia, como hace el servicio Java
+    widget.border_width = 0
+    widget.border_color = None
+    widget.fill_color = None
+    widget.update()
+    doc.xref_set_key(widget.xref, "F", str(pymupdf.PDF_ANNOT_IS_PRINT))
+    doc.xref_set_key(widget.xref, "H", "/N")
+    doc.xref_set_key(widget.xref, "MK", "<<>>")
+
+def fill_closing_fields(pdf_bytes, field_values):
+    """
+    Escribe field_values ({nombre: valor}) en los campos del formulario que no son
+    de firma, los deja de solo lectura y agrega los cambios como actualizacion
+    incremental: los bytes originales (y las firmas existentes) no se modifican.
+    """
+    fd, path = tempfile.mkstemp(suffix='.pdf', dir=PDF_CLOSE_TMPDIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        with _mupdf_lock:
+            doc = pymupdf.open(path)
+            try:
+                updated = set()
+                for page in doc:
+                    for widget in page.widgets():
+                        if widget.field_type == pymupdf.PDF_WIDGET_TYPE_SIGNATURE:
+                            continue
+                        if widget.field_name in field_values:
+                            _fill_widget(doc, widget, field_values[widget.field_name])
+                            updated.add(widget.field_name)
+                if updated:
+                    doc.saveIncr()
+            finally:
+                doc.close()
+        logging.debug(f"Campos de cierre actualizados: {sorted(updated)}")
+        with open(path, 'rb') as f:
+            closed_pdf = f.read()
+        count_copy(len(closed_pdf))
+    except Exception as e:
+        logging.error(f"Error al llenar los campos de cierre: {str(e)}")
+        raise PDFCloseError("Error al actualizar campos del formulario PDF")
+    finally:
+        os.remove(path)
+
+    if closed_pdf[:len(pdf_bytes)] != pdf_bytes:
+        raise PDFCloseError("La actualizacion del PDF no fue incremental")
+    return closed_pdf
+
+def read_field_values(pdf_bytes):
+    """
+    Devuelve {nombre: valor} de los campos que no son de firma (para comparar motores).
+    """
+    with _mupdf_lock, pymupdf.open(stream=pdf_bytes, filetype='pdf') as doc:
+        return {
+            widget.field_name: widget.field_value
+            for page in doc
+            for widget in page.widgets()
+            if widget.field_type != pymupdf.PDF_WIDGET_TYPE_SIGNATURE
+        }
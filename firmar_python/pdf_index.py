@@ -0,0 +1,105 @@
+# Descripcion: Indice estructural de PDFs (paginas, campos AcroForm y de firma) cacheado por hash del contenido
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from PyPDF2 import PdfReader
+from errors import PDFSignatureError
+from b64codec import b64decode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PDF_INDEX_CACHE_SIZE = int(os.getenv('PDF_INDEX_CACHE_SIZE', '64'))
+
+class PdfIndex:
+    __slots__ = ('page_count', 'field_names', 'signature_fields', 'byte_size')
+
+    def __init__(self, page_count, field_names, signature_fields, byte_size):
+        self.page_count = page_count
+        self.field_names = field_names
+        self.signature_fields = signature_fields
+        self.byte_size = byte_size
+
+    def require_signature_field(self, field_id):
+        if field_id not in self.signature_fields:
+            raise PDFSignatureError(f"El campo de firma '{field_id}' no existe en el PDF.")
+
+##################################################
+###        Lectura liviana de la estructura    ###
+##################################################
+
+def _walk_fields(fields, parent_name, inherited_type, field_names, signature_fields):
+    for ref in fields or []:
+        field = ref.get_object()
+        partial = field.get('/T')
+        if partial is None and parent_name:
+            continue
+        name = f"{parent_name}.{partial}" if parent_name and partial else (partial or parent_name)
+        field_type = field.get('/FT', inherited_type)
+        kids = field.get('/Kids')
+        # Los widgets sin /T son la parte visible del campo padre, no campos nuevos
+        if kids and any('/T' in kid.get_object() for kid in kids):
+            _walk_fields(kids, name, field_type, field_names, signature_fields)
+            continue
+        if name:
+            field_names.add(name)
+            if field_type == '/Sig':
+                signature_fields.add(name)
+
+def build_pdf_index(pdf_bytes):
+    """
+    Lee solo el trailer, el /Count del arbol de paginas y el arbol de campos del
+    AcroForm; PyPDF2 resuelve los objetos bajo demanda, el resto no se parsea.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    root = reader.trailer['/Root']
+    try:
+        page_count = int(root['/Pages']['/Count'])
+    except (KeyError, TypeError, ValueError):
+        page_count = len(reader.pages)
+
+    field_names = set()
+    signature_fields = set()
+    acroform = root.get('/AcroForm')
+    if acroform is not None:
+        _walk_fields(acroform.get_object().get('/Fields'), None, None, field_names, signature_fields)
+
+    return PdfIndex(page_count, frozenset(field_names), frozenset(signature_fields), len(pdf_bytes))
+
+##################################################
+###              Cache LRU acotado             ###
+##################################################
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_key(pdf):
+    # El hash se calcula sobre el documento tal como llega (base64 o bytes) para no decodificar en un acierto
+    if isinstance(pdf, str):
+        return 'b64:' + hashlib.sha256(pdf.encode('ascii')).hexdigest()
+    return 'raw:' + hashlib.sha256(pdf).hexdigest()
+
+def get_pdf_index(pdf):
+    key = _cache_key(pdf)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+
+    try:
+        pdf_bytes = b64decode(pdf) if isinstance(pdf, str) else pdf
+        index = build_pdf_index(pdf_bytes)
+    except Exception as e:
+        logging.error(f"Error al indexar el PDF: {str(e)}")
+        raise PDFSignatureError("No se pudo leer la estructura del PDF.")
+
+    with _cache_lock:
+        _cache[key] = index
+        _cache.move_to_end(key)
+        while len(_cache) > PDF_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
@@ -0,0 +1,246 @@
+# Descripcion: Escritura en segundo plano de los PDF firmados (antes sign.save_signed_pdf escribia dentro del pedido)
+# El escritor toma el documento, lo decodifica si hace falta y lo escribe bajo PDF_STORE_ROOT con archivo
+# temporal + rename, asi nunca queda un PDF a medio escribir. La cola esta acotada en bytes: si se llena,
+# el pedido espera (contrapresion) en lugar de acumular PDFs en memoria. Con PDF_DURABILITY=strict el
+# pedido espera hasta que el PDF esta en disco (y sincronizado si PDF_FSYNC=always).
+import os
+import time
+import uuid
+import atexit
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+from metrics import stage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###        Configuracion del escritor          ###
+##################################################
+
+# Ruta absoluta bajo el directorio de datos (ver closing_ledger.FIRMADOR_DATA_DIR)
+PDF_STORE_ROOT = os.getenv('PDF_STORE_ROOT', os.path.join(os.getenv('FIRMADOR_DATA_DIR', '/var/lib/firmador'), 'firmados'))
+# 'sharded': <root>/<ab>/<nombre>.<hash>.pdf (por defecto, sin pisadas entre lotes del mismo segundo)
+# 'content': <root>/<ab>/<cd>/<sha256>.pdf (direccionado por contenido, un documento igual se escribe una vez)
+# 'flat': <root>/<nombre> como antes (el nombre puede pisar a otro)
+PDF_STORE_LAYOUT = os.getenv('PDF_STORE_LAYOUT', 'sharded')
+# 'never' o 'always' (fsync del archivo y del directorio despues del rename)
+PDF_FSYNC = os.getenv('PDF_FSYNC', 'never')
+# 'async': el pedido no espera la escritura; 'strict': espera a que termine (y falla si falla)
+PDF_DURABILITY = os.getenv('PDF_DURABILITY', 'async')
+PDF_WRITER_THREADS = int(os.getenv('PDF_WRITER_THREADS', '2'))
+# Bytes de PDFs pendientes de escribir antes de frenar a los pedidos
+PDF_WRITER_MAX_PENDING_BYTES = int(os.getenv('PDF_WRITER_MAX_PENDING_BYTES', str(256 * 1024 * 1024)))
+# Tiempo maximo (segundos) esperando lugar en la cola
+PDF_WRITER_MAX_WAIT = float(os.getenv('PDF_WRITER_MAX_WAIT', '30'))
+
+LAYOUTS = ('sharded', 'content', 'flat')
+
+class PDFWriteError(Exception):
+    pass
+
+##################################################
+###         Ubicacion y escritura atomica      ###
+##################################################
+
+def store_path(root, layout, filename, raw):
+    """
+    Ruta final de un PDF segun el layout. filename es el nombre que armaba
+    sign.py (signed_pdf_filename + sufijo).
+    """
+    if layout == 'flat':
+        return os.path.join(root, filename)
+    digest = hashlib.sha256(raw).hexdigest()
+    if layout == 'content':
+        return os.path.join(root, digest[:2], digest[2:4], f"{digest}.pdf")
+    name = os.path.basename(filename)
+    if name.endswith('.pdf'):
+        name = name[:-4]
+    return os.path.join(root, digest[:2], f"{name}.{digest[:16]}.pdf")
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomic(path, raw, fsync=False):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(directory)
+
+##################################################
+###          Escritor en segundo plano         ###
+##################################################
+
+class _Job:
+    __slots__ = ('pdf', 'filename', 'size', 'future', 'context')
+
+    def __init__(self, pdf, filename, size):
+        self.pdf = pdf
+        self.filename = filename
+        self.size = size
+        self.future = Future()
+        # Etiquetas de metricas (ruta y modo) del pedido que origino la escritura
+        self.context = contextvars.copy_context()
+
+class PDFWriter:
+    """
+    Hilos escritores con una cola acotada por bytes pendientes. submit()
+    devuelve un Future con la ruta escrita; save() espera solo si la
+    durabilidad es 'strict'.
+    """
+    def __init__(self, root=PDF_STORE_ROOT, layout=PDF_STORE_LAYOUT, fsync=PDF_FSYNC, durability=PDF_DURABILITY,
+                 threads=PDF_WRITER_THREADS, max_pending_bytes=PDF_WRITER_MAX_PENDING_BYTES, max_wait=PDF_WRITER_MAX_WAIT):
+        if layout not in LAYOUTS:
+            raise ValueError(f"PDF_STORE_LAYOUT invalido: {layout}")
+        if fsync not in ('never', 'always'):
+            raise ValueError(f"PDF_FSYNC invalido: {fsync}")
+        if durability not in ('async', 'strict'):
+            raise ValueError(f"PDF_DURABILITY invalido: {durability}")
+        self.root = root
+        self.layout = layout
+        self.fsync = fsync == 'always'
+        self.strict = durability == 'strict'
+        self.threads = threads
+        self.max_pending_bytes = max_pending_bytes
+        self.max_wait = max_wait
+        self._jobs = deque()
+        self._pending_bytes = 0
+        self._cond = threading.Condition()
+        self._workers = []
+        self._closed = False
+        self._stats = dict.fromkeys(('submitted', 'written', 'skipped', 'failed', 'waits', 'timeouts'), 0)
+        self._wait_time_total = 0.0
+
+    def _start(self):
+        # Los hilos arrancan con la primera escritura (en mod_wsgi, dentro del proceso hijo)
+        while len(self._workers) < self.threads:
+            worker = threading.Thread(target=self._run, name=f'pdf-writer-{len(self._workers)}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, pdf, filename):
+        """
+        Encola un PdfPayload. Si hay mas de max_pending_bytes pendientes espera
+        a que se libere lugar (a lo sumo max_wait segundos).
+        """
+        size = pdf.nbytes
+        job = _Job(pdf, filename, size)
+        with self._cond:
+            if self._closed:
+                raise PDFWriteError("El escritor de PDFs esta cerrado")
+            self._start()
+            # Un PDF mas grande que el tope entra igual cuando la cola esta vacia
+            if self._pending_bytes and self._pending_bytes + size > self.max_pending_bytes:
+                self._stats['waits'] += 1
+                started = time.monotonic()
+                with stage('save_backpressure'):
+                    admitted = self._cond.wait_for(
+                        lambda: not self._pending_bytes or self._pending_bytes + size <= self.max_pending_bytes,
+                        timeout=self.max_wait,
+                    )
+                self._wait_time_total += time.monotonic() - started
+                if not admitted:
+                    self._stats['timeouts'] += 1
+                    raise PDFWriteError(f"Cola de escritura llena ({self._pending_bytes} bytes pendientes)")
+            self._pending_bytes += size
+            self._stats['submitted'] += 1
+            self._jobs.append(job)
+            self._cond.notify_all()
+        return job.future
+
+    def save(self, pdf, filename):
+        future = self.submit(pdf, filename)
+        if self.strict:
+            return future.result()
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs or self._closed)
+                if not self._jobs:
+                    return
+                job = self._jobs.popleft()
+            try:
+                path = job.context.run(self._write, job)
+            except Exception as e:
+                logging.error(f"No se pudo escribir el PDF firmado {job.filename}: {str(e)}")
+                with self._cond:
+                    self._stats['failed'] += 1
+                job.future.set_exception(PDFWriteError(str(e)))
+            else:
+                job.future.set_result(path)
+            finally:
+                with self._cond:
+                    self._pending_bytes -= job.size
+                    self._cond.notify_all()
+                # El escritor es el ultimo duenio del documento
+                job.pdf = None
+
+    def _write(self, job):
+        raw = job.pdf.raw
+        path = store_path(self.root, self.layout, job.filename, raw)
+        if self.layout != 'flat' and os.path.exists(path):
+            # Mismo contenido (y nombre) ya escrito
+            with self._cond:
+                self._stats['skipped'] += 1
+            return path
+        with stage('save', size=len(raw)):
+            write_atomic(path, raw, fsync=self.fsync)
+        with self._cond:
+            self._stats['written'] += 1
+        return path
+
+    def flush(self, timeout=None):
+        # Espera a que se escriba todo lo encolado hasta ahora
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._jobs and not self._pending_bytes, timeout=timeout)
+
+    def close(self, timeout=None):
+        """
+        Deja de aceptar escrituras y espera a que los hilos terminen lo encolado.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                queued=len(self._jobs),
+                pending_bytes=self._pending_bytes,
+                wait_time_total=round(self._wait_time_total, 6),
+                layout=self.layout,
+                fsync=self.fsync,
+                durability='strict' if self.strict else 'async',
+            )
+
+pdf_writer = PDFWriter()
+# Al terminar el proceso (mod_wsgi o uvicorn) se escriben los PDFs que quedaron en la cola
+atexit.register(pdf_writer.close)
@@ -0,0 +1,522 @@
+# Descripcion: Protocolizacion en lote (numero y fecha de cierre) de los documentos de /firmalote
+import os
+import time
+import json
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from db_pool import get_db_pool, get_async_db_pool, PoolTimeout, DB_STATEMENT_TIMEOUT
+from closing_ledger import closing_ledger, ledger_key
+from errors import PDFCloseError
+from metrics import stage, count_timeout
+from deadlines import bounded, remaining, expired, check_deadline, DeadlineExceeded
+from breaker import db_breaker
+from tracing import span
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cantidad maxima de documentos por sentencia
+PROTOCOLIZE_BATCH_SIZE = int(os.getenv('PROTOCOLIZE_BATCH_SIZE', '200'))
+
+# Errores de psycopg2 / psycopg 3 que indican la base caida o colgada (incluye statement_timeout)
+DB_OUTAGE_ERRORS = ('OperationalError', 'InterfaceError')
+DB_TIMEOUT_ERRORS = ('QueryCanceledError', 'QueryCanceled')
+
+def _is_db_outage(error, conn):
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & set(DB_TIMEOUT_ERRORS):
+        count_timeout('db')
+    return bool(getattr(conn, 'closed', 0)) or bool(names & set(DB_OUTAGE_ERRORS))
+
+def _statement_deadline():
+    # Milisegundos para SET LOCAL statement_timeout cuando el plazo del pedido es menor que el tope de la conexion
+    left = remaining()
+    if left is None or (DB_STATEMENT_TIMEOUT > 0 and left >= DB_STATEMENT_TIMEOUT):
+        return None
+    return str(max(int(left * 1000), 1))
+
+_SET_STATEMENT_TIMEOUT = "SELECT set_config('statement_timeout', %s, true)"
+
+##################################################
+###   Tiempo de bloqueo de la numeracion (DB)  ###
+##################################################
+
+class LockHoldStats:
+    """
+    Tiempo entre la primera llamada a f_documento_protocolizar de una transaccion
+    y su commit/rollback: es lo que la fila de la numeracion queda bloqueada.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._last = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+            self._last = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self._count,
+                "total_seconds": round(self._total, 6),
+                "avg_seconds": round(self._total / self._count, 6) if self._count else 0.0,
+                "max_seconds": round(self._max, 6),
+                "last_seconds": round(self._last, 6),
+            }
+
+lock_hold_stats = LockHoldStats()
+
+def _lock_released(locked_at):
+    # commit o rollback de una transaccion que llamo a f_documento_protocolizar
+    lock_hold_stats.observe(time.monotonic() - locked_at)
+
+class ProtocolResult:
+    __slots__ = ('id_doc', 'numero', 'fecha', 'error')
+
+    def __init__(self, id_doc, numero=None, fecha=None, error=None):
+        self.id_doc = id_doc
+        self.numero = numero
+        self.fecha = fecha
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def field_values(self):
+        return json.dumps({"numero": self.numero, "fecha": self.fecha})
+
+class ProtocolBatchError(PDFCloseError):
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__("Documentos sin numero: " + ", ".join(f"{r.id_doc} ({r.error})" for r in failed))
+
+def _to_result(id_doc, datos):
+    datos_json = json.loads(json.dumps(datos))
+    if datos_json['status'] == False:
+        return ProtocolResult(id_doc, error="Error al obtener fecha y numero: " + datos_json['message'])
+    return ProtocolResult(id_doc, datos_json['numero'], datos_json['fecha'])
+
+def _protocolize_statement(id_docs):
+    # Una sola sentencia y un solo viaje: SELECT f(%s), f(%s), ... devuelve una fila con una columna por documento
+    calls = ", ".join(["f_documento_protocolizar(%s)"] * len(id_docs))
+    return f"SELECT {calls}", tuple(id_docs)
+
+def _row_results(id_docs, row):
+    return [_to_result(id_doc, datos) for id_doc, datos in zip(id_docs, row)]
+
+def _chunks(id_docs):
+    for start in range(0, len(id_docs), PROTOCOLIZE_BATCH_SIZE):
+        yield id_docs[start:start + PROTOCOLIZE_BATCH_SIZE]
+
+def _transaction_error(id_doc, error):
+    return ProtocolResult(id_doc, error="Error transaccion: " + str(error))
+
+@contextmanager
+def _db_trip(to_reserve):
+    # Toda la ida a la base: conexion, reserva y commit
+    with stage('protocolize'), span('db f_documento_protocolizar', client=True, **{"db.system": "postgresql", "documents": len(to_reserve)}):
+        yield
+
+def _connect_failed(error):
+    """
+    Excepcion a lanzar cuando getconn falla. Agotar la espera del pool no es una
+    falla de la base y no cuenta para el breaker.
+    """
+    if isinstance(error, PoolTimeout):
+        db_breaker.release()
+        if expired():
+            return DeadlineExceeded('protocolize')
+    else:
+        db_breaker.record_failure()
+    return PDFCloseError("Error al conectar a la base de datos: " + str(error))
+
+class _Reservation:
+    """
+    Decisiones de una ida a la base de reserve_numbers, comunes al camino
+    sincronico y al asincrono: estos solo hacen la E/S (execute, fetchone,
+    commit, rollback, putconn) y le pasan los resultados y las excepciones.
+    """
+    def __init__(self, conn, to_reserve, all_or_nothing):
+        self.conn = conn
+        self.to_reserve = to_reserve
+        self.all_or_nothing = all_or_nothing
+        self.locked_at = None
+        self.outage = None
+        self.deadline_hit = False
+        self.discard = False
+        self.failed = []
+
+    def begin(self):
+        # Desde aca la fila de la numeracion puede quedar bloqueada; devuelve el statement_timeout a fijar
+        self.locked_at = time.monotonic()
+        return _statement_deadline()
+
+    def needs_rollback(self, error):
+        """
+        La sentencia conjunta fallo: clasifica el error y dice si hay que hacer
+        rollback antes de llamar a batch_failed.
+        """
+        if expired():
+            # statement_timeout recortado al plazo del pedido: no es una falla de la base
+            self.deadline_hit = True
+            return True
+        if _is_db_outage(error, self.conn):
+            # Sin base no tiene sentido reintentar documento por documento; la conexion se descarta
+            self.outage = error
+            return False
+        return True
+
+    def batch_failed(self, error):
+        # Lanza el error, o vuelve si hay que reintentar documento por documento
+        _lock_released(self.locked_at)
+        if self.deadline_hit:
+            raise DeadlineExceeded('protocolize') from error
+        if self.outage is not None or self.all_or_nothing:
+            raise PDFCloseError("Error transaccion: " + str(error))
+        logging.warning(f"Protocolizacion en lote fallida, se reintenta por documento: {str(error)}")
+
+    def rejects(self, results):
+        # Con all_or_nothing un documento sin numero revierte todo el lote (rollback en lugar de commit)
+        self.failed = [r for r in results if not r.ok] if self.all_or_nothing else []
+        return bool(self.failed)
+
+    def settled(self):
+        _lock_released(self.locked_at)
+        if self.failed:
+            raise ProtocolBatchError(self.failed)
+
+    def aborted(self, error):
+        self.discard = bool(getattr(self.conn, 'closed', 0))
+        if self.outage is None and _is_db_outage(error, self.conn):
+            self.outage = error
+
+    @property
+    def drop_connection(self):
+        # Tras una falla de la base la conexion no vuelve al pool (puede quedar con la transaccion abortada)
+        return self.discard or self.outage is not None
+
+    def released(self):
+        if self.outage is not None:
+            db_breaker.record_failure()
+        elif self.deadline_hit:
+            db_breaker.release()
+        else:
+            db_breaker.record_success()
+
+##################################################
+###   Un solo numero por documento (reintentos) ###
+##################################################
+
+# Reclamo de un id_doc antes de pedir su numero a la base. Un reintento
+# concurrente del mismo documento espera a que termine y encuentra el numero en
+# el registro local de cierres, en lugar de pedir otro. Primero se espera entre
+# hilos o corrutinas de este proceso, y despues se reclama en el registro de
+# cierres (SQLite compartido) para los demas procesos y workers.
+_reserving = set()
+_reserving_cond = threading.Condition()
+_reserving_async = set()
+_reserving_async_cond = None
+
+# Segundos maximos de espera por un documento reclamado por otro proceso (tambien acotados por el plazo)
+CLOSING_CLAIM_WAIT = float(os.getenv('CLOSING_CLAIM_WAIT', '60'))
+CLOSING_CLAIM_POLL = 0.05
+
+def _claim_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+def _claim_busy(id_docs, wait):
+    return PDFCloseError(f"Documentos en protocolizacion por otro proceso tras {wait:.3g}s: " + ", ".join(map(str, id_docs)))
+
+@contextmanager
+def _claim_shared(id_docs):
+    owner = _claim_owner()
+    wait = bounded(CLOSING_CLAIM_WAIT, 'protocolize')
+    give_up = time.monotonic() + wait
+    while not closing_ledger.claim(id_docs, owner):
+        if time.monotonic() >= give_up:
+            check_deadline('protocolize')
+            raise _claim_busy(id_docs, wait)
+        time.sleep(CLOSING_CLAIM_POLL)
+    try:
+        yield
+    finally:
+        closing_ledger.release(owner)
+
+@asynccontextmanager
+async def _claim_shared_async(id_docs):
+    owner = _claim_owner()
+    wait = bounded(CLOSING_CLAIM_WAIT, 'protocolize')
+    give_up = time.monotonic() + wait
+    while not await asyncio.to_thread(closing_ledger.claim, id_docs, owner):
+        if time.monotonic() >= give_up:
+            check_deadline('protocolize')
+            raise _claim_busy(id_docs, wait)
+        await asyncio.sleep(CLOSING_CLAIM_POLL)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(closing_ledger.release, owner)
+
+@contextmanager
+def _claim(id_docs):
+    keys = {ledger_key(id_doc) for id_doc in id_docs}
+    with _reserving_cond:
+        # Todos o ninguno: sin esperas cruzadas entre lotes que comparten documentos
+        _reserving_cond.wait_for(lambda: _reserving.isdisjoint(keys))
+        _reserving.update(keys)
+    try:
+        with _claim_shared(id_docs):
+            yield
+    finally:
+        with _reserving_cond:
+            _reserving.difference_update(keys)
+            _reserving_cond.notify_all()
+
+@asynccontextmanager
+async def _claim_async(id_docs):
+    global _reserving_async_cond
+    if _reserving_async_cond is None:
+        _reserving_async_cond = asyncio.Condition()
+    keys = {ledger_key(id_doc) for id_doc in id_docs}
+    async with _reserving_async_cond:
+        await _reserving_async_cond.wait_for(lambda: _reserving_async.isdisjoint(keys))
+        _reserving_async.update(keys)
+    try:
+        async with _claim_shared_async(id_docs):
+            yield
+    finally:
+        async with _reserving_async_cond:
+            _reserving_async.difference_update(keys)
+            _reserving_async_cond.notify_all()
+
+def _unique(id_docs):
+    # Un id_doc por documento (ver closing_ledger.ledger_key), en el orden pedido
+    unique = {}
+    for id_doc in id_docs:
+        unique.setdefault(ledger_key(id_doc), id_doc)
+    return list(unique.values())
+
+def _for_each(id_docs, results):
+    # El resultado de cada documento tambien bajo las otras formas de su id_doc que se pidieron
+    by_key = {ledger_key(id_doc): result for id_doc, result in results.items()}
+    return {id_doc: by_key[ledger_key(id_doc)] for id_doc in id_docs if ledger_key(id_doc) in by_key}
+
+def _split_known(id_docs):
+    # Los documentos con numero en el registro local de cierres no vuelven a la base
+    known = {
+        id_doc: ProtocolResult(id_doc, numero, fecha)
+        for id_doc, (numero, fecha, status) in closing_ledger.lookup(id_docs).items()
+    }
+    return known, [id_doc for id_doc in id_docs if id_doc not in known]
+
+def _record_reserved(known, results):
+    closing_ledger.record_reserved((r.id_doc, r.numero, r.fecha) for r in results if r.ok)
+    known.update((r.id_doc, r) for r in results)
+    return known
+
+def reserve_numbers(id_docs, all_or_nothing=False):
+    """
+    Protocoliza todos los id_doc en una transaccion corta y el menor numero de
+    viajes posible, y la confirma antes de llenar ningun PDF. Los documentos que
+    ya tienen numero en el registro local de cierres lo reutilizan sin ir a la
+    base. Devuelve {id_doc: ProtocolResult}. Con all_or_nothing, si algun
+    documento no obtiene numero se revierte todo y se lanza ProtocolBatchError.
+    """
+    unique = _unique(id_docs)
+    with _claim(unique):
+        return _for_each(id_docs, _reserve_numbers(unique, all_or_nothing))
+
+def _reserve_numbers(id_docs, all_or_nothing):
+    known, to_reserve = _split_known(id_docs)
+    if not to_reserve:
+        return known
+
+    with _db_trip(to_reserve):
+        pool = get_db_pool()
+        db_breaker.before_call()
+        try:
+            conn = pool.getconn(timeout=bounded(pool.max_wait, 'protocolize'))
+        except Exception as e:
+            raise _connect_failed(e) from e
+
+        reservation = _Reservation(conn, to_reserve, all_or_nothing)
+        try:
+            results = _protocolize(conn, reservation)
+        except Exception as e:
+            reservation.aborted(e)
+            raise
+        finally:
+            pool.putconn(conn, reservation.drop_connection)
+            reservation.released()
+
+    return _record_reserved(known, results)
+
+def _protocolize(conn, reservation):
+    results = []
+    cursor = conn.cursor()
+    try:
+        statement_timeout = reservation.begin()
+        if statement_timeout:
+            cursor.execute(_SET_STATEMENT_TIMEOUT, (statement_timeout,))
+        for chunk in _chunks(reservation.to_reserve):
+            cursor.execute(*_protocolize_statement(chunk))
+            results.extend(_row_results(chunk, cursor.fetchone()))
+    except Exception as e:
+        if reservation.needs_rollback(e):
+            conn.rollback()
+        reservation.batch_failed(e)
+        results = None
+    finally:
+        cursor.close()
+
+    if results is None:
+        return _protocolize_one_by_one(conn, reservation)
+
+    if reservation.rejects(results):
+        conn.rollback()
+    else:
+        conn.commit()
+    reservation.settled()
+    return results
+
+def _protocolize_one_by_one(conn, reservation):
+    # Si la sentencia conjunta falla se aisla el documento culpable con una transaccion por documento
+    results = []
+    for id_doc in reservation.to_reserve:
+        cursor = conn.cursor()
+        locked_at = time.monotonic()
+        try:
+            cursor.execute(*_protocolize_statement([id_doc]))
+            result = _row_results([id_doc], cursor.fetchone())[0]
+        except Exception as e:
+            conn.rollback()
+            _lock_released(locked_at)
+            results.append(_transaction_error(id_doc, e))
+            continue
+        finally:
+            cursor.close()
+        if result.ok:
+            conn.commit()
+        else:
+            conn.rollback()
+        _lock_released(locked_at)
+        results.append(result)
+    return results
+
+##################################################
+###       Protocolizacion asincrona (ASGI)     ###
+##################################################
+
+async def reserve_numbers_async(id_docs, all_or_nothing=False):
+    """
+    Igual que reserve_numbers, con el pool asincrono (psycopg 3) de sign_asgi.
+    El registro local de cierres (SQLite) se consulta y actualiza en un hilo.
+    """
+    unique = _unique(id_docs)
+    async with _claim_async(unique):
+        return _for_each(id_docs, await _reserve_numbers_async(unique, all_or_nothing))
+
+async def _reserve_numbers_async(id_docs, all_or_nothing):
+    known, to_reserve = await asyncio.to_thread(_split_known, id_docs)
+    if not to_reserve:
+        return known
+
+    with _db_trip(to_reserve):
+        pool = get_async_db_pool()
+        db_breaker.before_call()
+        try:
+            conn = await pool.getconn(timeout=bounded(pool.max_wait, 'protocolize'))
+        except Exception as e:
+            raise _connect_failed(e) from e
+
+        reservation = _Reservation(conn, to_reserve, all_or_nothing)
+        try:
+            results = await _protocolize_async(conn, reservation)
+        except Exception as e:
+            reservation.aborted(e)
+            raise
+        finally:
+            await pool.putconn(conn, reservation.drop_connection)
+            reservation.released()
+
+    return await asyncio.to_thread(_record_reserved, known, results)
+
+async def _protocolize_async(conn, reservation):
+    results = []
+    cursor = conn.cursor()
+    try:
+        statement_timeout = reservation.begin()
+        if statement_timeout:
+            await cursor.execute(_SET_STATEMENT_TIMEOUT, (statement_timeout,))
+        for chunk in _chunks(reservation.to_reserve):
+            await cursor.execute(*_protocolize_statement(chunk))
+            results.extend(_row_results(chunk, await cursor.fetchone()))
+    except Exception as e:
+        if reservation.needs_rollback(e):
+            await conn.rollback()
+        reservation.batch_failed(e)
+        results = None
+    finally:
+        await cursor.close()
+
+    if results is None:
+        return await _protocolize_one_by_one_async(conn, reservation)
+
+    if reservation.rejects(results):
+        await conn.rollback()
+    else:
+        await conn.commit()
+    reservation.settled()
+    return results
+
+async def _protocolize_one_by_one_async(conn, reservation):
+    results = []
+    for id_doc in reservation.to_reserve:
+        cursor = conn.cursor()
+        locked_at = time.monotonic()
+        try:
+            await cursor.execute(*_protocolize_statement([id_doc]))
+            result = _row_results([id_doc], await cursor.fetchone())[0]
+        except Exception as e:
+            await conn.rollback()
+            _lock_released(locked_at)
+            results.append(_transaction_error(id_doc, e))
+            continue
+        finally:
+            await cursor.close()
+        if result.ok:
+            await conn.commit()
+        else:
+            await conn.rollback()
+        _lock_released(locked_at)
+        results.append(result)
+    return results
+
+def mark_closed(id_doc):
+    closing_ledger.mark_filled(id_doc)
+
+def mark_not_filled(id_doc, reservations, reason):
+    """
+    Documento de un lote con numero reservado que no llego a entregarse (fallo
+    su firma o el lote se corto antes): queda como fill_failed con el motivo en
+    /cierres_pendientes, y un reintento reutiliza el numero.
+    """
+    reservation = reservations.get(id_doc)
+    if reservation is not None and reservation.ok:
+        mark_close_failed(id_doc, reason)
+
+def mark_close_failed(id_doc, error):
+    # El numero queda reservado en el registro: un reintento lo reutiliza
+    logging.error(f"Llenado del PDF fallido para el documento {id_doc} con numero reservado: {error}")
+    closing_ledger.mark_fill_failed(id_doc, error)
@@ -0,0 +1,209 @@
+# Descripcion: Formato de las respuestas con PDFs firmados segun lo que pide el cliente (Accept / Accept-Encoding)
+# - Un documento: JSON con el PDF en base64 (por defecto) o el PDF binario con Accept: application/pdf
+# - Lote: JSON, NDJSON (?stream=1 o Accept: application/x-ndjson), ZIP (Accept: application/zip) o
+#   multipart/mixed (Accept: multipart/mixed); NDJSON, ZIP y multipart se emiten en streaming
+# - Las respuestas JSON se comprimen con brotli o gzip si el cliente lo anuncia en Accept-Encoding
+# Los errores siguen respondiendo JSON con su codigo HTTP en todos los formatos.
+import os
+import io
+import json
+import gzip
+import time
+import uuid
+import zipfile
+from metrics import stage
+from b64codec import count_copy
+from dotenv import load_dotenv
+
+# brotli es opcional; sin el paquete solo se ofrece gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+load_dotenv()
+
+##################################################
+###        Configuracion de las respuestas     ###
+##################################################
+
+JSON_MIMETYPE = 'application/json'
+PDF_MIMETYPE = 'application/pdf'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ZIP_MIMETYPE = 'application/zip'
+MULTIPART_MIXED_MIMETYPE = 'multipart/mixed'
+
+# 0 desactiva la compresion de las respuestas JSON
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', '1') not in ('0', 'false', 'False')
+# Respuestas mas chicas que esto no se comprimen (errores, estados)
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '5'))
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '4'))
+
+# Preferencia del servidor cuando el cliente acepta ambas con la misma calidad
+ENCODINGS = ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',)
+
+##################################################
+###          Negociacion del formato           ###
+##################################################
+
+def wants_pdf(accept_mimetypes):
+    # Un documento: PDF binario solo si el cliente lo prefiere a JSON
+    return accept_mimetypes.best_match([JSON_MIMETYPE, PDF_MIMETYPE]) == PDF_MIMETYPE
+
+def batch_stream(args, accept_mimetypes):
+    """
+    Formato en streaming para /firmalote, o None para la respuesta JSON de
+    siempre. ?stream=1 sigue pidiendo NDJSON.
+    """
+    if args.get('stream', '').lower() in ('1', 'true'):
+        return NdjsonBatchStream()
+    match accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE, ZIP_MIMETYPE, MULTIPART_MIXED_MIMETYPE]):
+        case 'application/x-ndjson':
+            return NdjsonBatchStream()
+        case 'application/zip':
+            return ZipBatchStream()
+        case 'multipart/mixed':
+            return MultipartBatchStream()
+    return None
+
+def pdf_headers(filename):
+    return {'Content-Disposition': f'attachment; filename="{filename}"'}
+
+##################################################
+###         Lotes en streaming (encoders)      ###
+##################################################
+
+# Cada encoder devuelve los bytes a enviar por documento firmado, por documento
+# fallido y al final del lote; sign.stream_batch y sign_asgi los comparten.
+
+class NdjsonBatchStream:
+    """
+    Una linea JSON por documento (con su 'index') y una linea final de resumen.
+    """
+    mimetype = NDJSON_MIMETYPE
+
+    def document(self, index, pdf):
+        return (json.dumps({"index": index, "status": True, "pdf": pdf.b64}) + "\n").encode('utf-8')
+
+    def error(self, index, message):
+        return (json.dumps({"index": index, "status": False, "message": message}) + "\n").encode('utf-8')
+
+    def done(self, status, errors):
+        return (json.dumps({"done": True, "status": status, "errors": errors}) + "\n").encode('utf-8')
+
+class _ChunkWriter(io.RawIOBase):
+    # Destino no posicionable de zipfile: junta lo escrito hasta que se envia
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ZipBatchStream:
+    """
+    ZIP armado a medida que terminan los documentos: '<index>.pdf' por cada
+    documento firmado y al final 'lote.json' con el estado y los errores.
+    Las entradas van sin comprimir (los PDF ya vienen comprimidos).
+    """
+    mimetype = ZIP_MIMETYPE
+    manifest_name = 'lote.json'
+
+    def __init__(self):
+        self._writer = _ChunkWriter()
+        self._zip = zipfile.ZipFile(self._writer, mode='w', compression=zipfile.ZIP_STORED)
+        self._errors = []
+
+    def _entry(self, name, data):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        self._zip.writestr(info, data)
+        return self._writer.take()
+
+    def document(self, index, pdf):
+        # Como en MultipartBatchStream: la entrada se arma en una copia del PDF (take)
+        count_copy(len(pdf.raw))
+        return self._entry(f"{index}.pdf", pdf.raw)
+
+    def error(self, index, message):
+        self._errors.append({"index": index, "message": message})
+        return b''
+
+    def done(self, status, errors):
+        manifest = json.dumps({"status": status, "errors": self._errors}).encode('utf-8')
+        data = self._entry(self.manifest_name, manifest)
+        self._zip.close()
+        return data + self._writer.take()
+
+class MultipartBatchStream:
+    """
+    multipart/mixed: una parte application/pdf por documento firmado (filename
+    '<index>.pdf'), una parte JSON por documento fallido y una parte JSON final
+    con el resumen, como las lineas del NDJSON.
+    """
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+        self.mimetype = f'{MULTIPART_MIXED_MIMETYPE}; boundary={self.boundary}'
+
+    def _part(self, content_type, body, filename=None):
+        headers = f"--{self.boundary}\r\nContent-Type: {content_type}\r\n"
+        if filename:
+            headers += f'Content-Disposition: attachment; filename="{filename}"\r\n'
+        return headers.encode('ascii') + b"\r\n" + body + b"\r\n"
+
+    def document(self, index, pdf):
+        count_copy(len(pdf.raw))
+        return self._part(PDF_MIMETYPE, pdf.raw, f"{index}.pdf")
+
+    def error(self, index, message):
+        return self._part(JSON_MIMETYPE, json.dumps({"index": index, "status": False, "message": message}).encode('utf-8'))
+
+    def done(self, status, errors):
+        summary = json.dumps({"done": True, "status": status, "errors": errors}).encode('utf-8')
+        return self._part(JSON_MIMETYPE, summary) + f"--{self.boundary}--\r\n".encode('ascii')
+
+##################################################
+###         Compresion de respuestas JSON      ###
+##################################################
+
+def response_encoding(response, accept_encodings):
+    """
+    Content-Encoding a aplicar a una respuesta JSON ya armada, o None. Solo se
+    comprime JSON: los PDF y los lotes en streaming (NDJSON/ZIP/multipart) no.
+    """
+    if not RESPONSE_COMPRESSION or response.mimetype != JSON_MIMETYPE:
+        return None
+    if 'Content-Encoding' in response.headers:
+        return None
+    return accept_encodings.best_match(ENCODINGS)
+
+def compress(data, encoding):
+    with stage(f'compress_{encoding}', size=len(data)):
+        if encoding == 'br':
+            return brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+def set_compressed(response, data, encoding):
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.add('Vary', 'Accept-Encoding')
+    return response
+
+def compress_response(response, accept_encodings):
+    # after_request de la app Flask
+    encoding = response_encoding(response, accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    return set_compressed(response, compress(data, encoding), encoding)
@@ -0,0 +1,228 @@
+# Descripcion: Almacen de sesiones de firma para el flujo /firma_init -> /firma_valor
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict
+from signing_state import SigningState
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###        Configuracion de las sesiones       ###
+##################################################
+
+# 'memory' (LRU en el proceso) o 'sqlite' (compartido entre procesos de mod_wsgi)
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', os.path.join(tempfile.gettempdir(), 'firmador_sessions.db'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', '600'))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', str(256 * 1024 * 1024)))
+# PDFs mas grandes que este umbral se guardan en disco mientras se espera la firma del token
+SESSION_SPILL_BYTES = int(os.getenv('SESSION_SPILL_BYTES', str(1024 * 1024)))
+SESSION_SPILL_DIR = os.getenv('SESSION_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'firmador_sessions'))
+# Solo para clientes viejos: /firma_valor sin session_id usa la ultima sesion creada en el proceso.
+# Con pedidos concurrentes puede completar el documento de otro usuario; apagado por defecto.
+SESSION_LEGACY_FALLBACK = os.getenv('SESSION_LEGACY_FALLBACK', 'false').lower() in ('1', 'true', 'yes')
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+##################################################
+###       Volcado a disco de PDFs grandes      ###
+##################################################
+
+class _Spill:
+    def __init__(self, spill_dir, threshold):
+        self.spill_dir = spill_dir
+        self.threshold = threshold
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.pdf.b64")
+
+    def store(self, session_id, record):
+        # Devuelve el registro a guardar; el PDF queda en disco si supera el umbral
+        pdf_b64 = record.get('pdf_b64')
+        if pdf_b64 is None or len(pdf_b64) <= self.threshold:
+            return record, False
+        path = self.path(session_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='ascii') as f:
+            f.write(pdf_b64)
+        os.replace(tmp_path, path)
+        return dict(record, pdf_b64=None), True
+
+    def load(self, session_id, record, spilled):
+        if not spilled:
+            return record
+        with open(self.path(session_id), 'r', encoding='ascii') as f:
+            return dict(record, pdf_b64=f.read())
+
+    def discard(self, session_id, spilled):
+        if spilled:
+            try:
+                os.remove(self.path(session_id))
+            except FileNotFoundError:
+                pass
+
+def _record_size(record):
+    return sum(len(value) for value in record.values() if isinstance(value, str))
+
+##################################################
+###            Backend en memoria (LRU)        ###
+##################################################
+
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES, spill_dir=SESSION_SPILL_DIR, spill_bytes=SESSION_SPILL_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._spill = _Spill(spill_dir, spill_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, session_id):
+        expires_at, record, spilled, size = self._entries.pop(session_id)
+        self._bytes -= size
+        self._spill.discard(session_id, spilled)
+
+    def _evict(self, now):
+        for session_id in [sid for sid, entry in self._entries.items() if entry[0] <= now]:
+            self._drop(session_id)
+        while self._entries and self._bytes > self.max_bytes:
+            session_id = next(iter(self._entries))
+            logging.warning(f"Sesion de firma {session_id} descartada por limite de memoria")
+            self._drop(session_id)
+
+    def put(self, session_id, state):
+        record, spilled = self._spill.store(session_id, asdict(state))
+        size = _record_size(record)
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+            now = time.monotonic()
+            self._entries[session_id] = (now + self.ttl, record, spilled, size)
+            self._bytes += size
+            self._evict(now)
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(session_id)
+                return None
+            self._entries.move_to_end(session_id)
+            expires_at, record, spilled, size = entry
+        return SigningState(**self._spill.load(session_id, record, spilled))
+
+    def contains(self, session_id):
+        # Si la sesion sigue esperando /firma_valor, sin leer el PDF
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+
+##################################################
+###     Backend SQLite (compartido en disco)   ###
+##################################################
+
+class SQLiteSessionStore:
+    def __init__(self, path=SESSION_STORE_PATH, ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES, spill_dir=SESSION_SPILL_DIR, spill_bytes=SESSION_SPILL_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._spill = _Spill(spill_dir, spill_bytes)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS signing_sessions ("
+                " id TEXT PRIMARY KEY, expires_at REAL NOT NULL, record TEXT NOT NULL,"
+                " spilled INTEGER NOT NULL, size INTEGER NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        expired = conn.execute("SELECT id, spilled FROM signing_sessions WHERE expires_at <= ?", (now,)).fetchall()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM signing_sessions WHERE expires_at > ?", (now,)).fetchone()[0]
+        evicted = list(expired)
+        if total > self.max_bytes:
+            for session_id, spilled, size in conn.execute("SELECT id, spilled, size FROM signing_sessions WHERE expires_at > ? ORDER BY expires_at", (now,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                logging.warning(f"Sesion de firma {session_id} descartada por limite de memoria")
+                evicted.append((session_id, spilled))
+                total -= size
+        for session_id, spilled in evicted:
+            conn.execute("DELETE FROM signing_sessions WHERE id = ?", (session_id,))
+        return evicted
+
+    def put(self, session_id, state):
+        record, spilled = self._spill.store(session_id, asdict(state))
+        payload = json.dumps(record)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO signing_sessions (id, expires_at, record, spilled, size) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, now + self.ttl, payload, int(spilled), len(payload))
+                )
+                evicted = self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for evicted_id, evicted_spilled in evicted:
+            self._spill.discard(evicted_id, evicted_spilled)
+
+    def get(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT record, spilled FROM signing_sessions WHERE id = ? AND expires_at > ?",
+                (session_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return SigningState(**self._spill.load(session_id, json.loads(row[0]), bool(row[1])))
+
+    def contains(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM signing_sessions WHERE id = ? AND expires_at > ?",
+                (session_id, time.time())
+            ).fetchone()
+        return row is not None
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT spilled FROM signing_sessions WHERE id = ?", (session_id,)).fetchone()
+            conn.execute("DELETE FROM signing_sessions WHERE id = ?", (session_id,))
+        if row is not None:
+            self._spill.discard(session_id, bool(row[0]))
+
+def create_session_store(backend=SESSION_STORE):
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'memory':
+        return MemorySessionStore()
+    raise ValueError(f"SESSION_STORE invalido: {backend}")
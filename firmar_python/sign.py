@@ -2,15 +2,11 @@
 ###              Imports externos              ###
 ##################################################
 
-from flask import Flask, request, jsonify
-import base64
-import time as tiempo
+from flask import Flask, Response, request, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
-import os
 import json
 from datetime import *
-import pytz
-import psycopg2
 
 ##################################################
 ###              Imports propios               ###
@@ -19,9 +15,27 @@ import psycopg2
 from dss_sign import *
 from localcerts import *
 from certificates import *
-from errors import PDFSignatureError
+from errors import PDFSignatureError, PDFCloseError
 from imagecomp import *
 from createimagetostamp import *
+from dss_client import dss_post, get_dss_connection_stats, get_dss_replica_stats
+from signing_state import SigningState
+from session_store import create_session_store, new_session_id, SESSION_LEGACY_FALLBACK
+from db_pool import get_db_pool_stats
+from protocolizacion import reserve_numbers, mark_closed, mark_close_failed, mark_not_filled, lock_hold_stats, ProtocolBatchError
+from closing_ledger import closing_ledger
+from pdf_close import fill_closing_fields, PDF_CLOSE_ENGINE
+from b64codec import PdfPayload, count_document, codec_stats
+from pades_local import seal_pdf, local_seal_enabled
+from metrics import stage, start_request, end_request, set_mode, document_labels, signing_mode, render_metrics, NO_ROUTE
+from tracing import span, annotate, capture_context, use_context, start_request_span
+from batch import run_batch, iter_batch, resolve_failure_policy, BatchItemError, FAIL_FAST
+from uploads import UploadRequest, is_multipart, uploaded_pdf, batch_from_multipart, item_pdf, close_uploads
+from pdf_writer import pdf_writer
+from idempotency import idempotency_cache, caller_key, session_key, content_key, IDEMPOTENCY_HEADER, MISS
+from responses import wants_pdf, batch_stream, pdf_headers, compress_response, PDF_MIMETYPE
+from deadlines import request_deadline, start_deadline, end_deadline, current_deadline, use_deadline, check_deadline, DeadlineExceeded
+from breaker import dss_breaker, db_breaker, CircuitOpenError
 
 load_dotenv()
 
@@ -30,6 +44,10 @@ load_dotenv()
 ##################################################
 
 app = Flask(__name__)
+# Las partes binarias de multipart se vuelcan a archivos temporales con tope de tamaño (ver uploads.py)
+app.request_class = UploadRequest
+# Los campos de texto del multipart (firma_info, lote) no tienen el tope de 500 KB de Flask
+app.config['MAX_FORM_MEMORY_SIZE'] = None
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -41,39 +59,35 @@ if __name__ == '__main__':
 ###            Variables globales              ###
 ##################################################
 
-datetimesigned = None
-pdf = None
-current_time = None
-certificates = None
-signed_pdf_filename = None
-field_id = None
-stamp = None
-area = None
-name = None
-custom_image = None
-pdf_b64 = None
-isdigital = None
-isclosing = None
-closingplace = None
-json_fieldValues = None
-idDoc = None
+# Estado del flujo en dos pasos /firma_init -> /firma_valor, indexado por session_id
+session_store = create_session_store()
+# Ultima sesion creada en este proceso, solo con SESSION_LEGACY_FALLBACK (clientes que no envian session_id)
+last_session_id = None
 
 ##################################################
 ###         Imagen de firma en base64          ###
 ##################################################
 
-encoded_image = encode_image("logo_tribunal_para_tapir_250px.png")
+LOGO_PATH = "logo_tribunal_para_tapir_250px.png"
+encoded_image = encode_image(LOGO_PATH)
+if encoded_image is None:
+    logging.error(f"No se pudo cargar el logo de la firma: {LOGO_PATH}")
+
+def render_signature(text, path):
+    # El renderer se arma en el primer uso (get_signature_renderer): sin el logo falla el pedido, no la importacion
+    if encoded_image is None:
+        raise PDFSignatureError(f"No se pudo cargar el logo de la firma: {LOGO_PATH}")
+    return get_signature_renderer(encoded_image).render(text, path)
 #compressedimage = compressed_image_encoded("logo_tribunal_para_tapir.png")
 
 ##################################################
 ###         Funcion de guardado de PDF         ###
 ##################################################
 
-def save_signed_pdf(signed_pdf_base64, filename):
+def save_signed_pdf(signed_pdf, filename):
+    # La escritura queda a cargo de pdf_writer (segundo plano); el pedido solo la espera con PDF_DURABILITY=strict
     try:
-        signed_pdf_bytes = base64.b64decode(signed_pdf_base64)
-        with open(filename, 'wb') as f:
-            f.write(signed_pdf_bytes)
+        pdf_writer.save(PdfPayload.of(signed_pdf), filename)
     except Exception as e:
         logging.error(f"Error in save_signed_pdf: {str(e)}")
         raise PDFSignatureError("Failed to save signed PDF.")
@@ -82,323 +96,629 @@ def save_signed_pdf(signed_pdf_base64, filename):
 ###     Rutas de la aplicacion para Tapir      ###
 ##################################################
 
-@app.route('/firma_init', methods=['POST'])
-def get_certificates():
-    global pdf_b64, current_time, certificates, field_id, stamp, area, name, datetimesigned, custom_image, isdigital, isclosing, closingplace, signed_pdf_filename, idDoc
-    
-    try:   
-        request._load_form_data()
-        pdf_b64 = request.form.get('pdf')
-        now = datetime.now()
-        signed_pdf_filename = now.strftime("pdf_%d/%m/%Y_%H%M%S")
+def read_firma_init(form):
+    """
+    Valida los campos de /firma_init y arma el estado del documento (tambien
+    lo usa sign_asgi, con el formulario ya leido).
+    """
+    state = SigningState(pdf_b64=form.get('pdf'))
+    now = datetime.now()
+    state.signed_pdf_filename = now.strftime("pdf_%d/%m/%Y_%H%M%S")
 
-        firma_info_str = request.form.get('firma_info', '')
-        if not firma_info_str:
-            raise PDFSignatureError("El campo 'firma_info' está vacío o falta.")
+    firma_info_str = form.get('firma_info', '')
+    if not firma_info_str:
+        raise PDFSignatureError("El campo 'firma_info' está vacío o falta.")
 
-        try:
-            sign_info = json.loads(firma_info_str)
-        except json.JSONDecodeError:
-            raise PDFSignatureError("Formato JSON inválido para 'firma_info'.")
-        
-        isdigital = sign_info.get('firma_digital')
+    try:
+        sign_info = json.loads(firma_info_str)
+    except json.JSONDecodeError:
+        raise PDFSignatureError("Formato JSON inválido para 'firma_info'.")
+    
+    state.isdigital = sign_info.get('firma_digital')
 
-        # Solo intentar cargar y verificar 'certificados' si 'isdigital' es verdadero
-        if isdigital:
-        # Verificar que el campo 'certificados' esté presente y no esté vacío
-            certificados_str = request.form.get('certificados', '')
-            if not certificados_str and isdigital:
-                raise PDFSignatureError("El campo 'certificados' está vacío o falta.")
+    # Solo intentar cargar y verificar 'certificados' si 'isdigital' es verdadero
+    if state.isdigital:
+    # Verificar que el campo 'certificados' esté presente y no esté vacío
+        certificados_str = form.get('certificados', '')
+        if not certificados_str and state.isdigital:
+            raise PDFSignatureError("El campo 'certificados' está vacío o falta.")
 
-            # Intentar analizar el campo 'certificados' como JSON
-            try:
-                certificates = json.loads(certificados_str)
-            except json.JSONDecodeError:
-                raise PDFSignatureError("Formato JSON inválido para 'certificados'.")
-        
+        # Intentar analizar el campo 'certificados' como JSON
         try:
-            signed_pdf_filename = request.form.get('file_name')
-        except KeyError:
-            raise PDFSignatureError("El campo file_name is missing")
-        
-        field_id = sign_info.get('firma_lugar')
-        name = sign_info.get('firma_nombre')
-        stamp = sign_info.get('firma_sello')
-        area = sign_info.get('firma_area')
-        
-        isclosing = sign_info.get('firma_cierra')
-        closingplace = sign_info.get('firma_lugarcierre')
-        idDoc = sign_info.get('id_doc')
-
-        current_time = int(tiempo.time() * 1000)
-        datetimesigned = datetime.now(pytz.utc).astimezone(pytz.timezone('America/Argentina/Buenos_Aires')).strftime("%Y-%m-%d %H:%M:%S")
-
-        if not field_id or not stamp or not area:
-            raise PDFSignatureError("firma_info is missing required fields")
-
-        if isdigital:
-            name = extract_certificate_info_name(certificates['certificate'])
-
-        custom_image = create_signature_image(
-                        f"{name}\n{datetimesigned}\n{stamp}\n{area}",
-                        encoded_image,
-                        "token"
-                    )   
-
-        match (isdigital, isclosing):
+            state.certificates = json.loads(certificados_str)
+        except json.JSONDecodeError:
+            raise PDFSignatureError("Formato JSON inválido para 'certificados'.")
+    
+    try:
+        state.signed_pdf_filename = form.get('file_name')
+    except KeyError:
+        raise PDFSignatureError("El campo file_name is missing")
+    
+    state.field_id = sign_info.get('firma_lugar')
+    state.name = sign_info.get('firma_nombre')
+    state.stamp = sign_info.get('firma_sello')
+    state.area = sign_info.get('firma_area')
+    
+    state.isclosing = sign_info.get('firma_cierra')
+    state.closingplace = sign_info.get('firma_lugarcierre')
+    state.id_doc = sign_info.get('id_doc')
+
+    state.stamp_time()
+
+    if not state.field_id or not state.stamp or not state.area:
+        raise PDFSignatureError("firma_info is missing required fields")
+
+    if state.isdigital:
+        state.name = extract_certificate_info_name(state.certificates['certificate'], state.certificates.get('certificateChain'))
+    return state
+
+class SessionNotFound(Exception):
+    pass
+
+def document_response(pdf, id_doc, outcome=MISS):
+    # PDF firmado en JSON (base64) o binario si el cliente pide Accept: application/pdf (ver responses.py)
+    if wants_pdf(request.accept_mimetypes):
+        response = Response(pdf.raw, mimetype=PDF_MIMETYPE, headers=pdf_headers(f"{id_doc}.pdf"))
+    else:
+        response = jsonify({"status": True, "pdf": pdf.b64})
+    return replayed(response, outcome)
+
+def replayed(response, outcome):
+    # Resultado de un pedido anterior con la misma clave (ver idempotency.py)
+    if outcome != MISS:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def firma_init_key(form, headers, state, pdf):
+    if headers.get(IDEMPOTENCY_HEADER):
+        return caller_key('/firma_init', headers[IDEMPOTENCY_HEADER])
+    certificate = state.certificates['certificate'] if state.isdigital else None
+    return content_key('/firma_init', pdf, json.loads(form['firma_info']), certificate)
+
+def session_pending(result):
+    # Un data_to_sign solo se reusa mientras su sesion siga esperando /firma_valor
+    return not isinstance(result, dict) or session_store.contains(result["session_id"])
+
+def init_document(pdf, state):
+    """
+    Firma con sello (devuelve el PDF) o prepara la firma con token (devuelve
+    data_to_sign y la sesion para /firma_valor).
+    """
+    global last_session_id
+    with count_document(state.id_doc):
+        match (state.isdigital, state.isclosing):
             case (True, True):
-                data_to_sign_response = get_data_to_sign_tapir(pdf_b64, certificates, current_time, field_id, stamp, custom_image)
+                data_to_sign_response = get_data_to_sign_tapir(pdf, state.certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
                 data_to_sign = data_to_sign_response["bytes"]
             case (True, False):
-                data_to_sign_response = get_data_to_sign_tapir(pdf_b64, certificates, current_time, field_id, stamp, custom_image)
+                data_to_sign_response = get_data_to_sign_tapir(pdf, state.certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
                 data_to_sign = data_to_sign_response["bytes"]
             case (False, True):
-                signed_pdf_base64 = signown(pdf_b64, False)
-                lastpdf, code = get_number_and_date_then_close(signed_pdf_base64, idDoc)
-                if code == 500:
-                    response = lastpdf.get_json()
-                    if response['status'] == "error":
-                        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + response['message']}), 500
-                signed_pdf_base64_closed = signown(lastpdf, True)
-                save_signed_pdf(signed_pdf_base64_closed, signed_pdf_filename+"signEandclose.pdf")
+                signed_pdf = signown(pdf, False, state)
+                lastpdf = get_number_and_date_then_close(signed_pdf, state)
+                signed_pdf_closed = signown(lastpdf, True, state)
+                save_signed_pdf(signed_pdf_closed, state.signed_pdf_filename+"signEandclose.pdf")
+                return signed_pdf_closed
             case (False, False):
-                signed_pdf_base64_closed = signown(pdf_b64, False)
-                save_signed_pdf(signed_pdf_base64_closed, signed_pdf_filename+"signE.pdf")
-        
-        if isdigital:
-            return jsonify({"status": True, "data_to_sign": data_to_sign}), 200
+                signed_pdf_closed = signown(pdf, False, state)
+                save_signed_pdf(signed_pdf_closed, state.signed_pdf_filename+"signE.pdf")
+                return signed_pdf_closed
+
+    session_id = new_session_id()
+    state.pdf_b64 = pdf.b64
+    session_store.put(session_id, state)
+    if SESSION_LEGACY_FALLBACK:
+        last_session_id = session_id
+    return {"data_to_sign": data_to_sign, "session_id": session_id}
+
+@app.route('/firma_init', methods=['POST'])
+def get_certificates():
+    try:   
+        with stage('parse'):
+            request._load_form_data()
+        state = read_firma_init(request.form)
+        set_mode(signing_mode(state.isdigital, state.isclosing))
+        annotate(signing_mode=signing_mode(state.isdigital, state.isclosing), id_doc=state.id_doc)
+
+        state.custom_image = render_signature(
+                        f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
+                        "token"
+                    )   
+
+        # El PDF viaja como PdfPayload: base64 solo en los bordes HTTP (ver b64codec.py)
+        # El PDF llega en base64 (campo 'pdf' del formulario) o binario (parte 'pdf' de un multipart)
+        pdf = uploaded_pdf(request.files) or PdfPayload.from_b64(state.pdf_b64)
+        # Un reenvio del mismo documento espera al original o reusa su resultado (ver idempotency.py)
+        key = firma_init_key(request.form, request.headers, state, pdf)
+        result, outcome = idempotency_cache.run(key, lambda: init_document(pdf, state), valid=session_pending)
+
+        if state.isdigital:
+            return replayed(jsonify({"status": True, "data_to_sign": result["data_to_sign"], "session_id": result["session_id"]}), outcome)
         else:
-            return jsonify({"status": True, "pdf": signed_pdf_base64_closed}), 200
+            return document_response(result, state.id_doc, outcome)
         
+    except PDFCloseError as e:
+        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + str(e)}), 500
     except PDFSignatureError as e:
         return jsonify({"status": "error", "message": "Error en get_certificates: " + str(e)}), 500
+    except (RequestEntityTooLarge, DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         logging.error(f"Unexpected error in get_certificates: {str(e)}")
         return jsonify({"status": "error", "message": "An unexpected error occurred in get_certificates."}), 500
 
-@app.route('/firma_valor', methods=['POST'])
-def sign_pdf_firmas():
-    try:
-
-        signature_value = request.get_json()['signatureValue']
-        signed_pdf_response = sign_document_tapir(pdf_b64, signature_value, certificates, current_time, field_id, stamp, custom_image)
-        signed_pdf_base64 = signed_pdf_response['bytes']
-
-        match (isdigital, isclosing):
+def finish_signing(session_id, signature_value):
+    """
+    Completa la firma con token de una sesion de /firma_init. Devuelve el PDF
+    firmado (y cerrado, si corresponde) y el id_doc.
+    """
+    state = session_store.get(session_id) if session_id else None
+    if state is None:
+        raise SessionNotFound(session_id)
+    set_mode(signing_mode(state.isdigital, state.isclosing))
+    annotate(signing_mode=signing_mode(state.isdigital, state.isclosing), id_doc=state.id_doc)
+    with count_document(state.id_doc):
+        signed_pdf_response = sign_document_tapir(PdfPayload.from_b64(state.pdf_b64), signature_value, state.certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+        signed_pdf = PdfPayload.from_b64(signed_pdf_response['bytes'])
+
+        match (state.isdigital, state.isclosing):
             case (True, True):
-                lastpdf, code = get_number_and_date_then_close(signed_pdf_base64, idDoc)
-                if code == 500:
-                    response = lastpdf.get_json()
-                    if response['status'] == "error":
-                        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + response['message']}), 500
-                lastsignedpdf = signown(lastpdf, True)
-                save_signed_pdf(lastsignedpdf, signed_pdf_filename+"signDandclose.pdf")
-                return jsonify({"status": True, "pdf": lastsignedpdf}), 200
+                lastpdf = get_number_and_date_then_close(signed_pdf, state)
+                lastsignedpdf = signown(lastpdf, True, state)
+                save_signed_pdf(lastsignedpdf, state.signed_pdf_filename+"signDandclose.pdf")
+                session_store.delete(session_id)
+                return lastsignedpdf, state.id_doc
             case (True, False):
-                save_signed_pdf(signed_pdf_base64, signed_pdf_filename+"signD.pdf")
-                return jsonify({"status": True, "pdf": signed_pdf_base64}), 200
+                save_signed_pdf(signed_pdf, state.signed_pdf_filename+"signD.pdf")
+                session_store.delete(session_id)
+                return signed_pdf, state.id_doc
 
+@app.route('/firma_valor', methods=['POST'])
+def sign_pdf_firmas():
+    try:
+        with stage('parse'):
+            body = request.get_json()
+        session_id = body.get('session_id')
+        if not session_id:
+            if not SESSION_LEGACY_FALLBACK:
+                return jsonify({"status": "error", "message": "Falta session_id (lo devuelve /firma_init)."}), 400
+            logging.warning("firma_valor sin session_id, se usa la ultima sesion del proceso")
+            session_id = last_session_id
+        signature_value = body['signatureValue']
+        # Un reenvio con la misma sesion devuelve el PDF ya firmado aunque la sesion ya no exista
+        if request.headers.get(IDEMPOTENCY_HEADER):
+            key = caller_key('/firma_valor', request.headers[IDEMPOTENCY_HEADER])
+        else:
+            key = session_key(session_id) if session_id else None
+        (signed_pdf, id_doc), outcome = idempotency_cache.run(key, lambda: finish_signing(session_id, signature_value))
+        return document_response(signed_pdf, id_doc, outcome)
+
+    except SessionNotFound:
+        return jsonify({"status": "error", "message": "La sesion de firma no existe o expiro."}), 404
+    except PDFCloseError as e:
+        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + str(e)}), 500
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         logging.error(f"Unexpected error in sign_pdf_firmas: {str(e)}")
         return jsonify({"status": "error", "message": "An unexpected error occurred in sign_pdf_firmas."}), 500
 
+##################################################
+###          Metricas Prometheus (/metrics)     ###
+##################################################
+
+@app.before_request
+def deadline_before_request():
+    # Plazo del pedido: X-Request-Timeout o el valor por defecto de la ruta (ver deadlines.py)
+    g.deadline_token = start_deadline(request_deadline(request.headers, request.path))
+
+@app.teardown_request
+def deadline_teardown_request(error):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        end_deadline(token)
+
+@app.before_request
+def metrics_before_request():
+    g.metrics_request = start_request(request.url_rule.rule if request.url_rule else NO_ROUTE)
+
+@app.after_request
+def metrics_after_request(response):
+    started = g.pop('metrics_request', None)
+    if started is not None:
+        end_request(started, response.status_code, request.content_length)
+    return response
+
+@app.teardown_request
+def metrics_teardown_request(error):
+    # Solo si after_request no llego a ejecutarse (excepcion no manejada)
+    started = g.pop('metrics_request', None)
+    if started is not None:
+        end_request(started, 500)
+
+@app.before_request
+def tracing_before_request():
+    g.trace_request = start_request_span(request.method, request.url_rule.rule if request.url_rule else NO_ROUTE, request.headers)
+
+@app.after_request
+def tracing_after_request(response):
+    trace_request = g.pop('trace_request', None)
+    if trace_request is not None:
+        trace_request.detach(status_code=response.status_code)
+        # En streaming (NDJSON, ZIP, multipart) el pedido termina cuando se envio el ultimo documento
+        if response.is_streamed:
+            response.call_on_close(trace_request.end)
+        else:
+            trace_request.end()
+    return response
+
+@app.teardown_request
+def tracing_teardown_request(error):
+    trace_request = g.pop('trace_request', None)
+    if trace_request is not None:
+        trace_request.detach(status_code=500, error=error)
+        trace_request.end()
+
+@app.after_request
+def compress_after_request(response):
+    # JSON con brotli/gzip segun Accept-Encoding
+    return compress_response(response, request.accept_encodings)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"status": "error", "message": e.description}), 413
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    return jsonify({"status": "error", "message": str(e)}), 504
+
+@app.errorhandler(CircuitOpenError)
+def circuit_open(e):
+    # DSS o la base estan marcados como caidos: se responde enseguida en lugar de esperar el timeout
+    return jsonify({"status": "error", "message": str(e)}), 503, {"Retry-After": str(int(e.retry_after + 0.5))}
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({"status": False, "message": "prometheus_client no esta instalado"}), 501
+    payload, content_type = rendered
+    return Response(payload, content_type=content_type)
+
+@app.route('/estado_dss', methods=['GET'])
+def dss_connection_stats():
+    return jsonify({
+        "status": True,
+        "connections": get_dss_connection_stats(),
+        "replicas": get_dss_replica_stats(),
+        "breaker": dss_breaker.stats()
+    }), 200
+
+@app.route('/estado_db', methods=['GET'])
+def db_pool_stats():
+    return jsonify({
+        "status": True,
+        "pool": get_db_pool_stats(),
+        "lock_hold": lock_hold_stats.snapshot(),
+        "pending_closes": len(closing_ledger.pending()),
+        "breaker": db_breaker.stats()
+    }), 200
+
+@app.route('/estado_codec', methods=['GET'])
+def codec_stats_route():
+    return jsonify({"status": True, "codec": codec_stats()}), 200
+
+@app.route('/estado_pdfs', methods=['GET'])
+def pdf_writer_stats():
+    return jsonify({"status": True, "writer": pdf_writer.stats()}), 200
+
+@app.route('/estado_idempotencia', methods=['GET'])
+def idempotency_stats():
+    return jsonify({"status": True, "cache": idempotency_cache.stats()}), 200
+
+@app.route('/estado_certificados', methods=['GET'])
+def certificate_stats():
+    return jsonify({"status": True, "registry": certificate_registry.stats()}), 200
+
+@app.route('/cierres_pendientes', methods=['GET'])
+def pending_closes():
+    # Cierres con numero reservado cuyo PDF no se pudo llenar; se reintentan reenviando el documento
+    return jsonify({"status": True, "pending": closing_ledger.pending()}), 200
+
 ##################################################
 ###       Función para firmar el PDF con       ###
 ###       certificado propio del servidor      ###
 ##################################################
 
-def signown(pdf, isYungaSign):
+def signown(pdf, isYungaSign, state):
     try:
-        if not isYungaSign and isclosing or not isYungaSign and not isclosing:
-            custom_image = create_signature_image(
-                f"{name}\n{datetimesigned}\n{stamp}\n{area}",
-                encoded_image,
+        pdf = PdfPayload.of(pdf)
+        if not isYungaSign:
+            custom_image = render_signature(
+                f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
                 "cert"
             )
-            certificates = get_certificate_from_local()
-            data_to_sign_response = get_data_to_sign_own(pdf, certificates, current_time, field_id, stamp, custom_image)
-            data_to_sign = data_to_sign_response["bytes"]
-            signature_value = get_signature_value_own(data_to_sign)
-            signed_pdf_response = sign_document_own(pdf, signature_value, certificates, current_time, field_id, stamp, custom_image)
-            signed_pdf_base64 = signed_pdf_response['bytes']
-            return signed_pdf_base64
+            field_id = state.field_id
         else:
-            custom_image = create_signature_image(
-                f"Sistema Yunga TC Tucumán\n{datetimesigned}",
-                encoded_image,
+            custom_image = render_signature(
+                f"Sistema Yunga TC Tucumán\n{state.datetimesigned}",
                 "yunga"
             )
-            certificates = get_certificate_from_local()
-            data_to_sign_response = get_data_to_sign_own(pdf, certificates, current_time, closingplace, stamp, custom_image)
-            data_to_sign = data_to_sign_response["bytes"]
-            signature_value = get_signature_value_own(data_to_sign)
-            signed_pdf_response = sign_document_own(pdf, signature_value, certificates, current_time, closingplace, stamp, custom_image)
-            signed_pdf_base64 = signed_pdf_response['bytes']
-            return signed_pdf_base64
+            field_id = state.closingplace
+        if local_seal_enabled():
+            return seal_locally(pdf, state, field_id, custom_image)
+        certificates = get_certificate_from_local()
+        data_to_sign_response = get_data_to_sign_own(pdf, certificates, state.current_time, field_id, state.stamp, custom_image)
+        data_to_sign = data_to_sign_response["bytes"]
+        signature_value = get_signature_value_own(data_to_sign)
+        signed_pdf_response = sign_document_own(pdf, signature_value, certificates, state.current_time, field_id, state.stamp, custom_image)
+        return PdfPayload.from_b64(signed_pdf_response['bytes'])
     except PDFSignatureError as e:
-        return jsonify({"status": "error", "message": "Error en signown: " + str(e)}), 500
+        raise PDFSignatureError("Error en signown: " + str(e))
+
+def seal_locally(pdf, state, field_id, custom_image):
+    # Sellado PAdES en el proceso (SEAL_ENGINE=python), sin DSS
+    pdf.index.require_signature_field(field_id)
+    with stage('seal_local', size=len(pdf.raw)):
+        sealed_pdf = seal_pdf(pdf.raw, server_signer, state.current_time, field_id, state.stamp, custom_image)
+    return PdfPayload.from_bytes(sealed_pdf)
 
 ##################################################
 ###         Función para cerrar el PDF         ###
 ##################################################
 
-def closePDF(pdfToClose):
+def closePDF(pdfToClose, state):
+    if PDF_CLOSE_ENGINE == 'java':
+        return closePDF_java(pdfToClose, state)
+    try:
+        pdf = PdfPayload.of(pdfToClose)
+        with stage('close', size=len(pdf.raw)):
+            closed_pdf = fill_closing_fields(pdf.raw, json.loads(state.field_values))
+        return PdfPayload.from_bytes(closed_pdf)
+    except PDFCloseError:
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error in closePDF: {str(e)}")
+        raise PDFCloseError("An unexpected error occurred in closePDF")
+
+# Motor anterior: llenado en el servicio Java (PDF_CLOSE_ENGINE=java)
+def closePDF_java(pdfToClose, state):
     try:
         data = {
-                    'fileBase64': pdfToClose,
-                    'fileName': signed_pdf_filename,
-                    'fieldValues': json_fieldValues
+                    'fileBase64': PdfPayload.of(pdfToClose).b64,
+                    'fileName': state.signed_pdf_filename,
+                    'fieldValues': state.field_values
                 }
-        response = requests.post('http://java-webapp:5555/pdf/update', data=data)
+        response = dss_post('pdfUpdate', data=data)
         response.raise_for_status()
-        signed_pdf_base64 = base64.b64encode(response.content).decode("utf-8")
-        return signed_pdf_base64, 200
-    except PDFSignatureError as e:
-        return jsonify({"status": "error", "message": "Error cerrando el PDF: " + str(e)}), 500
+        return PdfPayload.from_bytes(response.content)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         logging.error(f"Unexpected error in closePDF: {str(e)}")
-        return jsonify({"status": "error", "message": "An unexpected error occurred in closePDF"}), 500
+        raise PDFCloseError("An unexpected error occurred in closePDF")
 
 ###################################################
 ###      Función para obtener el número de      ###
 ###         cierre y la fecha de cierre         ###
 ###################################################
 
-def get_number_and_date_then_close(pdfToClose, idDoc):
-    global json_fieldValues
-    dbname = os.getenv('DB_NAME')
-    user = os.getenv('DB_USER')
-    password = os.getenv('DB_PASSWORD')
-    host = os.getenv('DB_HOST')
-    port = os.getenv('DB_PORT')
-
-    # Detalles de conexión
-    conn_params = {
-        'dbname': dbname,
-        'user': user,
-        'password': password,
-        'host': host,
-        'port': port  # Puerto por defecto de PostgreSQL
-    }
+def get_number_and_date_then_close(pdfToClose, state):
+    # La reserva del numero se confirma en la base antes de llenar el PDF (transaccion corta)
     try:
-        # Establecer la conexión
-        conn = psycopg2.connect(**conn_params)
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT f_documento_protocolizar(%s)", (idDoc,))
-
-            datos = cursor.fetchone()
-            datos_json = json.loads(json.dumps(datos[0]))
-            print(datos)
-            print(datos_json)
-            print(type(datos_json))
-            json_fieldValues1 = {
-                "numero": datos_json['numero'],
-                "fecha": datos_json['fecha']
-            }
-            json_fieldValues = json.dumps(json_fieldValues1)
-            
-            if datos_json['status'] == False:
-                raise Exception("Error al obtener fecha y numero: " + datos_json['message'])
+        reservations = reserve_numbers([state.id_doc], all_or_nothing=True)
+    except ProtocolBatchError as e:
+        raise PDFCloseError("Error transaccion: " + e.failed[0].error)
+    return close_with_reserved_number(pdfToClose, state, reservations)
+
+##################################################
+###      Firma por lotes (ruta /firmalote)     ###
+##################################################
+
+def batch_item_state(index, item, certificates, signed_pdf_filename):
+    state = SigningState(
+        pdf_b64=item['pdf'] if 'pdf_upload' not in item else None,
+        certificates=certificates,
+        signed_pdf_filename=f"{signed_pdf_filename}_{index}",
+        field_id=item['firma_lugar'],
+        name=item['firma_nombre'],
+        stamp=item['firma_sello'],
+        area=item['firma_area'],
+        isclosing=item['firma_cierra'],
+        closingplace=item['firma_lugarcierre'],
+        id_doc=item['id_doc'],
+        isdigital=item['firma_digital'],
+    )
+    state.stamp_time()
+    return state
+
+def batch_item_key(index, item, pdf, certificates, batch_key=None):
+    # 'idempotency_key' del documento, Idempotency-Key del lote mas el indice, o el hash del contenido
+    if item.get('idempotency_key'):
+        return caller_key('/firmalote', item['idempotency_key'])
+    if batch_key:
+        return caller_key('/firmalote', f"{batch_key}:{index}")
+    info = {name: value for name, value in item.items() if name != 'pdf'}
+    return content_key('/firmalote', pdf, info, certificates.get('certificate') if item.get('firma_digital') else None)
+
+def sign_batch_item(index, item, certificates, signed_pdf_filename, reservations, batch_key=None):
+    state = batch_item_state(index, item, certificates, signed_pdf_filename)
+    signatureValue = item['signatureValue']
+
+    mode = signing_mode(state.isdigital, state.isclosing)
+    with document_labels('/firmalote', mode), count_document(state.id_doc), span('documento', index=index, id_doc=state.id_doc, signing_mode=mode, pdf_b64_bytes=len(state.pdf_b64) if state.pdf_b64 else None):
+        # Los documentos que no llegaron a empezar antes del plazo fallan sin llamar a DSS
+        check_deadline('documento')
+        pdf = item_pdf(item, state.pdf_b64)
+        key = batch_item_key(index, item, pdf, certificates, batch_key)
+        signed_pdf, outcome = idempotency_cache.run(key, lambda: sign_batch_document(pdf, signatureValue, state, certificates, reservations))
+        annotate(idempotency=outcome)
+        return signed_pdf
+
+def sign_batch_document(pdf, signatureValue, state, certificates, reservations):
+    if state.isdigital:
+        state.name = extract_certificate_info_name(certificates['certificate'], certificates.get('certificateChain'))
+        state.custom_image = render_signature(
+                        f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
+                        "token"
+                    )
+    return sign_batch_pdf(pdf, signatureValue, state, certificates, reservations)
+
+def sign_batch_pdf(pdf, signatureValue, state, certificates, reservations):
+    match (state.isdigital, state.isclosing):
+        case (True, True):
+            signed_pdf_response = sign_document_tapir(pdf, signatureValue, certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+            lastpdf = close_with_reserved_number(PdfPayload.from_b64(signed_pdf_response['bytes']), state, reservations)
+            lastsignedpdf = signown(lastpdf, True, state)
+            save_signed_pdf(lastsignedpdf, state.signed_pdf_filename+"signDandclose.pdf")
+            return lastsignedpdf
+        case (True, False):
+            signed_pdf_response = sign_document_tapir(pdf, signatureValue, certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+            signed_pdf = PdfPayload.from_b64(signed_pdf_response['bytes'])
+            save_signed_pdf(signed_pdf, state.signed_pdf_filename+"signD.pdf")
+            return signed_pdf
+        case (False, True):
+            signed_pdf = signown(pdf, False, state)
+            lastpdf = close_with_reserved_number(signed_pdf, state, reservations)
+            signed_pdf_closed = signown(lastpdf, True, state)
+            save_signed_pdf(signed_pdf_closed, state.signed_pdf_filename+"signEandclose.pdf")
+            return signed_pdf_closed
+        case (False, False):
+            signed_pdf = signown(pdf, False, state)
+            save_signed_pdf(signed_pdf, state.signed_pdf_filename+"signE.pdf")
+            return signed_pdf
+
+def close_with_reserved_number(pdfToClose, state, reservations):
+    # El numero y la fecha ya se reservaron para todo el lote (ver protocolizacion.reserve_numbers)
+    reservation = reservations.get(state.id_doc)
+    if reservation is None:
+        raise PDFCloseError(f"El documento {state.id_doc} no fue protocolizado.")
+    if not reservation.ok:
+        raise PDFCloseError(f"Documento {state.id_doc}: {reservation.error}")
+    state.field_values = reservation.field_values()
+    try:
+        pdf = closePDF(pdfToClose, state)
+    except PDFCloseError as e:
+        mark_close_failed(state.id_doc, str(e))
+        raise
+    mark_closed(state.id_doc)
+    return pdf
+
+def batch_error_message(error):
+    if isinstance(error, PDFCloseError):
+        return "Error al cerrar PDF: " + str(error)
+    return str(error)
+
+def mark_failed_item(item, reservations, error):
+    # Un documento que cierra y fallo deja su numero reservado como fill_failed (ver protocolizacion.mark_not_filled)
+    if isinstance(item, dict) and item.get('firma_cierra'):
+        mark_not_filled(item['id_doc'], reservations, batch_error_message(error))
+
+def mark_skipped_items(pdfs, skipped, reservations):
+    # Documentos que no empezaron porque fail_fast corto el lote (BatchItemError.skipped)
+    for index in skipped:
+        mark_failed_item(pdfs[index], reservations, "Lote cortado por el error de otro documento")
+
+def batch_error_status(error):
+    # 504 si se agoto el plazo del pedido, 503 con el circuito abierto
+    if isinstance(error, DeadlineExceeded):
+        return 504
+    if isinstance(error, CircuitOpenError):
+        return 503
+    return 500
+
+def stream_batch(pdfs, worker, failure_policy, encoder, reservations):
+    """
+    Emite cada documento apenas termina (en orden de finalizacion, con su
+    'index') y un resumen final, en el formato del encoder (NDJSON, ZIP o
+    multipart, ver responses.py). Cada PDF se libera en cuanto se escribe, asi
+    la memoria queda acotada a los documentos en vuelo.
+    """
+    errors = 0
+    try:
+        for result in iter_batch(pdfs, worker, failure_policy):
+            pdfs[result.index] = None
+            if result.ok:
+                yield encoder.document(result.index, result.value)
             else:
-                try:
-                    pdf, code = closePDF(pdfToClose)
-                    if code == 500:
-                        response = pdf.get_json()
-                        if response['status'] == "error":
-                            conn.rollback()
-                            return jsonify({"status": "error", "message": "Error al cerrar PDF: " + response['message']}), 500
-                except Exception as e:
-                    conn.rollback()
-                    return jsonify({"status": "error", "message": "Error al cerrar PDF: " + str(e)}), 500
-                conn.commit()
-                return pdf, 200
-        except Exception as e:
-            conn.rollback()
-            return jsonify({"status": "error", "message": "Error transaccion: " + str(e)}), 500
-        finally:
-            cursor.close()
-    except Exception as e:
-        return jsonify({"status": "error", "message": "Error al conectar a la base de datos: " + str(e)}), 500
+                errors += 1
+                yield encoder.error(result.index, batch_error_message(result.error))
+    except BatchItemError as e:
+        mark_skipped_items(pdfs, e.skipped, reservations)
+        errors += 1
+        yield encoder.error(e.index, batch_error_message(e.error))
+        yield encoder.done(False, errors)
+        return
     finally:
-        if conn:
-            conn.close()
+        close_uploads(pdfs)
+    yield encoder.done(errors == 0, errors)
 
 @app.route('/firmalote', methods=['POST'])
 def firmalote():
-    global pdf_b64, current_time, certificates,  field_id, stamp, area, name, datetimesigned, custom_image, isdigital, isclosing, closingplace, idDoc, signed_pdf_filename
     signed_pdf_filename = datetime.now().strftime("pdf_%d_%m_%Y_%H%M%S")
-    data = request.get_json()
+    set_mode('lote')
+    annotate(signing_mode='lote')
+    # JSON con los PDF en base64, o multipart con el JSON en 'lote' y un archivo 'pdfs' por documento
+    try:
+        with stage('parse'):
+            data = batch_from_multipart(request.form, request.files) if is_multipart(request) else request.get_json()
+    except ValueError as e:
+        return jsonify({"status": False, "message": str(e)}), 400
     pdfs = data['pdfs']
     certificates = data['certificates']
-    array_pdfs = []
-
-    for pdf in pdfs:
-        pdf_b64 = pdf['pdf']
-        field_id = pdf['firma_lugar']
-        name = pdf['firma_nombre']
-        stamp = pdf['firma_sello']
-        area = pdf['firma_area']
-        
-        isclosing = pdf['firma_cierra']        
-        closingplace = pdf['firma_lugarcierre']
-        idDoc = pdf['id_doc']
-        isdigital = pdf['firma_digital']
-
-        signatureValue = pdf['signatureValue']
-
-        current_time = int(tiempo.time() * 1000)
-        datetimesigned = datetime.now(pytz.utc).astimezone(pytz.timezone('America/Argentina/Buenos_Aires')).strftime("%Y-%m-%d %H:%M:%S")
+    # 'fail_fast' (por defecto) corta el lote en el primer error; 'collect' devuelve los errores por documento
+    try:
+        failure_policy = resolve_failure_policy(data.get('failure_policy'))
+    except ValueError as e:
+        close_uploads(pdfs)
+        return jsonify({"status": False, "message": str(e)}), 400
+
+    # Todos los documentos que cierran se protocolizan juntos antes de firmar
+    reservations = {}
+    closing_ids = [item['id_doc'] for item in pdfs if item.get('firma_cierra')]
+    if closing_ids:
+        try:
+            reservations = reserve_numbers(closing_ids, all_or_nothing=failure_policy == FAIL_FAST)
+        except ProtocolBatchError as e:
+            close_uploads(pdfs)
+            failed = [{"id_doc": r.id_doc, "message": r.error} for r in e.failed]
+            return jsonify({"status": False, "message": batch_error_message(e), "errors": failed}), 500
+        except PDFCloseError as e:
+            close_uploads(pdfs)
+            return jsonify({"status": False, "message": batch_error_message(e)}), 500
+        except (DeadlineExceeded, CircuitOpenError):
+            close_uploads(pdfs)
+            raise
+
+    # Los documentos se firman en hilos del pool (y en streaming, despues de esta funcion): heredan la traza del pedido
+    trace_context = capture_context()
+    deadline = current_deadline()
+
+    batch_key = request.headers.get(IDEMPOTENCY_HEADER)
+
+    def worker(index, item):
+        with use_context(trace_context), use_deadline(deadline):
+            try:
+                return sign_batch_item(index, item, certificates, signed_pdf_filename, reservations, batch_key)
+            except Exception as e:
+                mark_failed_item(item, reservations, e)
+                raise
 
-        if isdigital:
-            name = extract_certificate_info_name(certificates['certificate'])
+    # ?stream=1 o Accept: application/x-ndjson, application/zip o multipart/mixed
+    encoder = batch_stream(request.args, request.accept_mimetypes)
+    if encoder is not None:
+        return Response(stream_batch(pdfs, worker, failure_policy, encoder, reservations), mimetype=encoder.mimetype)
 
-        if isdigital:
-            custom_image = create_signature_image(
-                            f"{name}\n{datetimesigned}\n{stamp}\n{area}",
-                            encoded_image,
-                            "token"
-                        )
-        else:
-            custom_image = create_signature_image(
-                            f"Sistema Yunga TC Tucumán\n{datetimesigned}",
-                            encoded_image,
-                            "cert"
-                        )
-            
-        match (isdigital, isclosing):
-            case (True, True):
-                signed_pdf_response = sign_document_tapir(pdf_b64, signatureValue, certificates, current_time, field_id, stamp, custom_image)
-                signed_pdf_base64 = signed_pdf_response['bytes']
-                lastpdf, code = get_number_and_date_then_close(signed_pdf_base64, idDoc)
-                if code == 500:
-                    response = lastpdf.get_json()
-                    if response['status'] == "error":
-                        return jsonify({"status": False, "message": "Error al cerrar PDF: " + response['message']}), 500
-                lastsignedpdf = signown(lastpdf, True)
-                save_signed_pdf(lastsignedpdf, signed_pdf_filename+"signDandclose.pdf")
-                array_pdfs.append(lastsignedpdf)
-            
-            case (True, False):
-                signed_pdf_response = sign_document_tapir(pdf_b64, signatureValue, certificates, current_time, field_id, stamp, custom_image)
-                signed_pdf_base64 = signed_pdf_response['bytes']
-                save_signed_pdf(signed_pdf_base64, signed_pdf_filename+"signD.pdf")
-                array_pdfs.append(signed_pdf_base64)
-            
-            case (False, True):
-                signed_pdf_base64 = signown(pdf_b64, False)
-                lastpdf, code = get_number_and_date_then_close(signed_pdf_base64, idDoc)
-                if code == 500:
-                    response = lastpdf.get_json()
-                    if response['status'] == "error":
-                        return jsonify({"status": False, "message": "Error al cerrar PDF: " + response['message']}), 500
-                signed_pdf_base64_closed = signown(lastpdf, True)
-                save_signed_pdf(signed_pdf_base64_closed, signed_pdf_filename+"signEandclose.pdf")
-                array_pdfs.append(signed_pdf_base64_closed)
-            
-            case (False, False):
-                signed_pdf_base64 = signown(pdf_b64, False)
-                save_signed_pdf(signed_pdf_base64, signed_pdf_filename+"signE.pdf")
-                array_pdfs.append(signed_pdf_base64)
+    try:
+        results = run_batch(pdfs, worker, failure_policy)
+    except BatchItemError as e:
+        mark_skipped_items(pdfs, e.skipped, reservations)
+        return jsonify({"status": False, "message": batch_error_message(e.error), "index": e.index}), batch_error_status(e.error)
+    finally:
+        close_uploads(pdfs)
 
-    return jsonify({"status": True, "pdfs": array_pdfs}), 200
\ No newline at end of file
+    errors = [{"index": r.index, "message": batch_error_message(r.error)} for r in results if not r.ok]
+    array_pdfs = [r.value.b64 if r.ok else None for r in results]
+    if errors:
+        return jsonify({"status": False, "pdfs": array_pdfs, "errors": errors}), 200
+    return jsonify({"status": True, "pdfs": array_pdfs}), 200
@@ -0,0 +1,575 @@
+# Descripcion: Modo ASGI (Quart) de las rutas de sign.py, con las mismas URL y contratos JSON.
+# DSS se llama con httpx y la protocolizacion con psycopg 3, ambos asincronos: un pedido que espera a
+# DSS o a la base no ocupa un hilo, asi los pedidos en vuelo quedan acotados por DSS y no por los hilos
+# de mod_wsgi. Los pasos de CPU (imagen, RSA, indice y armado del PDF, JSON, llenado y guardado) corren
+# en un pool de hilos (ASGI_CPU_WORKERS).
+# Uso: uvicorn sign_asgi:app --host 0.0.0.0 --port 5000
+
+##################################################
+###              Imports externos              ###
+##################################################
+
+from quart import Quart, Response, request, jsonify, g
+from quart.wrappers import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+import os
+import json
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+
+##################################################
+###              Imports propios               ###
+##################################################
+
+from sign import (read_firma_init, batch_item_state, seal_locally, close_with_reserved_number, save_signed_pdf,
+                  batch_error_message, batch_error_status, mark_failed_item, mark_skipped_items, render_signature, session_store, firma_init_key, batch_item_key, replayed,
+                  SessionNotFound)
+from dss_sign import get_data_to_sign_own_body, sign_document_own_body, get_data_to_sign_tapir_body, sign_document_tapir_body
+from dss_client import async_dss_client, DSSRequestError
+from localcerts import get_certificate_from_local, get_signature_value_own
+from certificates import extract_certificate_info_name, certificate_registry
+from errors import PDFSignatureError, PDFCloseError
+from session_store import new_session_id, SESSION_LEGACY_FALLBACK
+from db_pool import get_async_db_pool
+from protocolizacion import reserve_numbers_async, lock_hold_stats, ProtocolBatchError
+from closing_ledger import closing_ledger
+from b64codec import PdfPayload, count_document, codec_stats
+from pades_local import local_seal_enabled
+from metrics import stage, start_request, end_request, set_mode, document_labels, signing_mode, render_metrics, NO_ROUTE
+from tracing import span, annotate, capture_context, use_context, start_request_span
+from batch import iter_batch_async, run_batch_async, resolve_failure_policy, BatchItemError, FAIL_FAST
+from uploads import spooled_stream_factory, is_multipart, uploaded_pdf, batch_from_multipart, item_pdf, close_uploads
+from pdf_writer import pdf_writer
+from idempotency import idempotency_cache, caller_key, session_key, IDEMPOTENCY_HEADER, MISS
+from responses import (wants_pdf, batch_stream, pdf_headers, response_encoding, compress, set_compressed,
+                       RESPONSE_COMPRESS_MIN_BYTES, PDF_MIMETYPE)
+from deadlines import request_deadline, start_deadline, end_deadline, current_deadline, use_deadline, check_deadline, DeadlineExceeded
+from breaker import dss_breaker, db_breaker, CircuitOpenError
+
+load_dotenv()
+
+##################################################
+###       Configuracion de aplicacion Quart    ###
+##################################################
+
+class UploadRequest(Request):
+    # Las partes binarias de multipart se vuelcan a archivos temporales con tope de tamaño (ver uploads.py)
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=spooled_stream_factory,
+        )
+
+app = Quart(__name__)
+app.request_class = UploadRequest
+# Como Flask bajo mod_wsgi: sin tope de tamaño del cuerpo ni del formulario y sin timeout de respuesta
+app.config.update(MAX_CONTENT_LENGTH=None, MAX_FORM_MEMORY_SIZE=None, BODY_TIMEOUT=None, RESPONSE_TIMEOUT=None)
+
+logger = logging.getLogger(__name__)
+# httpx registra cada pedido en INFO; las llamadas a DSS ya quedan en metricas y trazas
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Hilos para el trabajo de CPU; la espera a DSS y a la base no los ocupa
+ASGI_CPU_WORKERS = int(os.getenv('ASGI_CPU_WORKERS', str(min(32, (os.cpu_count() or 1) + 4))))
+_cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+
+# Ultima sesion creada en este proceso, solo con SESSION_LEGACY_FALLBACK (clientes que no envian session_id)
+last_session_id = None
+
+DSS_ERRORS = {
+    'getDataToSign': "Failed to get data to sign from DSS API.",
+    'signDocument': "Failed to sign document with DSS API.",
+}
+
+##################################################
+###       Trabajo de CPU fuera del event loop  ###
+##################################################
+
+async def run_cpu(fn, *args):
+    """
+    Ejecuta fn(*args) en el pool de CPU con el contexto actual (etiquetas de
+    metricas, traza y contador del codec del documento).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_cpu_executor, functools.partial(context.run, fn, *args))
+
+async def json_response(payload, status=200):
+    # Las respuestas con PDFs en base64 (MB) se serializan en el pool de CPU
+    return Response(await run_cpu(json.dumps, payload), status=status, content_type='application/json')
+
+async def document_response(pdf, id_doc, outcome=MISS):
+    # Igual que sign.document_response: JSON (base64) o PDF binario con Accept: application/pdf
+    if wants_pdf(request.accept_mimetypes):
+        response = Response(await run_cpu(getattr, pdf, 'raw'), content_type=PDF_MIMETYPE, headers=pdf_headers(f"{id_doc}.pdf"))
+    else:
+        response = await json_response({"status": True, "pdf": await run_cpu(getattr, pdf, 'b64')})
+    return replayed(response, outcome)
+
+async def dss_call(endpoint, build_body, *args):
+    body = await run_cpu(build_body, *args)
+    try:
+        return await async_dss_client.post_json(endpoint, body, executor=_cpu_executor)
+    except DSSRequestError as e:
+        logging.error(f"Error in {endpoint}: {str(e)}")
+        raise PDFSignatureError(DSS_ERRORS[endpoint])
+
+##################################################
+###     Rutas de la aplicacion para Tapir      ###
+##################################################
+
+async def session_pending_async(result):
+    # Igual que sign.session_pending
+    return not isinstance(result, dict) or await asyncio.to_thread(session_store.contains, result["session_id"])
+
+async def init_document_async(pdf, state):
+    # Igual que sign.init_document
+    global last_session_id
+    with count_document(state.id_doc):
+        match (state.isdigital, state.isclosing):
+            case (True, _):
+                data_to_sign_response = await dss_call('getDataToSign', get_data_to_sign_tapir_body, pdf, state.certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+                data_to_sign = data_to_sign_response["bytes"]
+            case (False, True):
+                signed_pdf = await signown_async(pdf, False, state)
+                lastpdf = await get_number_and_date_then_close_async(signed_pdf, state)
+                signed_pdf_closed = await signown_async(lastpdf, True, state)
+                await run_cpu(save_signed_pdf, signed_pdf_closed, state.signed_pdf_filename+"signEandclose.pdf")
+                return signed_pdf_closed
+            case (False, False):
+                signed_pdf_closed = await signown_async(pdf, False, state)
+                await run_cpu(save_signed_pdf, signed_pdf_closed, state.signed_pdf_filename+"signE.pdf")
+                return signed_pdf_closed
+
+    session_id = new_session_id()
+    state.pdf_b64 = await run_cpu(getattr, pdf, 'b64')
+    await asyncio.to_thread(session_store.put, session_id, state)
+    if SESSION_LEGACY_FALLBACK:
+        last_session_id = session_id
+    return {"data_to_sign": data_to_sign, "session_id": session_id}
+
+@app.route('/firma_init', methods=['POST'])
+async def get_certificates():
+    try:
+        with stage('parse'):
+            form = await request.form
+        state = read_firma_init(form)
+        set_mode(signing_mode(state.isdigital, state.isclosing))
+        annotate(signing_mode=signing_mode(state.isdigital, state.isclosing), id_doc=state.id_doc)
+
+        state.custom_image = await run_cpu(
+            render_signature,
+            f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
+            "token"
+        )
+
+        # El PDF llega en base64 (campo 'pdf' del formulario) o binario (parte 'pdf' de un multipart)
+        pdf = await run_cpu(uploaded_pdf, await request.files) or PdfPayload.from_b64(state.pdf_b64)
+        # Un reenvio del mismo documento espera al original o reusa su resultado (ver idempotency.py)
+        key = await run_cpu(firma_init_key, form, request.headers, state, pdf)
+        result, outcome = await idempotency_cache.run_async(key, lambda: init_document_async(pdf, state), valid=session_pending_async)
+
+        if state.isdigital:
+            return replayed(jsonify({"status": True, "data_to_sign": result["data_to_sign"], "session_id": result["session_id"]}), outcome)
+        else:
+            return await document_response(result, state.id_doc, outcome)
+
+    except PDFCloseError as e:
+        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + str(e)}), 500
+    except PDFSignatureError as e:
+        return jsonify({"status": "error", "message": "Error en get_certificates: " + str(e)}), 500
+    except (RequestEntityTooLarge, DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error in get_certificates: {str(e)}")
+        return jsonify({"status": "error", "message": "An unexpected error occurred in get_certificates."}), 500
+
+async def finish_signing_async(session_id, signature_value):
+    # Igual que sign.finish_signing
+    state = await asyncio.to_thread(session_store.get, session_id) if session_id else None
+    if state is None:
+        raise SessionNotFound(session_id)
+    set_mode(signing_mode(state.isdigital, state.isclosing))
+    annotate(signing_mode=signing_mode(state.isdigital, state.isclosing), id_doc=state.id_doc)
+    with count_document(state.id_doc):
+        signed_pdf_response = await dss_call('signDocument', sign_document_tapir_body, PdfPayload.from_b64(state.pdf_b64), signature_value, state.certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+        signed_pdf = PdfPayload.from_b64(signed_pdf_response['bytes'])
+
+        match (state.isdigital, state.isclosing):
+            case (True, True):
+                lastpdf = await get_number_and_date_then_close_async(signed_pdf, state)
+                lastsignedpdf = await signown_async(lastpdf, True, state)
+                await run_cpu(save_signed_pdf, lastsignedpdf, state.signed_pdf_filename+"signDandclose.pdf")
+                await asyncio.to_thread(session_store.delete, session_id)
+                return lastsignedpdf, state.id_doc
+            case (True, False):
+                await run_cpu(save_signed_pdf, signed_pdf, state.signed_pdf_filename+"signD.pdf")
+                await asyncio.to_thread(session_store.delete, session_id)
+                return signed_pdf, state.id_doc
+
+@app.route('/firma_valor', methods=['POST'])
+async def sign_pdf_firmas():
+    try:
+        with stage('parse'):
+            body = await request.get_json()
+        session_id = body.get('session_id')
+        if not session_id:
+            if not SESSION_LEGACY_FALLBACK:
+                return jsonify({"status": "error", "message": "Falta session_id (lo devuelve /firma_init)."}), 400
+            logging.warning("firma_valor sin session_id, se usa la ultima sesion del proceso")
+            session_id = last_session_id
+        signature_value = body['signatureValue']
+        # Un reenvio con la misma sesion devuelve el PDF ya firmado aunque la sesion ya no exista
+        if request.headers.get(IDEMPOTENCY_HEADER):
+            key = caller_key('/firma_valor', request.headers[IDEMPOTENCY_HEADER])
+        else:
+            key = session_key(session_id) if session_id else None
+        (signed_pdf, id_doc), outcome = await idempotency_cache.run_async(key, lambda: finish_signing_async(session_id, signature_value))
+        return await document_response(signed_pdf, id_doc, outcome)
+
+    except SessionNotFound:
+        return jsonify({"status": "error", "message": "La sesion de firma no existe o expiro."}), 404
+    except PDFCloseError as e:
+        return jsonify({"status": "error", "message": "Error al cerrar PDF: " + str(e)}), 500
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error in sign_pdf_firmas: {str(e)}")
+        return jsonify({"status": "error", "message": "An unexpected error occurred in sign_pdf_firmas."}), 500
+
+##################################################
+###     Metricas, trazas y rutas de estado     ###
+##################################################
+
+# Los hooks son corrutinas: Quart corre los hooks sincronicos en otro hilo y el
+# contexto (etiquetas de metricas, span del pedido) no llegaria a la ruta
+
+@app.before_request
+async def deadline_before_request():
+    g.deadline_token = start_deadline(request_deadline(request.headers, request.path))
+
+@app.teardown_request
+async def deadline_teardown_request(error):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        end_deadline(token)
+
+@app.before_request
+async def metrics_before_request():
+    g.metrics_request = start_request(request.url_rule.rule if request.url_rule else NO_ROUTE)
+
+@app.after_request
+async def metrics_after_request(response):
+    started = g.pop('metrics_request', None)
+    if started is not None:
+        end_request(started, response.status_code, request.content_length)
+    return response
+
+@app.teardown_request
+async def metrics_teardown_request(error):
+    started = g.pop('metrics_request', None)
+    if started is not None:
+        end_request(started, 500)
+
+@app.before_request
+async def tracing_before_request():
+    g.trace_request = start_request_span(request.method, request.url_rule.rule if request.url_rule else NO_ROUTE, request.headers)
+
+@app.after_request
+async def tracing_after_request(response):
+    trace_request = g.pop('trace_request', None)
+    if trace_request is not None:
+        trace_request.detach(status_code=response.status_code)
+        # En streaming (NDJSON, ZIP, multipart) el pedido termina cuando se envio el ultimo documento
+        on_close = g.get('on_close')
+        if on_close is not None:
+            on_close.append(trace_request.end)
+        else:
+            trace_request.end()
+    return response
+
+@app.teardown_request
+async def tracing_teardown_request(error):
+    trace_request = g.pop('trace_request', None)
+    if trace_request is not None:
+        trace_request.detach(status_code=500, error=error)
+        trace_request.end()
+
+@app.after_request
+async def compress_after_request(response):
+    # JSON con brotli/gzip segun Accept-Encoding; la compresion corre en el pool de CPU
+    encoding = response_encoding(response, request.accept_encodings)
+    if encoding is None:
+        return response
+    data = await response.get_data()
+    if len(data) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    return set_compressed(response, await run_cpu(compress, data, encoding), encoding)
+
+@app.after_serving
+async def close_clients():
+    await async_dss_client.aclose()
+    await get_async_db_pool().close()
+    await asyncio.to_thread(pdf_writer.close)
+
+@app.errorhandler(RequestEntityTooLarge)
+async def upload_too_large(e):
+    return jsonify({"status": "error", "message": e.description}), 413
+
+@app.errorhandler(DeadlineExceeded)
+async def deadline_exceeded(e):
+    return jsonify({"status": "error", "message": str(e)}), 504
+
+@app.errorhandler(CircuitOpenError)
+async def circuit_open(e):
+    return jsonify({"status": "error", "message": str(e)}), 503, {"Retry-After": str(int(e.retry_after + 0.5))}
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_route():
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({"status": False, "message": "prometheus_client no esta instalado"}), 501
+    payload, content_type = rendered
+    return Response(payload, content_type=content_type)
+
+@app.route('/estado_dss', methods=['GET'])
+async def dss_connection_stats():
+    return jsonify({
+        "status": True,
+        "connections": async_dss_client.stats(),
+        "replicas": async_dss_client.replicas.stats(),
+        "breaker": dss_breaker.stats()
+    }), 200
+
+@app.route('/estado_db', methods=['GET'])
+async def db_pool_stats():
+    return jsonify({
+        "status": True,
+        "pool": get_async_db_pool().stats(),
+        "lock_hold": lock_hold_stats.snapshot(),
+        "pending_closes": len(await asyncio.to_thread(closing_ledger.pending)),
+        "breaker": db_breaker.stats()
+    }), 200
+
+@app.route('/estado_codec', methods=['GET'])
+async def codec_stats_route():
+    return jsonify({"status": True, "codec": codec_stats()}), 200
+
+@app.route('/estado_pdfs', methods=['GET'])
+async def pdf_writer_stats():
+    return jsonify({"status": True, "writer": pdf_writer.stats()}), 200
+
+@app.route('/estado_idempotencia', methods=['GET'])
+async def idempotency_stats():
+    return jsonify({"status": True, "cache": idempotency_cache.stats()}), 200
+
+@app.route('/estado_certificados', methods=['GET'])
+async def certificate_stats():
+    return jsonify({"status": True, "registry": certificate_registry.stats()}), 200
+
+@app.route('/cierres_pendientes', methods=['GET'])
+async def pending_closes():
+    return jsonify({"status": True, "pending": await asyncio.to_thread(closing_ledger.pending)}), 200
+
+##################################################
+###       Firma con certificado propio y       ###
+###           cierre del PDF (async)           ###
+##################################################
+
+async def signown_async(pdf, isYungaSign, state):
+    try:
+        pdf = PdfPayload.of(pdf)
+        if not isYungaSign:
+            custom_image = await run_cpu(
+                render_signature,
+                f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
+                "cert"
+            )
+            field_id = state.field_id
+        else:
+            custom_image = await run_cpu(
+                render_signature,
+                f"Sistema Yunga TC Tucumán\n{state.datetimesigned}",
+                "yunga"
+            )
+            field_id = state.closingplace
+        if local_seal_enabled():
+            return await run_cpu(seal_locally, pdf, state, field_id, custom_image)
+        certificates = get_certificate_from_local()
+        data_to_sign_response = await dss_call('getDataToSign', get_data_to_sign_own_body, pdf, certificates, state.current_time, field_id, state.stamp, custom_image)
+        data_to_sign = data_to_sign_response["bytes"]
+        signature_value = await run_cpu(get_signature_value_own, data_to_sign)
+        signed_pdf_response = await dss_call('signDocument', sign_document_own_body, pdf, signature_value, certificates, state.current_time, field_id, state.stamp, custom_image)
+        return PdfPayload.from_b64(signed_pdf_response['bytes'])
+    except PDFSignatureError as e:
+        raise PDFSignatureError("Error en signown: " + str(e))
+
+async def get_number_and_date_then_close_async(pdfToClose, state):
+    try:
+        reservations = await reserve_numbers_async([state.id_doc], all_or_nothing=True)
+    except ProtocolBatchError as e:
+        raise PDFCloseError("Error transaccion: " + e.failed[0].error)
+    # El llenado (PyMuPDF, o el servicio Java con PDF_CLOSE_ENGINE=java) corre en el pool de CPU
+    return await run_cpu(close_with_reserved_number, pdfToClose, state, reservations)
+
+##################################################
+###      Firma por lotes (ruta /firmalote)     ###
+##################################################
+
+async def sign_batch_item_async(index, item, certificates, signed_pdf_filename, reservations, batch_key=None):
+    state = batch_item_state(index, item, certificates, signed_pdf_filename)
+    signatureValue = item['signatureValue']
+
+    mode = signing_mode(state.isdigital, state.isclosing)
+    with document_labels('/firmalote', mode), count_document(state.id_doc), span('documento', index=index, id_doc=state.id_doc, signing_mode=mode, pdf_b64_bytes=len(state.pdf_b64) if state.pdf_b64 else None):
+        check_deadline('documento')
+        pdf = await run_cpu(item_pdf, item, state.pdf_b64)
+        key = await run_cpu(batch_item_key, index, item, pdf, certificates, batch_key)
+        signed_pdf, outcome = await idempotency_cache.run_async(key, lambda: sign_batch_document_async(pdf, signatureValue, state, certificates, reservations))
+        annotate(idempotency=outcome)
+        return signed_pdf
+
+async def sign_batch_document_async(pdf, signatureValue, state, certificates, reservations):
+    if state.isdigital:
+        state.name = extract_certificate_info_name(certificates['certificate'], certificates.get('certificateChain'))
+        state.custom_image = await run_cpu(
+            render_signature,
+            f"{state.name}\n{state.datetimesigned}\n{state.stamp}\n{state.area}",
+            "token"
+        )
+    return await sign_batch_pdf_async(pdf, signatureValue, state, certificates, reservations)
+
+async def sign_batch_pdf_async(pdf, signatureValue, state, certificates, reservations):
+    match (state.isdigital, state.isclosing):
+        case (True, True):
+            signed_pdf_response = await dss_call('signDocument', sign_document_tapir_body, pdf, signatureValue, certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+            lastpdf = await run_cpu(close_with_reserved_number, PdfPayload.from_b64(signed_pdf_response['bytes']), state, reservations)
+            lastsignedpdf = await signown_async(lastpdf, True, state)
+            await run_cpu(save_signed_pdf, lastsignedpdf, state.signed_pdf_filename+"signDandclose.pdf")
+            return lastsignedpdf
+        case (True, False):
+            signed_pdf_response = await dss_call('signDocument', sign_document_tapir_body, pdf, signatureValue, certificates, state.current_time, state.field_id, state.stamp, state.custom_image)
+            signed_pdf = PdfPayload.from_b64(signed_pdf_response['bytes'])
+            await run_cpu(save_signed_pdf, signed_pdf, state.signed_pdf_filename+"signD.pdf")
+            return signed_pdf
+        case (False, True):
+            signed_pdf = await signown_async(pdf, False, state)
+            lastpdf = await run_cpu(close_with_reserved_number, signed_pdf, state, reservations)
+            signed_pdf_closed = await signown_async(lastpdf, True, state)
+            await run_cpu(save_signed_pdf, signed_pdf_closed, state.signed_pdf_filename+"signEandclose.pdf")
+            return signed_pdf_closed
+        case (False, False):
+            signed_pdf = await signown_async(pdf, False, state)
+            await run_cpu(save_signed_pdf, signed_pdf, state.signed_pdf_filename+"signE.pdf")
+            return signed_pdf
+
+async def stream_batch_async(pdfs, worker, failure_policy, encoder, reservations, on_close):
+    """
+    Igual que sign.stream_batch: cada documento en orden de finalizacion y un
+    resumen final en el formato del encoder. on_close se llama al terminar.
+    """
+    errors = 0
+    try:
+        try:
+            async for result in iter_batch_async(pdfs, worker, failure_policy):
+                pdfs[result.index] = None
+                if result.ok:
+                    # base64 (NDJSON) o entrada ZIP/multipart: en el pool de CPU
+                    yield await run_cpu(encoder.document, result.index, result.value)
+                else:
+                    errors += 1
+                    yield encoder.error(result.index, batch_error_message(result.error))
+        except BatchItemError as e:
+            await asyncio.to_thread(mark_skipped_items, pdfs, e.skipped, reservations)
+            errors += 1
+            yield encoder.error(e.index, batch_error_message(e.error))
+            yield encoder.done(False, errors)
+            return
+        finally:
+            close_uploads(pdfs)
+        yield encoder.done(errors == 0, errors)
+    finally:
+        for callback in on_close:
+            callback()
+
+@app.route('/firmalote', methods=['POST'])
+async def firmalote():
+    signed_pdf_filename = datetime.now().strftime("pdf_%d_%m_%Y_%H%M%S")
+    set_mode('lote')
+    annotate(signing_mode='lote')
+    # JSON con los PDF en base64, o multipart con el JSON en 'lote' y un archivo 'pdfs' por documento
+    try:
+        with stage('parse'):
+            if is_multipart(request):
+                data = batch_from_multipart(await request.form, await request.files)
+            else:
+                data = await request.get_json()
+    except ValueError as e:
+        return jsonify({"status": False, "message": str(e)}), 400
+    pdfs = data['pdfs']
+    certificates = data['certificates']
+    # 'fail_fast' (por defecto) corta el lote en el primer error; 'collect' devuelve los errores por documento
+    try:
+        failure_policy = resolve_failure_policy(data.get('failure_policy'))
+    except ValueError as e:
+        close_uploads(pdfs)
+        return jsonify({"status": False, "message": str(e)}), 400
+
+    # Todos los documentos que cierran se protocolizan juntos antes de firmar
+    reservations = {}
+    closing_ids = [item['id_doc'] for item in pdfs if item.get('firma_cierra')]
+    if closing_ids:
+        try:
+            reservations = await reserve_numbers_async(closing_ids, all_or_nothing=failure_policy == FAIL_FAST)
+        except ProtocolBatchError as e:
+            close_uploads(pdfs)
+            failed = [{"id_doc": r.id_doc, "message": r.error} for r in e.failed]
+            return jsonify({"status": False, "message": batch_error_message(e), "errors": failed}), 500
+        except PDFCloseError as e:
+            close_uploads(pdfs)
+            return jsonify({"status": False, "message": batch_error_message(e)}), 500
+        except (DeadlineExceeded, CircuitOpenError):
+            close_uploads(pdfs)
+            raise
+
+    # En streaming los documentos se firman despues de esta funcion: heredan la traza del pedido
+    trace_context = capture_context()
+    deadline = current_deadline()
+
+    batch_key = request.headers.get(IDEMPOTENCY_HEADER)
+
+    async def worker(index, item):
+        with use_context(trace_context), use_deadline(deadline):
+            try:
+                return await sign_batch_item_async(index, item, certificates, signed_pdf_filename, reservations, batch_key)
+            except Exception as e:
+                await asyncio.to_thread(mark_failed_item, item, reservations, e)
+                raise
+
+    # ?stream=1 o Accept: application/x-ndjson, application/zip o multipart/mixed
+    encoder = batch_stream(request.args, request.accept_mimetypes)
+    if encoder is not None:
+        g.on_close = []
+        return Response(stream_batch_async(pdfs, worker, failure_policy, encoder, reservations, g.on_close), content_type=encoder.mimetype)
+
+    try:
+        results = await run_batch_async(pdfs, worker, failure_policy)
+    except BatchItemError as e:
+        await asyncio.to_thread(mark_skipped_items, pdfs, e.skipped, reservations)
+        return jsonify({"status": False, "message": batch_error_message(e.error), "index": e.index}), batch_error_status(e.error)
+    finally:
+        close_uploads(pdfs)
+
+    errors = [{"index": r.index, "message": batch_error_message(r.error)} for r in results if not r.ok]
+    array_pdfs = [await run_cpu(getattr, r.value, 'b64') if r.ok else None for r in results]
+    if errors:
+        return await json_response({"status": False, "pdfs": array_pdfs, "errors": errors})
+    return await json_response({"status": True, "pdfs": array_pdfs})
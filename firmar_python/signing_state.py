@@ -0,0 +1,30 @@
+# Descripcion: Estado por documento del proceso de firma (reemplaza las variables globales de sign.py)
+from dataclasses import dataclass
+from datetime import datetime
+import time as tiempo
+import pytz
+
+@dataclass
+class SigningState:
+    pdf_b64: str = None
+    certificates: dict = None
+    current_time: int = None
+    datetimesigned: str = None
+    signed_pdf_filename: str = None
+    field_id: str = None
+    name: str = None
+    stamp: str = None
+    area: str = None
+    custom_image: str = None
+    isdigital: bool = None
+    isclosing: bool = None
+    closingplace: str = None
+    id_doc: int = None
+    field_values: str = None
+
+    def stamp_time(self):
+        """
+        Fija la fecha de firma (milisegundos para DSS y texto para la imagen).
+        """
+        self.current_time = int(tiempo.time() * 1000)
+        self.datetimesigned = datetime.now(pytz.utc).astimezone(pytz.timezone('America/Argentina/Buenos_Aires')).strftime("%Y-%m-%d %H:%M:%S")
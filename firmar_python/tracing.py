@@ -0,0 +1,154 @@
+# Descripcion: Trazas (OpenTelemetry) del proceso de firma: pedido, documentos, DSS, base de datos e imagen
+# Con TRACING_EXPORTER=none (por defecto) no se importa OpenTelemetry y cada span es un no-op.
+import os
+import logging
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# none | file (JSON por linea) | otlp (colector OTLP/HTTP) | console
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+# Fraccion de trazas nuevas que se registran (las que llegan con traceparent respetan la decision del origen)
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', '1.0'))
+# Un archivo por proceso de mod_wsgi; {pid} se reemplaza por el pid
+TRACING_FILE = os.getenv('TRACING_FILE', 'traces-{pid}.jsonl')
+TRACING_OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACING_SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'firmador-python')
+
+def _file_exporter(path):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    out = open(path.format(pid=os.getpid()), 'a', buffering=1)
+    return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+
+def _setup():
+    if TRACING_EXPORTER == 'none' or TRACING_SAMPLE_RATIO <= 0:
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        if TRACING_EXPORTER == 'file':
+            exporter = _file_exporter(TRACING_FILE)
+        elif TRACING_EXPORTER == 'otlp':
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT)
+        elif TRACING_EXPORTER == 'console':
+            exporter = ConsoleSpanExporter()
+        else:
+            raise ValueError(f"TRACING_EXPORTER desconocido: {TRACING_EXPORTER}")
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+            sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        return provider.get_tracer("firmador")
+    except Exception as e:
+        logging.warning(f"Trazas desactivadas: {str(e)}")
+        return None
+
+_tracer = _setup()
+
+def tracing_enabled():
+    return _tracer is not None
+
+##################################################
+###                   Spans                    ###
+##################################################
+
+@contextmanager
+def span(name, client=False, **attributes):
+    """
+    Span hijo del span actual. client=True marca una llamada saliente (DSS, base).
+    Sin trazas activas no hace nada.
+    """
+    if _tracer is None:
+        yield None
+        return
+    from opentelemetry.trace import SpanKind
+    kind = SpanKind.CLIENT if client else SpanKind.INTERNAL
+    with _tracer.start_as_current_span(name, kind=kind, attributes=_clean(attributes)) as current:
+        yield current
+
+def _clean(attributes):
+    # OpenTelemetry solo acepta str, bool, int, float (o listas de ellos) y no None
+    return {key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in attributes.items() if value is not None}
+
+def annotate(**attributes):
+    # Atributos en el span actual (por ejemplo el modo de firma en el span del pedido)
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    trace.get_current_span().set_attributes(_clean(attributes))
+
+def inject_headers(headers):
+    """
+    Agrega traceparent/tracestate del span actual a los headers de una llamada saliente.
+    """
+    if _tracer is None:
+        return headers
+    from opentelemetry import propagate
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+def capture_context():
+    # Contexto actual, para continuar la traza en otro hilo (documentos de un lote)
+    if _tracer is None:
+        return None
+    from opentelemetry import context
+    return context.get_current()
+
+@contextmanager
+def use_context(captured):
+    if captured is None:
+        yield
+        return
+    from opentelemetry import context
+    token = context.attach(captured)
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+##################################################
+###          Span raiz de cada pedido          ###
+##################################################
+
+class RequestSpan:
+    def __init__(self, current, token):
+        self.span = current
+        self._token = token
+
+    def detach(self, status_code=None, error=None):
+        from opentelemetry import context
+        from opentelemetry.trace import Status, StatusCode
+        if status_code is not None:
+            self.span.set_attribute("http.status_code", status_code)
+            if status_code >= 500:
+                self.span.set_status(Status(StatusCode.ERROR))
+        if error is not None:
+            self.span.record_exception(error)
+            self.span.set_status(Status(StatusCode.ERROR, str(error)))
+        context.detach(self._token)
+
+    def end(self):
+        self.span.end()
+
+def start_request_span(method, route, headers):
+    """
+    Abre el span raiz del pedido (continua la traza si llega traceparent) y lo
+    deja como span actual. Devuelve None si las trazas estan desactivadas.
+    """
+    if _tracer is None:
+        return None
+    from opentelemetry import context, propagate, trace
+    from opentelemetry.trace import SpanKind
+    parent = propagate.extract(headers)
+    current = _tracer.start_span(f"{method} {route}", context=parent, kind=SpanKind.SERVER,
+                                 attributes={"http.method": method, "http.route": route})
+    token = context.attach(trace.set_span_in_context(current, parent))
+    return RequestSpan(current, token)
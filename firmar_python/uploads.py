@@ -0,0 +1,125 @@
+# Descripcion: Subida de PDFs binarios (multipart/form-data) para /firma_init y /firmalote
+# Cada parte de archivo se escribe en un SpooledTemporaryFile: en memoria hasta UPLOAD_SPOOL_BYTES y en
+# disco a partir de ahi. UPLOAD_MAX_BYTES se controla mientras se lee la parte, antes de tener el PDF entero.
+# El contrato anterior (PDF en base64 en el formulario o en el JSON) sigue funcionando igual.
+import os
+import io
+import json
+import tempfile
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from b64codec import PdfPayload, count_copy
+from dotenv import load_dotenv
+
+load_dotenv()
+
+##################################################
+###        Configuracion de las subidas        ###
+##################################################
+
+MULTIPART_MIMETYPE = 'multipart/form-data'
+
+# Hasta este tamaño cada PDF subido queda en memoria; los mas grandes se vuelcan a disco
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_BYTES', str(2 * 1024 * 1024)))
+# Tamaño maximo de cada PDF subido en multipart
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(100 * 1024 * 1024)))
+# Directorio de los volcados (por defecto el temporal del sistema)
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR') or None
+
+class UploadTooLarge(RequestEntityTooLarge):
+    def __init__(self, limit):
+        super().__init__(description=f"El PDF supera el tamaño maximo de {limit} bytes")
+        self.limit = limit
+
+##################################################
+###      Archivo temporal con tope de tamaño   ###
+##################################################
+
+class LimitedSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    SpooledTemporaryFile que corta la subida (413) apenas se escriben mas de
+    'limit' bytes, sin esperar a que termine la parte.
+    """
+    def __init__(self, spool_bytes=UPLOAD_SPOOL_BYTES, limit=UPLOAD_MAX_BYTES, spool_dir=UPLOAD_SPOOL_DIR):
+        super().__init__(max_size=spool_bytes, dir=spool_dir)
+        self.limit = limit
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        if self.written > self.limit:
+            raise UploadTooLarge(self.limit)
+        return super().write(data)
+
+def spooled_stream_factory(total_content_length, content_type, filename=None, content_length=None):
+    # Misma firma que werkzeug.formparser.default_stream_factory (la usan Flask y Quart)
+    return LimitedSpooledFile()
+
+class UploadRequest(Request):
+    # request_class de la app Flask: las partes de archivo van a LimitedSpooledFile
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spooled_stream_factory(total_content_length, content_type, filename, content_length)
+
+##################################################
+###          Lectura de los PDF subidos        ###
+##################################################
+
+def is_multipart(request):
+    return request.mimetype == MULTIPART_MIMETYPE
+
+def read_upload(stream):
+    """
+    Lee el PDF completo de un archivo subido y libera el archivo temporal.
+    """
+    try:
+        stream.seek(0)
+        data = stream.read()
+        count_copy(len(data))
+        return data
+    finally:
+        stream.close()
+
+def take_upload(storage):
+    # El archivo pasa al documento: al terminar el pedido el framework cierra solo un buffer vacio
+    stream, storage.stream = storage.stream, io.BytesIO()
+    return stream
+
+def uploaded_pdf(files, name='pdf'):
+    """
+    PdfPayload de la parte binaria 'name' de un multipart, o None si no vino.
+    """
+    storage = files.get(name)
+    if storage is None:
+        return None
+    return PdfPayload.from_bytes(read_upload(take_upload(storage)))
+
+def batch_from_multipart(form, files):
+    """
+    /firmalote en multipart: el campo 'lote' trae el mismo JSON que la version
+    JSON (sin 'pdf' en los documentos) y cada documento llega como una parte
+    'pdfs', en el mismo orden que la lista. El archivo de cada parte queda en
+    item['pdf_upload'] hasta que el documento se firma.
+    """
+    data = json.loads(form.get('lote') or 'null')
+    if not isinstance(data, dict) or not isinstance(data.get('pdfs'), list):
+        raise ValueError("El campo 'lote' debe ser el JSON del lote con la lista 'pdfs'.")
+    uploads = files.getlist('pdfs')
+    if len(uploads) != len(data['pdfs']):
+        raise ValueError(f"Se recibieron {len(uploads)} PDFs para {len(data['pdfs'])} documentos del lote.")
+    for item, storage in zip(data['pdfs'], uploads):
+        item['pdf_upload'] = take_upload(storage)
+    return data
+
+def item_pdf(item, pdf_b64):
+    # PDF de un documento del lote: parte binaria (multipart) o base64 (JSON)
+    upload = item.pop('pdf_upload', None)
+    if upload is not None:
+        return PdfPayload.from_bytes(read_upload(upload))
+    return PdfPayload.from_b64(pdf_b64)
+
+def close_uploads(items):
+    # Partes de documentos que no llegaron a firmarse (por ejemplo un lote cortado por fail_fast)
+    for item in items:
+        upload = item.pop('pdf_upload', None) if isinstance(item, dict) else None
+        if upload is not None:
+            upload.close()
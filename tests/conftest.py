@@ -0,0 +1,46 @@
+# Las pruebas importan los modulos de firmar_python igual que sign.wsgi (python-path=/app)
+import os
+import sys
+import collections
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'firmar_python'))
+
+from bench.pg_standin import ProtocolBook
+
+class CountingBook(ProtocolBook):
+    """
+    ProtocolBook que cuenta las llamadas a f_documento_protocolizar por id_doc:
+    el sustituto devuelve el mismo numero a un documento ya numerado, asi que
+    lo que prueba que no se pidio dos veces es la cantidad de llamadas.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = collections.Counter()
+
+    def result(self, id_doc):
+        self.calls[id_doc] += 1
+        return super().result(id_doc)
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    # Registro de cierres propio de cada prueba
+    import closing_ledger
+    import protocolizacion
+    ledger = closing_ledger.ClosingLedger(str(tmp_path / 'cierres.db'))
+    monkeypatch.setattr(protocolizacion, 'closing_ledger', ledger)
+    return ledger
+
+@pytest.fixture
+def book(monkeypatch):
+    # Pools (sincronico y asincrono) contra el sustituto de PostgreSQL y un breaker cerrado
+    import db_pool
+    import protocolizacion
+    from breaker import CircuitBreaker
+    from bench.pg_standin import standin_connect_factory, async_standin_connect_factory
+    book = CountingBook()
+    db_pool.configure_db_pool(connect_fn=standin_connect_factory(book), minconn=0, maxconn=4)
+    db_pool.configure_async_db_pool(connect_fn=async_standin_connect_factory(book), maxconn=4)
+    monkeypatch.setattr(protocolizacion, 'db_breaker', CircuitBreaker('db'))
+    return book
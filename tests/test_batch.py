@@ -0,0 +1,117 @@
+# Descripcion: Motor de lotes de /firmalote (orden, politicas de fallos y aislamiento entre documentos)
+import time
+import asyncio
+import threading
+import contextvars
+
+import pytest
+
+from batch import iter_batch, run_batch, iter_batch_async, run_batch_async, BatchItemError, FAIL_FAST, COLLECT
+from protocolizacion import reserve_numbers, mark_not_filled
+from closing_ledger import FILL_FAILED, RESERVED
+
+current_item = contextvars.ContextVar('current_item', default=None)
+
+def _sleepy(index, item):
+    # Los primeros terminan ultimos: el orden de llegada no es el de entrada
+    time.sleep(item)
+    return index
+
+def test_run_batch_keeps_input_order():
+    results = run_batch([0.08, 0.04, 0.0, 0.02], _sleepy, COLLECT, max_workers=4)
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert [result.value for result in results] == [0, 1, 2, 3]
+
+def test_iter_batch_yields_in_completion_order():
+    results = list(iter_batch([0.08, 0.0], _sleepy, COLLECT, max_workers=2))
+    assert [result.index for result in results] == [1, 0]
+
+def _fails_on_odd(index, item):
+    if index % 2:
+        raise ValueError(f"documento {index}")
+    return item
+
+def test_collect_returns_errors_per_document():
+    results = run_batch(['a', 'b', 'c', 'd'], _fails_on_odd, COLLECT)
+    assert [result.ok for result in results] == [True, False, True, False]
+    assert str(results[1].error) == "documento 1"
+    assert results[2].value == 'c'
+
+def test_fail_fast_waits_for_in_flight_and_lists_skipped():
+    started = []
+    finished = threading.Event()
+
+    def worker(index, item):
+        started.append(index)
+        if index == 0:
+            time.sleep(0.01)
+            raise ValueError("fallo")
+        # En vuelo cuando falla el primero: tiene que terminar antes del BatchItemError
+        time.sleep(0.1)
+        finished.set()
+        return item
+
+    with pytest.raises(BatchItemError) as info:
+        run_batch(range(5), worker, FAIL_FAST, max_workers=2)
+    assert info.value.index == 0
+    assert finished.is_set()
+    # El 1 estaba en vuelo; del 2 en adelante no empezaron y son los que quedan sin firmar
+    assert sorted(started) == [0, 1]
+    assert info.value.skipped == [2, 3, 4]
+
+def test_context_does_not_leak_between_documents():
+    seen = []
+
+    def worker(index, item):
+        seen.append(current_item.get())
+        current_item.set(item)
+        return item
+
+    run_batch(['a', 'b', 'c'], worker, COLLECT, max_workers=1)
+    assert seen == [None, None, None]
+    assert current_item.get() is None
+
+def test_async_keeps_input_order_and_collects_errors():
+    async def worker(index, item):
+        await asyncio.sleep(item)
+        if index == 1:
+            raise ValueError("documento 1")
+        return index
+
+    results = asyncio.run(run_batch_async([0.06, 0.03, 0.0], worker, COLLECT))
+    assert [result.index for result in results] == [0, 1, 2]
+    assert [result.ok for result in results] == [True, False, True]
+
+def test_async_fail_fast_waits_for_in_flight_and_lists_skipped():
+    started = []
+    finished = []
+
+    async def worker(index, item):
+        started.append(index)
+        if index == 0:
+            raise ValueError("fallo")
+        await asyncio.sleep(0.05)
+        finished.append(index)
+        return item
+
+    async def main():
+        return [result async for result in iter_batch_async(range(5), worker, FAIL_FAST, max_in_flight=2)]
+
+    with pytest.raises(BatchItemError) as info:
+        asyncio.run(main())
+    assert info.value.index == 0
+    assert finished == [1]
+    assert info.value.skipped == [2, 3, 4]
+
+def test_mark_not_filled_leaves_reserved_number_for_retry(ledger, book):
+    reservations = reserve_numbers(['7', '8'])
+    mark_not_filled('7', reservations, "Lote cortado por el error de otro documento")
+    assert ledger.lookup(['7'])['7'][2] == FILL_FAILED
+    assert ledger.lookup(['8'])['8'][2] == RESERVED
+    # El reintento del documento reutiliza su numero
+    assert reserve_numbers(['7'])['7'].numero == reservations['7'].numero
+    assert book.calls['7'] == 1
+
+def test_mark_not_filled_ignores_documents_without_number(ledger, book):
+    mark_not_filled('9', {}, "sin reserva")
+    assert ledger.lookup(['9']) == {}
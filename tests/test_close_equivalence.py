@@ -0,0 +1,32 @@
+# Descripcion: Equivalencia del llenado de cierre en Python (pdf_close) con el endpoint Java /pdf/update
+# La comparacion con Java usa el servicio de DSS_BASE_URL y se saltea si no responde.
+# Uso (desde la raiz del repositorio): python -m pytest tests
+import pytest
+import requests
+
+from bench.corpus import generate_pdf
+from bench.close_equivalence import compare
+from pdf_close import fill_closing_fields, read_field_values
+
+FIELD_VALUES = {"numero": "123", "fecha": "18/10/2026"}
+
+@pytest.fixture(scope="module")
+def pdf_bytes():
+    return generate_pdf(1, 10 * 1024)
+
+def test_python_close_fills_fields_incrementally(pdf_bytes):
+    closed = fill_closing_fields(pdf_bytes, FIELD_VALUES)
+    fields = read_field_values(closed)
+    assert {name: fields.get(name) for name in FIELD_VALUES} == FIELD_VALUES
+    # Los bytes firmados quedan intactos: el llenado es una actualizacion incremental
+    assert closed[:len(pdf_bytes)] == pdf_bytes
+
+def test_python_close_matches_java(pdf_bytes):
+    try:
+        result = compare(pdf_bytes, FIELD_VALUES)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        pytest.skip(f"Servicio Java no disponible: {e}")
+    except requests.HTTPError as e:
+        pytest.skip(f"Servicio Java sin /pdf/update: {e}")
+    assert result["fields_equal"], (result["python_fields"], result["java_fields"])
+    assert result["python_incremental"]
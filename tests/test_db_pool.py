@@ -0,0 +1,135 @@
+# Descripcion: Pool de conexiones (db_pool.ConnectionPool) contra el sustituto de PostgreSQL (bench.pg_standin)
+import time
+import threading
+import functools
+
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout, configure_db_pool, get_db_pool
+from bench.pg_standin import ProtocolBook, standin_connect_factory
+
+@pytest.fixture
+def connect():
+    opened = []
+    factory = standin_connect_factory(ProtocolBook())
+    def connect_fn():
+        conn = factory()
+        opened.append(conn)
+        return conn
+    connect_fn.opened = opened
+    return connect_fn
+
+def test_getconn_waits_and_times_out(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=0, maxconn=1, max_wait=0.1)
+    conn = pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert 0.1 <= time.monotonic() - started < 1
+    # El timeout de la llamada (plazo del pedido) acota la espera por debajo de max_wait
+    with pytest.raises(PoolTimeout):
+        pool.getconn(timeout=0.01)
+    stats = pool.stats()
+    assert stats["timeouts"] == 2
+    assert stats["waiting"] == 0
+    pool.putconn(conn)
+
+def test_waiter_gets_released_connection(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=0, maxconn=1, max_wait=5)
+    conn = pool.getconn()
+    threading.Timer(0.1, pool.putconn, args=(conn,)).start()
+    assert pool.getconn() is conn
+    assert len(connect.opened) == 1
+    # Solo los retiros logrados suman al tiempo de espera
+    assert pool.stats()["wait_time_max"] >= 0.05
+
+def test_broken_connections_are_discarded(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=0, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn, discard=True)
+    closed = pool.getconn()
+    closed.closed = 1
+    pool.putconn(closed)
+    stats = pool.stats()
+    assert stats["discarded"] == 2
+    assert stats["size"] == 0 and stats["idle"] == 0 and stats["in_use"] == 0
+    assert pool.getconn() not in (conn, closed)
+    assert len(connect.opened) == 3
+
+def test_connection_context_discards_closed_connection(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=0, maxconn=1)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.closed = 1
+            raise RuntimeError("caida")
+    assert pool.stats()["discarded"] == 1
+    assert pool.stats()["size"] == 0
+
+def test_idle_healthcheck_replaces_dead_connection(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=1, maxconn=1, healthcheck_idle=0)
+    pool.fill()
+    dead = connect.opened[0]
+    def broken_cursor():
+        raise Exception("server closed the connection unexpectedly")
+    dead.cursor = broken_cursor
+    conn = pool.getconn()
+    assert conn is not dead
+    assert pool.stats()["discarded"] == 1
+    pool.putconn(conn)
+    # Una conexion sana pasa el SELECT 1 y se reutiliza
+    assert pool.getconn() is conn
+
+def test_recent_idle_connection_skips_healthcheck(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=1, maxconn=1, healthcheck_idle=60)
+    pool.fill()
+    idle = connect.opened[0]
+    idle.cursor = None  # Cualquier uso fallaria
+    assert pool.getconn() is idle
+
+def test_failed_connect_frees_the_slot(connect):
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise Exception("could not connect")
+        return connect()
+    pool = configure_db_pool(connect_fn=flaky, minconn=0, maxconn=1, max_wait=0.1)
+    with pytest.raises(Exception, match="could not connect"):
+        pool.getconn()
+    assert pool.stats()["size"] == 0
+    assert pool.getconn() is connect.opened[0]
+
+def test_stats_counters(connect):
+    pool = configure_db_pool(connect_fn=connect, minconn=2, maxconn=3)
+    pool.fill()
+    assert pool.stats()["size"] == 2 and pool.stats()["idle"] == 2
+    first = pool.getconn()
+    second = pool.getconn()
+    third = pool.getconn()
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["idle"], stats["checkouts"]) == (3, 3, 0, 3)
+    for conn in (first, second, third):
+        pool.putconn(conn)
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["idle"], stats["discarded"]) == (3, 0, 3, 0)
+    pool.close()
+    assert pool.stats()["size"] == 0
+
+def test_get_db_pool_fills_outside_the_lock(connect, monkeypatch):
+    # Con la base colgada, abrir las conexiones minimas no bloquea a los demas pedidos
+    def slow_connect():
+        time.sleep(0.5)
+        return connect()
+    monkeypatch.setattr(db_pool, 'ConnectionPool', functools.partial(ConnectionPool, connect_fn=slow_connect, minconn=1))
+    monkeypatch.setattr(db_pool, '_pool', None)
+    first = []
+    thread = threading.Thread(target=lambda: first.append(get_db_pool()))
+    thread.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    pool = get_db_pool()
+    assert time.monotonic() - started < 0.25
+    thread.join()
+    assert first[0] is pool
+    assert pool.stats()["idle"] == 1
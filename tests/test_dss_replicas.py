@@ -0,0 +1,18 @@
+# Descripcion: Tope de pedidos en vuelo por replica de DSS
+import dss_replicas
+from dss_replicas import ReplicaBalancer, AsyncReplicaBalancer
+
+def test_single_replica_has_no_cap_by_default(monkeypatch):
+    monkeypatch.setattr(dss_replicas, 'DSS_REPLICA_MAX_IN_FLIGHT', None)
+    # Solo DSS_BASE_URL: igual que antes del balanceo, sin esperas por replica
+    assert ReplicaBalancer(['http://dss:5555']).max_in_flight == 0
+    assert AsyncReplicaBalancer(['http://dss:5555']).max_in_flight == 0
+
+def test_several_replicas_are_capped_by_default(monkeypatch):
+    monkeypatch.setattr(dss_replicas, 'DSS_REPLICA_MAX_IN_FLIGHT', None)
+    assert ReplicaBalancer(['http://dss-1:5555', 'http://dss-2:5555']).max_in_flight == 10
+
+def test_explicit_cap_applies_to_single_replica(monkeypatch):
+    monkeypatch.setattr(dss_replicas, 'DSS_REPLICA_MAX_IN_FLIGHT', '4')
+    assert ReplicaBalancer(['http://dss:5555']).max_in_flight == 4
+    assert ReplicaBalancer(['http://dss:5555'], max_in_flight=2).max_in_flight == 2
@@ -0,0 +1,106 @@
+# Descripcion: El sellado local (pades_local) produce una firma PAdES que valida con el validador de pyHanko
+# No reemplaza a bench.seal_equivalence (comparacion contra DSS, que habilita SEAL_ENGINE_VERIFIED):
+# comprueba que el PDF sellado este integro y cubierto por completo y que lleve el rol declarado.
+import io
+import base64
+import hashlib
+import datetime
+
+import pytest
+
+pytest.importorskip('pyhanko')
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from PIL import Image
+from pyhanko.keys import load_cert_from_pemder
+from pyhanko.pdf_utils.reader import PdfFileReader
+from pyhanko.sign.validation import validate_pdf_signature, SignatureCoverageLevel
+from pyhanko_certvalidator import ValidationContext
+
+from bench.corpus import generate_pdf
+from localcerts import ServerSealSigner
+from pades_local import seal_pdf, _claimed_role
+
+STAMP = "Juez de Cámara"
+SIGNING_TIME = datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone.utc)
+
+@pytest.fixture(scope="module")
+def seal_signer(tmp_path_factory):
+    # Certificado autofirmado del servidor: clave PEM cifrada y certificado DER, como en produccion
+    work = tmp_path_factory.mktemp('sello')
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Sello de prueba')])
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(1).not_valid_before(datetime.datetime(2024, 1, 1)).not_valid_after(datetime.datetime(2030, 1, 1))
+            .sign(key, hashes.SHA256()))
+    key_path = work / 'key.pem'
+    cert_path = work / 'cert.der'
+    key_path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.BestAvailableEncryption(b'pw')))
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.DER))
+    return ServerSealSigner(str(key_path), str(cert_path), 'pw')
+
+@pytest.fixture(scope="module")
+def sealed(seal_signer):
+    pdf_bytes = generate_pdf(1, 10 * 1024)
+    image = io.BytesIO()
+    Image.new('RGB', (200, 80), 'white').save(image, format='PNG')
+    encoded_image = base64.b64encode(image.getvalue()).decode('utf-8')
+    current_time = int(SIGNING_TIME.timestamp() * 1000)
+    return pdf_bytes, seal_pdf(pdf_bytes, seal_signer, current_time, 'firma1', STAMP, encoded_image)
+
+def _signature(pdf_bytes):
+    signatures = PdfFileReader(io.BytesIO(pdf_bytes)).embedded_signatures
+    assert len(signatures) == 1
+    return signatures[0]
+
+def _signed_attr(signature, name):
+    for attr in signature.signer_info['signed_attrs']:
+        if attr['type'].native == name:
+            return attr['values'][0]
+    return None
+
+def test_sealed_pdf_is_an_incremental_update(sealed):
+    pdf_bytes, sealed_pdf = sealed
+    assert sealed_pdf[:len(pdf_bytes)] == pdf_bytes
+
+def test_byte_range_covers_the_whole_file(sealed):
+    _, sealed_pdf = sealed
+    signature = _signature(sealed_pdf)
+    start, first_length, second_start, second_length = signature.byte_range
+    # Todo el archivo menos el hueco de /Contents
+    assert start == 0
+    assert second_start + second_length == len(sealed_pdf)
+    assert sealed_pdf[first_length:first_length + 1] == b'<'
+    assert sealed_pdf[second_start - 1:second_start] == b'>'
+
+def test_cms_digest_matches_signed_bytes(sealed):
+    _, sealed_pdf = sealed
+    signature = _signature(sealed_pdf)
+    start, first_length, second_start, second_length = signature.byte_range
+    digest = hashlib.sha256(sealed_pdf[start:start + first_length] + sealed_pdf[second_start:second_start + second_length]).digest()
+    assert _signed_attr(signature, 'message_digest').native == digest
+
+def test_pyhanko_validates_the_seal(sealed, seal_signer):
+    _, sealed_pdf = sealed
+    signature = _signature(sealed_pdf)
+    trust_root = load_cert_from_pemder(seal_signer.cert_path)
+    status = validate_pdf_signature(signature, ValidationContext(trust_roots=[trust_root]))
+    assert status.intact
+    assert status.valid
+    assert status.coverage == SignatureCoverageLevel.ENTIRE_FILE
+    assert signature.sig_object['/SubFilter'] == '/ETSI.CAdES.detached'
+    assert signature.self_reported_timestamp == SIGNING_TIME
+
+def test_seal_declares_the_role(sealed):
+    _, sealed_pdf = sealed
+    signer_attributes = _signed_attr(_signature(sealed_pdf), 'signer_attributes_v2')
+    assert signer_attributes is not None
+    claimed = signer_attributes['claimed_attributes'][0]
+    assert claimed.dump() == _claimed_role(STAMP).dump()
+    role_name = claimed['values'][0]['role_name']
+    assert role_name.name == 'uniform_resource_identifier'
+    assert role_name.chosen.contents == b'Juez de C%C3%A1mara'
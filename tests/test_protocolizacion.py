@@ -0,0 +1,155 @@
+# Descripcion: Un documento de cierre nunca recibe dos numeros por un reintento (protocolizacion + registro de cierres)
+import time
+import asyncio
+import threading
+
+import pytest
+
+import protocolizacion
+from protocolizacion import reserve_numbers, reserve_numbers_async, mark_close_failed, ProtocolBatchError
+from closing_ledger import FILL_FAILED
+from idempotency import IdempotencyCache, session_key, MISS, HIT
+from session_store import MemorySessionStore, new_session_id
+from signing_state import SigningState
+from b64codec import PdfPayload
+
+def _concurrently(count, target):
+    results = [None] * count
+    def run(index):
+        results[index] = target()
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_concurrent_retries_get_one_number(ledger, book):
+    book.latency = 0.1
+    results = _concurrently(3, lambda: reserve_numbers(['7']))
+    assert book.calls['7'] == 1
+    assert {result['7'].numero for result in results} == {1}
+
+def test_concurrent_retries_get_one_number_async(ledger, book):
+    book.latency = 0.1
+    async def main():
+        return await asyncio.gather(*(reserve_numbers_async(['7']) for _ in range(3)))
+    results = asyncio.run(main())
+    assert book.calls['7'] == 1
+    assert {result['7'].numero for result in results} == {1}
+
+def test_id_doc_with_other_json_type_is_the_same_document(ledger, book):
+    first = reserve_numbers([123])
+    again = reserve_numbers(['123'])
+    both = reserve_numbers([123, '123'])
+    assert sum(book.calls.values()) == 1
+    assert again['123'].numero == first[123].numero
+    assert both[123].numero == both['123'].numero == first[123].numero
+
+def test_retry_after_fill_failed_reuses_number(ledger, book):
+    first = reserve_numbers(['7', '8'])
+    mark_close_failed('7', 'PDF invalido')
+    retry = reserve_numbers(['7'])
+    assert book.calls['7'] == 1
+    assert retry['7'].numero == first['7'].numero
+    pending = {row['id_doc']: row for row in ledger.pending()}
+    assert pending['7']['status'] == FILL_FAILED
+    assert pending['7']['numero'] == first['7'].numero
+
+def test_claim_held_by_other_process_waits_and_reuses_its_number(ledger, book):
+    assert ledger.claim(['7'], 'otro-proceso')
+    results = []
+    thread = threading.Thread(target=lambda: results.append(reserve_numbers(['7'])))
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    # El otro proceso termina: registra su numero y libera el reclamo
+    ledger.record_reserved([('7', 41, '18/10/2026')])
+    ledger.release('otro-proceso')
+    thread.join(5)
+    assert results[0]['7'].numero == 41
+    assert book.calls['7'] == 0
+
+def test_expired_claim_is_taken_over(ledger, book):
+    ledger.claim_ttl = 0.2
+    assert ledger.claim(['7'], 'proceso-caido')
+    assert not ledger.claim(['7'], 'otro')
+    started = time.monotonic()
+    result = reserve_numbers(['7'])
+    assert time.monotonic() - started >= 0.1
+    assert result['7'].ok
+    assert book.calls['7'] == 1
+    # El reclamo tomado se libero al terminar
+    assert ledger.claim(['7'], 'otro')
+
+def test_claim_wait_is_bounded(ledger, book, monkeypatch):
+    monkeypatch.setattr(protocolizacion, 'CLOSING_CLAIM_WAIT', 0.1)
+    assert ledger.claim(['7'], 'otro-proceso')
+    try:
+        reserve_numbers(['7'])
+    except protocolizacion.PDFCloseError as e:
+        assert '7' in str(e)
+    else:
+        raise AssertionError("reserve_numbers no respeto CLOSING_CLAIM_WAIT")
+    assert book.calls['7'] == 0
+
+def test_replay_after_session_delete_returns_cached_pdf():
+    # Mismo flujo que /firma_valor: la sesion se borra al terminar y el reenvio usa session_key
+    store = MemorySessionStore()
+    cache = IdempotencyCache()
+    session_id = new_session_id()
+    store.put(session_id, SigningState(pdf_b64='JVBERi0=', id_doc=7))
+    calls = []
+
+    def finish():
+        state = store.get(session_id)
+        assert state is not None, "la sesion ya no existe"
+        calls.append(session_id)
+        store.delete(session_id)
+        return PdfPayload.from_bytes(b'%PDF-firmado'), state.id_doc
+
+    (pdf, id_doc), outcome = cache.run(session_key(session_id), finish)
+    assert outcome == MISS
+    assert store.get(session_id) is None
+    (replayed, replayed_id), outcome = cache.run(session_key(session_id), finish)
+    assert outcome == HIT
+    assert replayed is pdf and replayed_id == 7
+    assert len(calls) == 1
+
+def _reserve(mode, id_docs, all_or_nothing=False):
+    # El mismo pedido por el camino sincronico (WSGI) o el asincrono (ASGI)
+    if mode == 'async':
+        return asyncio.run(reserve_numbers_async(id_docs, all_or_nothing))
+    return reserve_numbers(id_docs, all_or_nothing)
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_document_without_number_is_reported_per_document(ledger, book, mode):
+    book.fail_ids = {'8'}
+    results = _reserve(mode, ['7', '8', '9'])
+    assert results['7'].ok and results['9'].ok
+    assert not results['8'].ok
+    assert set(ledger.lookup(['7', '8', '9'])) == {'7', '9'}
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_all_or_nothing_rolls_back_the_batch(ledger, book, mode):
+    book.fail_ids = {'8'}
+    with pytest.raises(ProtocolBatchError) as info:
+        _reserve(mode, ['7', '8'], all_or_nothing=True)
+    assert [r.id_doc for r in info.value.failed] == ['8']
+    assert ledger.lookup(['7', '8']) == {}
+    assert protocolizacion.db_breaker.stats()['successes'] == 1
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_failed_statement_falls_back_to_one_by_one(ledger, book, monkeypatch, mode):
+    result = book.result
+    def broken(id_doc):
+        if id_doc == '8':
+            raise ValueError("fila invalida")
+        return result(id_doc)
+    monkeypatch.setattr(book, 'result', broken)
+    results = _reserve(mode, ['7', '8', '9'])
+    # La sentencia conjunta se revirtio y cada documento se pidio en su propia transaccion
+    assert results['7'].ok and results['9'].ok
+    assert results['8'].error == "Error transaccion: fila invalida"
+    assert book.calls['7'] == 2
+    assert protocolizacion.lock_hold_stats.snapshot()['count'] >= 4
@@ -0,0 +1,28 @@
+# Descripcion: Encoders de los lotes en streaming (ZIP y multipart/mixed)
+import io
+import zipfile
+
+import pytest
+
+from b64codec import PdfPayload, count_document
+from responses import ZipBatchStream, MultipartBatchStream
+
+PDF = b'%PDF-1.7\n' + b'x' * 1000
+
+@pytest.mark.parametrize('encoder_class', [ZipBatchStream, MultipartBatchStream])
+def test_document_counts_one_copy(encoder_class):
+    # Los dos encoders copian el PDF una vez al armar la entrada o la parte
+    encoder = encoder_class()
+    pdf = PdfPayload.from_bytes(PDF)
+    with count_document() as counters:
+        encoder.document(0, pdf)
+    values = counters.snapshot()
+    assert values['copies'] == 1
+    assert values['copied_bytes'] == len(PDF)
+
+def test_zip_stream_is_a_valid_archive():
+    encoder = ZipBatchStream()
+    body = encoder.document(0, PdfPayload.from_bytes(PDF)) + encoder.error(1, "fallo") + encoder.done(False, 1)
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.read('0.pdf') == PDF
+        assert b'"fallo"' in archive.read(ZipBatchStream.manifest_name)